@@ -16,6 +16,10 @@
 
 __all__ = [
     "main",
+    "build",
+    "Session",
+    "era5grib_wrf",
+    "era5grib_um",
     "era5grib",
     "data_handling",
     "config",
@@ -26,13 +30,14 @@ __all__ = [
     "__version__"
     ]
 
-from .era5grib import (main,
-                       era5grib,
-                       data_handling,
-                       config,
-                       domain,
-                       logging,
-                       parallel,
-                       command_line)
+from . import (era5grib,
+               data_handling,
+               config,
+               domain,
+               logging,
+               parallel,
+               command_line)
+from .era5grib import build, era5grib_wrf, era5grib_um, main
+from .session import Session
 
 from ._version import __version__
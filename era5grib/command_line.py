@@ -1,16 +1,19 @@
 import argparse
 import f90nml
-import importlib
 import pandas
+import re
 import textwrap
 from logging import DEBUG
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, List, Mapping, Optional, Tuple, Union
 
-from . import domain
-from .config import conf
+from . import domain, output_drivers
+from . import sites as site_mode
+from .config import Era5gribConfig, RunContext
+from .data_handling import weights
 from .logging import die, log
 from .main import __doc__ as maindoc
+from .session import Session
 
 
 def handle_args(
@@ -18,7 +21,7 @@ def handle_args(
         file: Optional[str] = None,
         output: Optional[str] = None,
         namelist: Optional[str] = None,
-        geo: Optional[str] = None,
+        geo: Optional[Union[str, List[Path]]] = None,
         target: Optional[str] = None,
         time: Optional[str] = None,
         start: Optional[str] = None,
@@ -27,11 +30,24 @@ def handle_args(
         era5land: bool = True,
         polar: Optional[bool] = None,
         debug: Optional[bool] = False,
-        ) -> None:
+        progress: Optional[str] = None,
+        plan: bool = False,
+        extra_output: Optional[List[str]] = None,
+        sites: Optional[str] = None,
+        ) -> RunContext:
 
     # Cmdline > local conf > default conf
+    conf = Era5gribConfig()
     conf_path = Path(__file__).parent / 'config'
 
+    if isinstance(geo, (str, Path)):
+        geo = [geo]
+    nml_starts = None
+    nml_ends = None
+    max_dom = None
+    nml_interval = None
+    nested = []
+
     # Convert times to what we need first
     if time:
         time = pandas.to_datetime(time).floor('h')
@@ -56,26 +72,22 @@ def handle_args(
             output = "GRIBFILE.AAA"
 
         if namelist:
-            with open(namelist, 'r') as f:
-                nml = f90nml.read(f)
-                if start is None:
-                    start = pandas.to_datetime(nml["share"]["start_date"], format="%Y-%m-%d_%H:%M:%S")
-                    try:
-                        start = start.min()
-                    except AttributeError:
-                        pass
-                if end is None:
-                    end = pandas.to_datetime(nml["share"]["end_date"], format="%Y-%m-%d_%H:%M:%S")
-                    try:
-                        end = end.max()
-                    except AttributeError:
-                        pass
+            nml_starts, nml_ends, max_dom, nml_interval = read_namelist(namelist)
+            if start is None:
+                start = min(nml_starts)
+            else:
+                nml_starts = None
+            if end is None:
+                end = max(nml_ends)
+            else:
+                nml_ends = None
 
         if start is None:
             die("Please provide either 'start' or 'namelist' if 'wrf' is selected as a model")
 
-        if geo is not None:
-            conf.set('domain', domain.get_domain(Path(geo), polar))
+        if geo:
+            geo_files = find_geo_files(geo, max_dom)
+            nested = set_domain(conf, geo_files, polar)
         else:
             log.warning("Outputting the full domain, use --geo=geo_em.d01.nc to limit")
             conf.set('domain', domain.get_domain(None, polar))
@@ -98,7 +110,7 @@ def handle_args(
             start = time
 
         if target is not None:
-            conf.set('domain', domain.get_domain(Path(target), polar))
+            conf.set('domain', domain.get_domain(Path(target), polar, get_halos(conf)[0]))
         else:
             log.warning("Outputting the full domain, use --target=qrparm.mask to limit")
             conf.set('domain', domain.get_domain(None, polar))
@@ -113,30 +125,35 @@ def handle_args(
             conf.set('log_level', DEBUG)
         log.start(conf.get("log_level"))
 
+        if time:
+            start = time
+        elif namelist:
+            nml_starts, nml_ends, max_dom, nml_interval = read_namelist(namelist)
+            if start is None:
+                start = min(nml_starts)
+            else:
+                nml_starts = None
+            if end is None:
+                end = max(nml_ends)
+            else:
+                nml_ends = None
+
         if target is not None:
-            conf.set('domain', domain.get_domain(Path(target), polar))
-        elif geo is not None:
-            conf.set('domain', domain.get_domain(Path(geo), polar))
+            conf.set('domain', domain.get_domain(Path(target), polar, get_halos(conf)[0]))
+        elif geo:
+            geo_files = find_geo_files(geo, max_dom)
+            nested = set_domain(conf, geo_files, polar)
         else:
             conf.set('domain', domain.get_domain(None, polar))
 
-        if time:
-            start = time
-        elif namelist:
-            with open(namelist, 'r') as f:
-                nml = f90nml.read(f)
-                if start is None:
-                    start = pandas.to_datetime(nml["share"]["start_date"], format="%Y-%m-%d_%H:%M:%S")
-                    try:
-                        start = start.min()
-                    except AttributeError:
-                        pass
-                if end is None:
-                    end = pandas.to_datetime(nml["share"]["end_date"], format="%Y-%m-%d_%H:%M:%S")
-                    try:
-                        end = end.max()
-                    except AttributeError:
-                        pass
+    log.start_progress(progress or conf.get("progress"))
+
+    if sites is not None:
+        conf.set('sites', site_mode.read_sites(Path(sites)))
+    if conf.get('sites'):
+        if target is not None or geo:
+            die("Error! Sites cannot be combined with --target or --geo")
+        conf.set('domain', site_mode.site_domain(conf.get('sites')))
 
     if start is None:
         die("Either 'time', 'start' or 'namelist' must be provided in order to construct time bounds")
@@ -148,20 +165,35 @@ def handle_args(
     if output is None:
         log.warning(f"Output file name not specified, using out.{fmt}")
         output = 'out.' + fmt
-    try:
-        writer = importlib.import_module(f"era5grib.output_drivers.{fmt}").write
-    except ModuleNotFoundError:
-        die("Error! Invalid format specifier. A format must have a corresponding"
-            " python source file in output_drivers and contain a 'write' function")
-    except AttributeError:
-        die(f"Error! Output driver for {format} does not have a 'write' function")
+    outputs = get_outputs(conf, fmt, output, extra_output)
+    if conf.get('sites') and any(t["format"] != "netcdf" for t in outputs):
+        die("Error! Site time series can only be written in netcdf format")
 
     # Derived config
-    conf.set('writer', writer)
+    conf.set('outputs', outputs)
     conf.set('start', start)
     conf.set('end', end)
     conf.set('output', output)
-    conf.set('domain_with_buffer', domain.get_domain_with_buffer(*conf.get("domain")))
+    conf.set('output_interval', get_interval(conf, nml_interval))
+    if plan:
+        conf.set('plan', True)
+    if len(nested) > 1:
+        # Each nested domain gets its own trimmed output and time range
+        domains = []
+        for i, (geo_file, dom) in enumerate(zip(geo_files, nested)):
+            name = domain_name(geo_file, i)
+            domains.append({
+                "name": name,
+                "domain": dom,
+                "start": nml_starts[i] if nml_starts and i < len(nml_starts) else start,
+                "end": nml_ends[i] if nml_ends and i < len(nml_ends) else end,
+                "output": domain_output(output, name),
+                "outputs": [t | {"output": domain_output(t["output"], name)} for t in outputs],
+            })
+            if (domains[-1]["start"] - start) % pandas.Timedelta(hours=conf.get("output_interval")):
+                die(f"Start of nested domain {name} ({domains[-1]['start']}) is not a multiple of output_interval from {start}")
+            log.info(f"Nested domain {name}: {domains[-1]['start']} - {domains[-1]['end']} -> {domains[-1]['output']}")
+        conf.set('domains', domains)
 
     if polar is not None:
         conf.set("polar", polar)
@@ -171,14 +203,158 @@ def handle_args(
     log.info(conf.get("default_config"))
     log.info(conf.get("model_config"))
 
+    set_read_domain(conf)
+
+    return conf.freeze().replace({"session": Session()})
+
+
+def set_read_domain(conf: Era5gribConfig):
+    """
+    Check the fields and regridding options and set the regions to read
+    around conf's domain
+    """
     if not conf.get("fields"):
         die("No fields specified!")
 
     if conf.get("regrid") != 'era5' and conf.get("regrid_options") == "weight_file":
         die("ERROR: Weight file regridding option only supports regridding to 'era5'")
 
+    conf.set('domain_with_buffer', domain.get_domain_with_buffer(*conf.get("domain"), get_halos(conf)[1]))
+
+    if conf.get("regrid_options") == "weight_file":
+        # Only read the ERA5-Land points the weight file needs for this domain
+        conf.set('weight_file_domain', weights.source_domain(conf.get('domain_with_buffer')))
+
 
-def parse_args(in_args: List[str]) -> None:
+def read_namelist(namelist: Path) -> Tuple[List[pandas.Timestamp], List[pandas.Timestamp], int, Optional[int]]:
+    """
+    Return the per-domain start and end dates, max_dom and interval_seconds
+    from a WPS namelist
+    """
+    with open(namelist, 'r') as f:
+        nml = f90nml.read(f)
+
+    def to_dates(val) -> List[pandas.Timestamp]:
+        if isinstance(val, str):
+            val = [val]
+        return [pandas.to_datetime(v, format="%Y-%m-%d_%H:%M:%S") for v in val]
+
+    return (
+        to_dates(nml["share"]["start_date"]),
+        to_dates(nml["share"]["end_date"]),
+        nml["share"].get("max_dom", 1),
+        nml["share"].get("interval_seconds"),
+    )
+
+
+def get_interval(conf: Era5gribConfig, nml_interval: Optional[int]) -> int:
+    """
+    Return the output interval in hours. An output_interval in the
+    configuration takes precedence over interval_seconds from the namelist.
+    """
+    interval = conf.get("output_interval")
+    if interval is None and nml_interval is not None:
+        if nml_interval % 3600 != 0:
+            die(f"interval_seconds = {nml_interval} in namelist is not a whole number of hours")
+        interval = nml_interval // 3600
+        log.info(f"Using output interval of {interval} hours from namelist")
+    if interval is None:
+        return 1
+    if int(interval) != interval or interval < 1:
+        die(f"output_interval must be a whole number of hours, got {interval}")
+    return int(interval)
+
+
+def get_outputs(conf: Era5gribConfig, fmt: str, output: Union[str, Path], extra: Optional[List[str]]) -> List[Dict]:
+    """
+    The primary output followed by any extra targets from the 'outputs'
+    config key and --extra-output, each with the driver class for its format
+    """
+    targets = [{"format": fmt, "output": str(output)}]
+    for t in conf.get("outputs") or []:
+        if not isinstance(t, Mapping) or "format" not in t or "output" not in t:
+            die(f"Error! Entries in 'outputs' must have 'format' and 'output' keys, got {t}")
+        targets.append({"format": t["format"], "output": str(t["output"])})
+    for t in extra or []:
+        t_fmt, sep, t_out = t.partition(":")
+        if not sep or not t_out:
+            die(f"Error! --extra-output must be given as FORMAT:PATH, got {t}")
+        targets.append({"format": t_fmt, "output": t_out})
+
+    seen = set()
+    for t in targets:
+        if t["output"] in seen:
+            die(f"Error! Output {t['output']} is given more than once")
+        seen.add(t["output"])
+        t["driver"] = output_drivers.get_driver(t["format"])
+    if len(targets) > 1:
+        log.info("Writing " + ", ".join(f"{t['format']} to {t['output']}" for t in targets))
+    return targets
+
+
+def find_geo_files(geo: List[Path], max_dom: Optional[int]) -> List[Path]:
+    """
+    Expand a geogrid directory into its geo_em.d*.nc files, up to max_dom
+    """
+    if len(geo) == 1 and Path(geo[0]).is_dir():
+        geo_files = sorted(Path(geo[0]).glob("geo_em.d*.nc"))
+        if not geo_files:
+            die(f"No geo_em.d*.nc files found in {geo[0]}")
+        if max_dom:
+            geo_files = geo_files[:max_dom]
+        log.info(f"Found geogrid files: {[str(i) for i in geo_files]}")
+        return geo_files
+    return [Path(i) for i in geo]
+
+
+def set_domain(conf: Era5gribConfig, geo_files: List[Path], polar: Optional[bool]) -> List[Tuple[slice, domain.LonRange]]:
+    """
+    Set the domain to read from one or more geogrid files. For multiple files
+    the union of all domains is read, and the individual domains are returned.
+    """
+    halo, _ = get_halos(conf)
+    if len(geo_files) == 1:
+        conf.set('domain', domain.get_domain(geo_files[0], polar, halo))
+        return []
+    union, nested = domain.get_union_domain(geo_files, polar, halo)
+    conf.set('domain', union)
+    return nested
+
+
+def get_halos(conf: Era5gribConfig) -> Tuple[float, float]:
+    """
+    Return the halo in degrees around the model grid (output points needed by
+    the model's own interpolation) and around the output domain (source points
+    needed by the regridding stencil)
+    """
+    spacings = [conf.get(f"catalogue_flags.{c}.grid_spacing") for c in conf.get("catalogues")]
+    spacings = [i for i in spacings if i is not None]
+    if not spacings:
+        # Unknown grids, fall back to a degree each
+        return 1.0, 1.0
+    target_spacing = conf.get(f"catalogue_flags.{conf.get('regrid')}.grid_spacing") or max(spacings)
+    domain_halo = conf.get("halo_cells", 2) * target_spacing
+    buffer_halo = domain.stencil_cells(conf.get("regrid_method", "bilinear")) * max(spacings)
+    log.info(f"Halo: {domain_halo} degrees around target, {buffer_halo} degrees for regridding")
+    return domain_halo, buffer_halo
+
+
+def domain_name(geo_file: Path, i: int) -> str:
+    m = re.search(r"\.(d\d+)\.", Path(geo_file).name)
+    if m:
+        return m.group(1)
+    return f"d{i + 1:02d}"
+
+
+def domain_output(output: Union[str, Path], name: str) -> str:
+    output = str(output)
+    if "{domain}" in output:
+        # Other fields (e.g. shard names) are filled in later
+        return output.replace("{domain}", name)
+    return f"{output}.{name}"
+
+
+def parse_args(in_args: List[str]) -> RunContext:
     f = argparse.RawDescriptionHelpFormatter
     parser = argparse.ArgumentParser(
         description=textwrap.dedent(maindoc), formatter_class=f
@@ -190,13 +366,30 @@ def parse_args(in_args: List[str]) -> None:
     parser.add_argument("--time", help="Output time", type=pandas.to_datetime)
     parser.add_argument("--start", help="Output start time", type=pandas.to_datetime)
     parser.add_argument("--end", help="Output end time", type=pandas.to_datetime)
-    parser.add_argument("--geo", help="Geogrid file for trimming (e.g. geo_em.d01.nc)", type=Path)
+    parser.add_argument(
+        "--geo",
+        help="Geogrid file(s) for trimming (e.g. geo_em.d01.nc), or a directory containing geo_em.d*.nc files",
+        type=Path,
+        nargs="+",
+    )
     parser.add_argument("--target", help="UM file on the target grid for trimming (e.g. qrparm.mask)", type=Path)
     parser.add_argument("--format", help="Output format", choices=["grib", "netcdf"], default="grib")
     parser.add_argument("--era5land", help="Use era5land over land", action=argparse.BooleanOptionalAction, default=True)
     parser.add_argument("--polar", help="Include all longitudes", action=argparse.BooleanOptionalAction)
     parser.add_argument("--debug", help="Debug output", action="store_true")
+    parser.add_argument("--plan", help="Print the files that would be read and resource estimates, then exit", action="store_true")
+    parser.add_argument(
+        "--sites",
+        help="CSV file of name,latitude,longitude sites to extract time series at, instead of a gridded domain",
+        type=Path,
+    )
+    parser.add_argument(
+        "--extra-output",
+        help="Additional output written from the same computation, as FORMAT:PATH (e.g. netcdf:out.nc). May be repeated",
+        action="append",
+    )
+    parser.add_argument("--progress", help="Write JSON lines progress events to a file, '-' for stdout or 'fd:N' for a file descriptor")
 
     ns = parser.parse_args(in_args)
 
-    handle_args(**vars(ns))
+    return handle_args(**vars(ns))
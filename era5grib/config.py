@@ -1,6 +1,7 @@
 from pathlib import Path
 import yaml
-from typing import Any, Union
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Optional, Union
 from .logging import log, die
 import pandas
 from .conftree import ConfTree
@@ -12,6 +13,131 @@ except NameError:
     die("Could not determine path to this file")
 
 
+def _freeze(value: Any) -> Any:
+    # Make nested config values read-only so a RunContext can be shared between threads
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _thaw(value: Any) -> Any:
+    # Structural copy only - leaf values (timestamps, slices, drivers) are shared
+    if isinstance(value, Mapping):
+        return {k: _thaw(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_thaw(v) for v in value]
+    return value
+
+
+def _flatten(d: Mapping[str, Any], prefix: str = "") -> Dict[str, Any]:
+    out = {}
+    for k, v in d.items():
+        key = f"{prefix}{k}"
+        out[key] = _freeze(v)
+        if isinstance(v, Mapping):
+            out.update(_flatten(v, f"{key}."))
+    return out
+
+
+def calc_time_range(
+    start_time: Optional[pandas.Timestamp], end_time: Optional[pandas.Timestamp], interval: int = 1
+) -> pandas.DatetimeIndex:
+    if start_time is None or end_time is None:
+        die("Simulation time has not been correctly set")
+    return pandas.date_range(start_time, end_time, freq=f"{interval}h")
+
+
+def calc_month_range(start_time: Optional[pandas.Timestamp], end_time: Optional[pandas.Timestamp]) -> pandas.DatetimeIndex:
+    if start_time is None or end_time is None:
+        die("Simulation time has not been correctly set")
+    start_time = pandas.offsets.MonthBegin().rollback(start_time.date())
+    end_time = pandas.offsets.MonthEnd().rollforward(end_time.date())
+    return pandas.date_range(start_time, end_time, freq="ME")
+
+
+class RunContext:
+    """
+    Immutable, flattened snapshot of an era5grib configuration. Every dotted key
+    (e.g. ``catalogue_flags.era5.grid_spacing``) is resolved once on construction, so
+    lookups are a single dict access. A RunContext is passed explicitly through
+    the read, combine and write stages so that several conversions can run in
+    the same process. The state of the build it describes (open files, shared
+    weights, caches) is held by the Session under the ``session`` key.
+    """
+
+    __slots__ = ("_tree", "_flat")
+
+    def __init__(self, tree: Mapping[str, Any]):
+        tree = _thaw(tree)
+        # Derived time ranges are part of the snapshot
+        if tree.get("start") is not None:
+            if tree.get("time_range") is None:
+                tree["time_range"] = calc_time_range(tree.get("start"), tree.get("end"), tree.get("output_interval") or 1)
+            if tree.get("month_range") is None:
+                tree["month_range"] = calc_month_range(tree.get("start"), tree.get("end"))
+        object.__setattr__(self, "_tree", tree)
+        object.__setattr__(self, "_flat", MappingProxyType(_flatten(tree)))
+
+    def __setattr__(self, key: str, value: Any):
+        raise AttributeError("RunContext is immutable, use replace() to derive a new context")
+
+    def __contains__(self, item: Any) -> bool:
+        return self._flat.get(item) is not None
+
+    def __getitem__(self, key: str) -> Any:
+        out = self._flat.get(key)
+        if out is None:
+            raise KeyError(key)
+        return out
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self._flat.get(key, default)
+
+    @property
+    def session(self) -> Any:
+        s = self._flat.get("session")
+        if s is None:
+            die("Error! No era5grib session in the run context")
+        return s
+
+    def get_time_range(self) -> pandas.DatetimeIndex:
+        dr = self._flat.get("time_range")
+        if dr is None:
+            die("Simulation time has not been correctly set")
+        return dr
+
+    def get_month_range(self) -> pandas.DatetimeIndex:
+        mr = self._flat.get("month_range")
+        if mr is None:
+            die("Simulation time has not been correctly set")
+        return mr
+
+    def to_dict(self) -> Dict[str, Any]:
+        return _thaw(self._tree)
+
+    def replace(self, updates: Mapping[str, Any]) -> "RunContext":
+        """
+        Return a new context with the dotted keys in ``updates`` set. Derived
+        time ranges are recalculated if the start or end time or the output
+        interval changes.
+        """
+        tree = self.to_dict()
+        for key, val in updates.items():
+            k_arr = key.split(".")
+            node = tree
+            for k in k_arr[:-1]:
+                if not isinstance(node.get(k), dict):
+                    node[k] = {}
+                node = node[k]
+            node[k_arr[-1]] = _thaw(val)
+        if "start" in updates or "end" in updates or "output_interval" in updates:
+            tree.pop("time_range", None)
+            tree.pop("month_range", None)
+        return RunContext(tree)
+
+
 class Era5gribConfig:
     def __init__(self):
         # First, read in global conf
@@ -26,14 +152,18 @@ class Era5gribConfig:
             return False
         return True
 
-    def update(self, infile: Union[str, Path]):
-        if infile in _known_configs:
-            p = _p.parent / "config" / f"{infile}.yaml"
+    def update(self, infile: Union[str, Path, Mapping[str, Any]]):
+        if isinstance(infile, Mapping):
+            # Already loaded configuration
+            out = _thaw(infile)
         else:
-            p = Path(infile)
-        if not p.is_file():
-            die(f"Model configuration: {infile} does not exist")
-        out = self.read_yaml(p)
+            if infile in _known_configs:
+                p = _p.parent / "config" / f"{infile}.yaml"
+            else:
+                p = Path(infile)
+            if not p.is_file():
+                die(f"Model configuration: {infile} does not exist")
+            out = self.read_yaml(p)
         # Any includes?
         if "includes" in out:
             self.update(out["includes"])
@@ -74,11 +204,7 @@ class Era5gribConfig:
             return dr
 
         log.info("Calculating time range")
-        start_time = self.get("start", None)
-        end_time = self.get("end", None)
-        if start_time is None or end_time is None:
-            die("Simulation time has not been correctly set")
-        dr = pandas.date_range(start_time, end_time, freq="h")
+        dr = calc_time_range(self.get("start", None), self.get("end", None), self.get("output_interval") or 1)
         self.set("time_range", dr)
         return dr
 
@@ -88,13 +214,7 @@ class Era5gribConfig:
             return mr
 
         log.info("Calculating ERA5 month range")
-        start_time = self.get("start", None)
-        end_time = self.get("end", None)
-        if start_time is None or end_time is None:
-            die("Simulation time has not been correctly set")
-        start_time = pandas.offsets.MonthBegin().rollback(start_time.date())
-        end_time = pandas.offsets.MonthEnd().rollforward(end_time.date())
-        mr = pandas.date_range(start_time, end_time, freq="ME")
+        mr = calc_month_range(self.get("start", None), self.get("end", None))
         self.set("month_range", mr)
         return mr
 
@@ -111,5 +231,8 @@ class Era5gribConfig:
         # Deep-copy original config
         self._combined_config = ConfTree.from_dict(self.default_config.to_dict())
 
-
-conf = Era5gribConfig()
+    def freeze(self) -> RunContext:
+        """
+        Snapshot the combined configuration into an immutable RunContext
+        """
+        return RunContext(self._combined_config.to_dict())
@@ -0,0 +1,147 @@
+import xarray as xr
+from dask.distributed import get_client
+from dask.utils import parse_bytes
+from pandas import Timestamp
+from typing import Dict, Optional, Tuple
+
+from ..config import RunContext
+from ..domain import LonRange, is_split, select
+from ..logging import log
+from . import file_pool
+from .xarray_legacy_read import open_kwargs
+
+_default_budget = 128 * 2**20
+# Several copies of each chunk are in flight (raw, decoded, regridded, merged)
+_budget_fraction = 8
+_bytes_per_value = 4
+
+
+
+def memory_budget(ctx: RunContext) -> int:
+    """
+    Target size in bytes of a single chunk
+    """
+    if ctx.get("chunk_memory") is not None:
+        return parse_bytes(str(ctx.get("chunk_memory")))
+    try:
+        client = get_client()
+    except ValueError:
+        return _default_budget
+    limits = [w["memory_limit"] for w in client.scheduler_info()["workers"].values() if w.get("memory_limit")]
+    if not limits:
+        return _default_budget
+    return int(min(limits)) // _budget_fraction
+
+
+def domain_points(domain: Tuple[slice, LonRange], spacing: float) -> int:
+    lat_range, lon_range = domain
+    lat_max = 90.0 if lat_range.start is None else lat_range.start
+    lat_min = -90.0 if lat_range.stop is None else lat_range.stop
+    nlat = int((lat_max - lat_min) / spacing) + 1
+
+    lon_ranges = lon_range if is_split(lon_range) else (lon_range,)
+    nlon = 0
+    for r in lon_ranges:
+        lon_min = 0.0 if r.start is None else r.start
+        lon_max = 360.0 - spacing if r.stop is None else r.stop
+        nlon += int((lon_max - lon_min) / spacing) + 1
+    return nlat * nlon
+
+
+def time_chunk(ctx: RunContext, t: Timestamp, budget: int) -> int:
+    """
+    Time chunk shared by every catalogue for the month ending at t
+    """
+    tr = ctx.get_time_range()
+    n_t = max(1, int(((tr.year == t.year) & (tr.month == t.month)).sum()))
+
+    # Size a single time step on the finest grid we'll read
+    spacings = [ctx.get(f"catalogue_flags.{c}.grid_spacing") for c in ctx.get("catalogues")]
+    spacing = min([i for i in spacings if i is not None] or [0.25])
+    domains = [ctx.get("domain_with_buffer")]
+    if ctx.get("weight_file_domain") is not None:
+        domains.append(ctx.get("weight_file_domain"))
+    points = max(domain_points(d, spacing) for d in domains)
+
+    return max(1, min(n_t, budget // (points * _bytes_per_value)))
+
+
+def disk_layout(ctx: RunContext, cat_name: str, dataset: str, path: str) -> Tuple[Dict[str, int], Dict[str, int], xr.Dataset]:
+    """
+    Return the sizes, on-disk chunk sizes and horizontal coordinates of the
+    first variable in a file. Only metadata is read and the result is cached
+    for each catalogue and dataset until the dataset being built is done.
+    """
+    key = (cat_name, dataset)
+    session = ctx.session
+    with session.lock:
+        if key in session.layouts:
+            return session.layouts[key]
+    # The same file is about to be read, so keep it open
+    ds = file_pool.open_dataset(ctx, path, **open_kwargs(ctx))
+    da = next(ds[v] for v in ds.data_vars if "time" in ds[v].dims)
+    disk_chunks = dict(zip(da.dims, da.encoding.get("chunksizes") or da.encoding.get("chunks") or da.shape))
+    sizes = dict(da.sizes)
+    coords = xr.Dataset(coords={"latitude": ds.latitude.values, "longitude": ds.longitude.values})
+    with session.lock:
+        session.layouts[key] = (sizes, disk_chunks, coords)
+    return sizes, disk_chunks, coords
+
+
+def plan_chunks(
+    ctx: RunContext,
+    cat_name: str,
+    dataset: str,
+    path: str,
+    t: Timestamp,
+    read_domain: Tuple[slice, LonRange],
+    n_levels: Optional[int] = None,
+) -> Dict[str, int]:
+    """
+    Pick read chunks for a catalogue search result from the requested time
+    range, the region being read and the memory available to each worker.
+
+    The time chunk is the same for every catalogue in a given month, so
+    fields from different catalogues line up when they are merged and never
+    need rechunking, rounded down to a multiple of the on-disk time chunk
+    (and no less than one) so no disk chunk is decompressed twice. The trimmed horizontal domain is read whole (except
+    for site extraction, which follows the on-disk chunks), and levels
+    are only split when a chunk would otherwise exceed the budget, in
+    multiples of the on-disk chunk size. n_levels is the number of levels
+    that will be selected, if not all of them.
+    """
+    budget = memory_budget(ctx)
+    sizes, disk_chunks, coords = disk_layout(ctx, cat_name, dataset, path)
+
+    # Size of a single time step and level once trimmed to the domain
+    coords = select(coords, *read_domain)
+    points = max(1, coords.sizes["latitude"] * coords.sizes["longitude"])
+
+    n_t = time_chunk(ctx, t, budget)
+    disk_t = disk_chunks.get("time", 1)
+    chunks = {"time": max(disk_t, n_t // disk_t * disk_t), "latitude": -1, "longitude": -1}
+    if ctx.get("sites"):
+        # Only the points around each site are indexed, so follow the disk
+        # chunks and only the chunks holding sites are read
+        for d in ("latitude", "longitude"):
+            if disk_chunks.get(d, sizes[d]) < sizes[d]:
+                chunks[d] = disk_chunks[d]
+    if "level" in sizes:
+        n_lev = min(sizes["level"], n_levels or sizes["level"])
+        lev = max(1, min(n_lev, budget // (chunks["time"] * points * _bytes_per_value)))
+        disk_lev = disk_chunks.get("level", 1)
+        if lev < n_lev and lev >= disk_lev:
+            lev = (lev // disk_lev) * disk_lev
+        chunks["level"] = lev
+
+    log.debug(f"Planned chunks for {cat_name}/{dataset}: {chunks} (budget {budget} bytes, disk chunks {disk_chunks})")
+    return chunks
+
+
+def custom_field_chunks(ctx: RunContext, da: xr.DataArray) -> Dict[str, int]:
+    """
+    Chunks for a time-varying custom field already trimmed to the domain
+    """
+    points = max(1, da.sizes["latitude"] * da.sizes["longitude"])
+    n_t = max(1, min(da.sizes["time"], memory_budget(ctx) // (points * _bytes_per_value)))
+    return {"time": n_t, "latitude": -1, "longitude": -1}
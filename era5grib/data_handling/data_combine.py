@@ -1,15 +1,24 @@
+import numpy as np
 import xarray as xr
-import xesmf
 from collections import OrderedDict
 from pandas import Timestamp
-from pathlib import Path
-from typing import Dict, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 
-from ..config import conf
+from ..config import RunContext
 from ..logging import die, log
+from ..parallel import SharedObjects
+from ..sites import SiteInterpolator
 from .data_read import get_single_field
+from . import chunking, weights
 from .era5field import Era5field
 from .grib_metadata import Paramdb
+from .rectilinear import RectilinearRegridder
+from .sparse_regridder import SparseRegridder
+
+_horizontal = ("latitude", "longitude")
+# Stacked chunks may be this many times the chunk memory budget, the
+# regridded chunks are no larger than the source ones
+_batch_fraction = 4
 
 
 class InterpolatingRegridder:
@@ -21,10 +30,21 @@ class InterpolatingRegridder:
     NaN corner points with field average and calls interpolate_na twice on each
     field, vertically then horizontally on one, and reversed on the other. The final
     field is given by averaging the two filled fields, then interpolated.
+
+    The interpolation itself is done by xesmf, or by the built-in
+    RectilinearRegridder if engine is 'rectilinear'. The weights are shared
+    with the workers through shared.
     """
 
-    def __init__(self, *args, **kwargs):
-        self.regridder = xesmf.Regridder(*args, **kwargs)
+    def __init__(self, *args, engine: str = "xesmf", shared: Optional[SharedObjects] = None, **kwargs):
+        if engine == "rectilinear":
+            self.regridder = RectilinearRegridder(*args, shared=shared, **kwargs)
+        else:
+            # Importing ESMF is slow, only do it if we have to
+            import xesmf
+
+            # Only keep the weights, so they can be shared with the workers
+            self.regridder = SparseRegridder.from_xesmf(xesmf.Regridder(*args, **kwargs), args[1], shared)
 
     def __call__(self, field):
         # Set corners to field mean if they're NaN
@@ -49,18 +69,34 @@ class InterpolatingRegridder:
         return self.regridder((lat_first + lon_first) / 2)
 
 
-def merge_fields_in_time(fields: Dict[Timestamp, Dict[Tuple[str, str], Era5field]]) -> Dict[Tuple[str, str], Era5field]:
-    custom_fields = [i for i in conf.get("custom_fields", {}).values()]
-    static_fields = conf.get("static", {})
+def select_times(ctx: RunContext, da: xr.DataArray, field_name: str) -> xr.DataArray:
+    """
+    The time steps of the run in the month da was read for, dying if any
+    of them are missing
+    """
+    tr = ctx.get_time_range()
+    t0 = da.indexes["time"][0]
+    tr = tr[(tr.year == t0.year) & (tr.month == t0.month)]
+    try:
+        return da.sel(time=tr)
+    except KeyError:
+        missing = tr.difference(da.indexes["time"])
+        die(f"Error! {len(missing)} time steps from {missing[0]} to {missing[-1]} are missing from {field_name}"
+            f" in {da.attrs['source']}")
+
+
+def merge_fields_in_time(ctx: RunContext, fields: Dict[Timestamp, Dict[Tuple[str, str], Era5field]]) -> Dict[Tuple[str, str], Era5field]:
+    custom_fields = [i for i in ctx.get("custom_fields", {}).values()]
+    static_fields = ctx.get("static", {})
 
     fields_to_merge = OrderedDict()
 
-    ts = conf.get_month_range()[0]
+    ts = ctx.get_month_range()[0]
     d = fields[ts]
 
     for (field_name, ds), field in d.items():
         key = (field_name, ds)
-        fields_to_merge[key] = Era5field(field_name)
+        fields_to_merge[key] = Era5field(field_name, ctx)
         for realm, da in field.get_dataarrays():
             if realm in fields_to_merge[key]:
                 die(f"Error: Multiple definition of {field_name} on {realm}")
@@ -70,23 +106,23 @@ def merge_fields_in_time(fields: Dict[Timestamp, Dict[Tuple[str, str], Era5field
                     # Already handled
                     fields_to_merge[key].add_dataarray(da, realm)
                 else:
-                    fields_to_merge[key].add_dataarray(da.expand_dims({"time": conf.get_time_range()}), realm)
+                    fields_to_merge[key].add_dataarray(da.expand_dims({"time": ctx.get_time_range()}), realm)
                 continue
             # if ds in static_fields:
             # if field_name in static_fields[ds]:
-            if conf.get(f"static.{ds}.{field_name}") is not None:
+            if ctx.get(f"static.{ds}.{field_name}") is not None:
                 # Static field - only include first timestep
-                fields_to_merge[key].add_dataarray(da.sel(time=conf.get("start")), realm)
+                fields_to_merge[key].add_dataarray(da.sel(time=ctx.get("start")), realm)
                 continue
-            fields_to_merge[key].add_dataarray(da.sel(time=conf.get_time_range()), realm)
+            fields_to_merge[key].add_dataarray(select_times(ctx, da, field_name), realm)
 
-    for ts in conf.get_month_range()[1:]:
+    for ts in ctx.get_month_range()[1:]:
         for (field_name, ds), field in fields[ts].items():
             key = (field_name, ds)
             if key not in fields_to_merge:
                 die(
                     f"Error: {key} in timestamp {ts} of catalogue search results"
-                    f", but not in first timestep {conf.get_month_range()[0]}"
+                    f", but not in first timestep {ctx.get_month_range()[0]}"
                 )
             for realm, da in field.get_dataarrays():
                 if da.attrs["source"] in custom_fields:
@@ -97,9 +133,9 @@ def merge_fields_in_time(fields: Dict[Timestamp, Dict[Tuple[str, str], Era5field
                 if realm not in fields_to_merge[key]:
                     die(
                         f"Error: {key} on {realm} in timestamp {ts} of catalogue"
-                        f" search results but not in first timestep {conf.get_month_range()[0]}"
+                        f" search results but not in first timestep {ctx.get_month_range()[0]}"
                     )
-                fields_to_merge[key].concat_dataarray(da.sel(conf.get_time_range()), realm)
+                fields_to_merge[key].concat_dataarray(select_times(ctx, da, field_name), realm)
 
     # Sanity checks - all timestemps need to have the exact same number of
     # variables and the same number of data arrays for each variable
@@ -129,12 +165,22 @@ def merge_fields_in_time(fields: Dict[Timestamp, Dict[Tuple[str, str], Era5field
     return fields_to_merge
 
 
-def handle_regridding(fields: Dict[Tuple[str, str], Era5field]) -> None:
+def handle_regridding(ctx: RunContext, fields: Dict[Tuple[str, str], Era5field]) -> None:
     # Now regrid if necessary
-    regrid_options = conf.get("regrid_options")
-    regrid = conf.get("regrid")
+    regrid_options = ctx.get("regrid_options")
+    regrid = ctx.get("regrid")
     example_das = {}
     regridders = {}
+
+    if ctx.get("sites"):
+        # Every source is interpolated straight to the sites instead
+        for field in fields.values():
+            for _, da in field.get_dataarrays():
+                if da.attrs["source"] not in regridders:
+                    regridders[da.attrs["source"]] = SiteInterpolator(ctx.get("sites"))
+        apply_regridders(ctx, fields, regridders)
+        return
+
     for field in fields.values():
         for _, da in field.get_dataarrays():
             if da.attrs["source"] not in example_das:
@@ -150,14 +196,14 @@ def handle_regridding(fields: Dict[Tuple[str, str], Era5field]) -> None:
         target_da = example_das[regrid]
     else:
         # Regridding to unloaded data array
-        # regrid_params = conf.get("regridding") or {}
-        ref_field = conf.get("regrid_params.ref_field")
-        ref_date = conf.get("regrid_params.ref_date")
+        # regrid_params = ctx.get("regridding") or {}
+        ref_field = ctx.get("regrid_params.ref_field")
+        ref_date = ctx.get("regrid_params.ref_date")
         # if "ref_field" not in regrid_params or "ref_date" not in regrid_params:
         if ref_field is None or ref_date is None:
             die("Regridding to unloaded dataarray requested, but regridding parameters "
                 "'ref_field' and 'ref_date' are not set")
-        target_da = get_single_field(ref_field, regrid, Timestamp(ref_date))
+        target_da = get_single_field(ctx, ref_field, regrid, Timestamp(ref_date))
     if target_da is None:
         die(f"Could not find unloaded dataarray to regrid to: {ref_field}")
 
@@ -174,68 +220,124 @@ def handle_regridding(fields: Dict[Tuple[str, str], Era5field]) -> None:
             if regrid is None:
                 die(f"Error! Regridding not specified and field {da.name} has mismatching grid")
             if regrid_options == "weight_file":
-                weight_file = str(Path(__file__).parent.parent / "nci_regrid_weights.nc")
-                regridders[source] = xesmf.Regridder(
+                # Special case, can only regrid from era5land -> era5
+                if not weights.is_source_grid(da) or not np.isclose(weights.grid_spacing(target_da), weights.TARGET_SPACING):
+                    die("ERROR: weight_file regridding option can only be used to regrid from era5land to era5")
+                regridders[source] = weights.subset_regridder(da, target_da, ctx.session.shared)
+            else:
+                regridders[source] = InterpolatingRegridder(
                     da.to_dataset(),
                     target_da.to_dataset(),
-                    "bilinear",
-                    filename=weight_file,
-                    reuse_weights=True,
+                    ctx.get("regrid_method", "bilinear"),
+                    engine="rectilinear" if regrid_options == "rectilinear" else "xesmf",
+                    shared=ctx.session.shared,
                 )
-            else:
-                regridders[source] = InterpolatingRegridder(da.to_dataset(), target_da.to_dataset(), "bilinear")
-
-    if regrid_options == "weight_file":
-        # Special case, can only regrid from era5land -> era5
-        for source, regridder in regridders.items():
-            if regridder is not None:
-                if (len(example_das[source].latitude) != 1801 or len(example_das[source].longitude) != 3600):
-                    die("ERROR: weight_file regridding option can only be used to regrid from era5land to era5")
 
     if regrid:
-        for field in fields.values():
-            for realm, da in field.get_dataarrays():
+        apply_regridders(ctx, fields, regridders)
+
+
+def apply_regridders(ctx: RunContext, fields: Dict[Tuple[str, str], Era5field], regridders: Dict[str, Callable]) -> None:
+    batched = batch_regrid(ctx, fields, regridders)
+    for field in fields.values():
+        for realm, da in field.get_dataarrays():
+            if (id(field), realm) not in batched:
                 field.set_regridder(realm, regridders[da.attrs["source"]])
-            field.regrid()
+        field.regrid()
 
 
-def combine(fields: Dict[Timestamp, Dict[Tuple[str, str], Era5field]]) -> xr.Dataset:
+def batch_regrid(ctx: RunContext, fields: Dict[Tuple[str, str], Era5field], regridders: Dict[str, Callable]) -> set:
+    """
+    Regrid the data arrays that share a regridder and have the same shape
+    together, stacked along a 'variable' dimension, so every chunk of the
+    stack is a single sparse matmul with the same weights instead of one per
+    field. The results are split back out into their fields. Returns the
+    (id(field), realm) pairs that were regridded.
+    """
+    groups: Dict[Tuple, List[Tuple[Era5field, str, xr.DataArray]]] = OrderedDict()
+    for field in fields.values():
+        for realm, da in field.get_dataarrays():
+            regridder = regridders[da.attrs["source"]]
+            if regridder is None:
+                continue
+            shape = tuple((d, da.sizes[d]) for d in da.dims if d not in _horizontal)
+            groups.setdefault((id(regridder), shape, da.dtype), []).append((field, realm, da))
+
+    budget = chunking.memory_budget(ctx)
+    done = set()
+    for members in groups.values():
+        if len(members) < 2:
+            continue
+        first = members[0][2]
+        regridder = regridders[first.attrs["source"]]
+
+        # Only the horizontal grid is shared, the other coordinates (e.g. levels) are put back afterwards
+        stacked = xr.concat(
+            [da.reset_coords(drop=True).drop_vars([d for d in da.dims if d not in _horizontal and d in da.coords])
+             for _, _, da in members],
+            dim="variable",
+            join="override",
+            combine_attrs="drop",
+        )
+        if first.chunks:
+            member_bytes = first.dtype.itemsize
+            for d, c in zip(first.dims, first.chunks):
+                member_bytes *= first.sizes[d] if d in _horizontal else c[0]
+            per_chunk = max(1, budget * _batch_fraction // member_bytes)
+            stacked = stacked.chunk({"variable": min(per_chunk, len(members))})
+        log.debug(f"Regridding {len(members)} fields from {first.attrs['source']} together")
+
+        out = regridder(stacked)
+        for i, (field, realm, da) in enumerate(members):
+            regridded = out.isel(variable=i, drop=True)
+            regridded = regridded.assign_coords({k: v for k, v in da.coords.items() if not set(v.dims) & set(_horizontal)})
+            regridded.name = da.name
+            regridded.attrs = da.attrs
+            field.data_arrays[realm] = regridded.transpose(*[d for d in da.dims if d not in _horizontal], ...)
+            field.set_regridder(realm, None)
+            done.add((id(field), realm))
+    return done
+
+
+def combine(ctx: RunContext, fields: Dict[Timestamp, Dict[Tuple[str, str], Era5field]]) -> xr.Dataset:
     """
     This function takes a list of Dict of Era5field objects. Each dict kv
     pair corresponds to a month of ERA5 data. Custom data
     can have no time dimension or can contain every timestep in the model
     Therefore, custom data only needs to be dealt with on the first month
     """
-    regrid = conf.get("regrid")
+    regrid = ctx.get("regrid")
 
-    fields_to_merge = merge_fields_in_time(fields)
-    handle_regridding(fields_to_merge)
+    fields_to_merge = merge_fields_in_time(ctx, fields)
+    handle_regridding(ctx, fields_to_merge)
 
-    # land_masks = conf.get('land-mask') or {}
+    # land_masks = ctx.get('land-mask') or {}
     # Don't need a landmask if there is no merging to do
     if all([len(i) == 1 for i in fields_to_merge.values()]):
         log.info("No merging required")
         land_mask_da = None
     else:
         log.info("Retrieving landmask for field merging")
-        if conf.get("land-mask") is None:
+        if ctx.get("land-mask") is None:
             die("Error! DataArray merge is required and no land mask has been specified")
         if regrid:
-            land_mask_name = conf.get(f"land-mask.{regrid}")
+            land_mask_name = ctx.get(f"land-mask.{regrid}")
             log.debug(f"Regridding required - using {land_mask_name} from land-mask.{regrid}")
             # if regrid in land_masks:
             #    land_mask_name = land_masks[regrid]
         else:
             log.debug("Not regridding - looking for first land-mask field")
-            land_mask_name = [i for i in conf.get("land-mask").values()][0]
+            land_mask_name = [i for i in ctx.get("land-mask").values()][0]
         if (land_mask_name, "single-levels") in fields_to_merge:
             _, land_mask_da = next(fields_to_merge[(land_mask_name, "single-levels")].get_dataarrays())
         else:
             # Need to load a field
             land_mask_source = (regrid or [i for i in fields_to_merge.values()][0].attrs["source"])
-            land_mask_da = get_single_field(land_mask_name, land_mask_source, conf.get("start"))
+            land_mask_da = get_single_field(ctx, land_mask_name, land_mask_source, ctx.get("start"))
         if land_mask_da is None:
             die("Unable to recover landmask for merging dataarrays")
+        if ctx.get("sites") and "latitude" in land_mask_da.dims:
+            land_mask_da = SiteInterpolator(ctx.get("sites"))(land_mask_da)
 
     # Run merge on everything though, as it does do nothing for
     # era5fields with a single dataarray
@@ -245,7 +347,7 @@ def combine(fields: Dict[Timestamp, Dict[Tuple[str, str], Era5field]]) -> xr.Dat
     ds = xr.merge([v.get_merged_field() for v in fields_to_merge.values()])
 
     # Add grib metadata here
-    grib_params = Paramdb()
+    grib_params = Paramdb(ctx)
     for k in ds:
         ds[k].attrs |= grib_params(k)
 
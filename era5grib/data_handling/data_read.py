@@ -1,18 +1,26 @@
 import intake
 import intake_esm
+import os
 import xarray as xr
 from collections import OrderedDict, namedtuple
-from pandas import Timestamp
-from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+from concurrent.futures import Future, ThreadPoolExecutor
+from pandas import DatetimeIndex, Timestamp
+from typing import Dict, Iterator, List, Mapping, NamedTuple, Optional, Tuple, Type, Union
 
-from ..config import conf
+from ..config import RunContext
+from ..domain import LonRange, contains, covers, describe, from_bounds, select
 from ..logging import die, log
+from . import chunking, file_pool, staging, weights
 from .era5field import Era5field
-from .xarray_legacy_read import cat_to_dataset_dict
+from .xarray_legacy_read import decode_dataset
 
 _lat_names = ["latitude", "lat", "LAT", "LATITUDE", "Lat", "Latitude"]
 _lon_names = ["longitude", "lon", "LON", "LONGITUDE", "Lon", "Longitude"]
 
+# Files opened at once within a month. Opening is dominated by metadata
+# latency on Lustre, not by the client
+_default_open_threads = 16
+
 
 def find_datasets(cat: intake_esm.core.esm_datastore, datasets: List[str], name: str) -> List[intake_esm.core.esm_datastore]:
     sub_cats = []
@@ -35,13 +43,13 @@ def find_datasets(cat: intake_esm.core.esm_datastore, datasets: List[str], name:
     return sub_cats
 
 
-def get_catalogues() -> List[Union[intake_esm.core.esm_datastore, NamedTuple]]:
-    custom_field_cat_key = conf.get("custom_field_catalogue_key")
-    datasets = [k for k in conf.get("fields").keys()]
+def get_catalogues(ctx: RunContext) -> List[Union[intake_esm.core.esm_datastore, NamedTuple]]:
+    custom_field_cat_key = ctx.get("custom_field_catalogue_key")
+    datasets = [k for k in ctx.get("fields").keys()]
     cats = []
-    for cat_path in conf.get("catalogue_paths"):
+    for cat_path in ctx.get("catalogue_paths"):
         log.info(f"Trying catalogue path: {cat_path}")
-        for cat in conf.get("catalogues"):
+        for cat in ctx.get("catalogues"):
             if cat == custom_field_cat_key:
                 # We found the special (fake) "custom field" catalogue, create an empty
                 # object that has a 'name' attribute, we'll need to query that later
@@ -58,14 +66,14 @@ def get_catalogues() -> List[Union[intake_esm.core.esm_datastore, NamedTuple]]:
             except KeyError:
                 log.debug("Not Found")
                 continue
-            product_type = conf.get(f"catalogue_flags.{out.name}.product_type")
+            product_type = ctx.get(f"catalogue_flags.{out.name}.product_type")
             log.debug(f"product_type: {product_type}")
             if product_type:
                 n = out.name
                 log.info(f"Filtering by product type: {product_type}")
                 out = out.search(product_type=product_type)
                 out.name = n
-            sub_coll_pref = conf.get(f"catalogue_flags.{out.name}.sub_collection_pref")
+            sub_coll_pref = ctx.get(f"catalogue_flags.{out.name}.sub_collection_pref")
             log.debug(f"sub_coll_pref: {sub_coll_pref}")
             if sub_coll_pref is not None:
                 log.info(f"Attempting to find preferred subcollection: {sub_coll_pref}")
@@ -83,34 +91,188 @@ def get_catalogues() -> List[Union[intake_esm.core.esm_datastore, NamedTuple]]:
     return cats
 
 
-def get_single_field(field_name: str, source: str, ts: Timestamp) -> Optional[xr.DataArray]:
+def get_single_field(ctx: RunContext, field_name: str, source: str, ts: Timestamp) -> Optional[xr.DataArray]:
     log.info(f"Retrieving single field {field_name} from {source}")
-    lat_buffer_range, lon_buffer_range = conf.get("domain_with_buffer")
+    lat_buffer_range, lon_buffer_range = ctx.get("domain_with_buffer")
     # Source is a file.
     if source.startswith("/"):
         log.debug(f"{source} is file")
-        ds = xr.open_dataset(source)
+        ds = file_pool.open_dataset(ctx, source)
         if field_name in ds:
             log.debug(f"{field_name} found")
-            return ds[field_name][0].drop_vars("time").sel(latitude=lat_buffer_range, longitude=lon_buffer_range)
+            return select(ds[field_name][0].drop_vars("time"), lat_buffer_range, lon_buffer_range)
         else:
             log.debug(f"{field_name} not found")
             return None
     log.debug(f"{source} is catalogue")
-    for cat in get_catalogues():
+    for cat in get_catalogues(ctx):
         if cat.name() == source:
             log.debug(f"{source} found")
             result = cat.search(parameter=field_name, year=ts.year, month=ts.month)
-            return (
-                xr.open_dataarray(result.path[0])[0]
-                .drop_vars("time")
-                .sel(latitude=lat_buffer_range, longitude=lon_buffer_range)
-            )
+            ds = file_pool.open_dataset(ctx, result.path[0])
+            da = next(iter(ds.data_vars.values()))
+            return select(da[0].drop_vars("time"), lat_buffer_range, lon_buffer_range)
     log.debug(f"{source} not found")
     return None
 
 
-def handle_custom_field(field_name: str, file_name: str) -> xr.DataArray:
+def levels_for(ctx: RunContext, field_name: str, dataset: Optional[str]) -> Optional[List[float]]:
+    """
+    Levels to read for a field: levels.<dataset>.<field> if set, otherwise
+    levels.<dataset>.default or levels.<dataset> if it is a list, otherwise
+    None for every level in the file
+    """
+    levels = ctx.get(f"levels.{dataset}")
+    if isinstance(levels, Mapping):
+        levels = levels.get(field_name, levels.get("default"))
+    if levels is None:
+        return None
+    return list(levels)
+
+
+def month_times(ctx: RunContext, t: Timestamp) -> DatetimeIndex:
+    """
+    Time steps of the run in the month ending at t
+    """
+    tr = ctx.get_time_range()
+    return tr[(tr.year == t.year) & (tr.month == t.month)]
+
+
+def submit_result(
+    ctx: RunContext,
+    pool: ThreadPoolExecutor,
+    result: intake_esm.core.esm_datastore,
+    domain: Tuple[slice, LonRange],
+    t: Timestamp,
+    file_levels: Dict[str, Optional[List[float]]],
+) -> Dict[str, Tuple[List[str], List[Future]]]:
+    """
+    Start opening the files in a catalogue search result for the month
+    ending at t, through the staging cache and shared file pool, on the open
+    pool. Returns the paths and pending datasets for each file variable.
+
+    This replaces intake-esm's to_dataset_dict, which opens files one
+    search result at a time. The catalogue's aggregation_control is not
+    used: files are grouped by file variable and joined along time in path
+    order, and the catalogue's xarray_open_kwargs and preprocess are ignored.
+    """
+    path_col = result.esmcat.assets.column_name
+    times = month_times(ctx, t)
+    out = {}
+    for file_var, paths in result.df.groupby("file_variable")[path_col]:
+        paths = sorted(paths)
+        levels = file_levels.get(file_var)
+        out[file_var] = (
+            paths,
+            [pool.submit(staging.open_staged, ctx, p, file_var, domain, times, levels) for p in paths],
+        )
+    return out
+
+
+def open_result(
+    ctx: RunContext,
+    t: Timestamp,
+    opened: Dict[str, Tuple[List[str], List[Future]]],
+    chunks: Union[str, Dict[str, int]],
+    file_levels: Dict[str, Optional[List[float]]],
+) -> Dict[str, xr.Dataset]:
+    """
+    Wait for the files started by submit_result for the month ending at t,
+    returning a chunked dataset for each file variable trimmed to the time
+    steps and levels that will be used
+    """
+    times = month_times(ctx, t)
+    out = {}
+    for file_var, (paths, futures) in opened.items():
+        dss = [f.result() for f in futures]
+        if len(dss) == 1:
+            ds = dss[0]
+        else:
+            ds = xr.concat(dss, dim="time", data_vars="minimal", coords="minimal", compat="override")
+        # Only read the time steps we need, before chunking so the
+        # chunks are made up of just those steps
+        if "time" in ds.dims:
+            needed = ds.indexes["time"].intersection(times)
+            # Files with none of the requested times hold time-invariant data
+            if len(needed) > 0:
+                missing = times.difference(needed)
+                if len(missing) > 0:
+                    die(f"Error! {len(missing)} time steps from {missing[0]} to {missing[-1]} requested for {file_var}"
+                        f" are not in {paths[0]}")
+                ds = ds.sel(time=needed)
+        levels = file_levels.get(file_var)
+        if levels is not None and "level" in ds.dims:
+            missing = set(levels) - set(ds.level.values.tolist())
+            if missing:
+                die(f"Levels {sorted(missing)} requested for {file_var} are not in {paths[0]}")
+            ds = ds.sel(level=levels)
+        if isinstance(chunks, dict):
+            ds = ds.chunk({k: v for k, v in chunks.items() if k in ds.dims})
+        else:
+            ds = ds.chunk(chunks)
+        if ctx.get("data_types", 32) == 32:
+            # Force 32-bit right from the start
+            ds = decode_dataset(ds)
+        out[file_var] = ds
+    return out
+
+
+def field_realm(ctx: RunContext, cat_name: str, field_name: str) -> str:
+    # Field realm overrides dataset realm
+    if field_name in (ctx.get("ocean_only") or []):
+        return "ocean_only"
+    if field_name in (ctx.get("land_only") or []):
+        return "land_only"
+    return ctx.get(f"catalogue_flags.{cat_name}.realm", "global")
+
+
+def read_domain(ctx: RunContext, da: xr.DataArray) -> Tuple[slice, LonRange]:
+    """
+    Return the region to read for a DataArray. Data that will be regridded
+    with the weight file needs every source point used by the weight file
+    stencil, which can extend further than the buffered domain.
+    """
+    if ctx.get("regrid_options") == "weight_file" and ctx.get("weight_file_domain") is not None:
+        if weights.is_source_grid(da):
+            return ctx.get("weight_file_domain")
+    return ctx.get("domain_with_buffer")
+
+
+def catalogue_domain(ctx: RunContext, cat_name: str) -> Tuple[slice, LonRange]:
+    """
+    The region that will be read from a catalogue, from its grid spacing
+    rather than its data, for use before anything is opened
+    """
+    if ctx.get("regrid_options") == "weight_file" and ctx.get("weight_file_domain") is not None:
+        if ctx.get(f"catalogue_flags.{cat_name}.grid_spacing") == weights.SOURCE_SPACING:
+            return ctx.get("weight_file_domain")
+    return ctx.get("domain_with_buffer")
+
+
+def handle_custom_field(ctx: RunContext, field_name: str, file_name: str) -> xr.DataArray:
+    """
+    Return a custom field, loading it on the first call for each file. The
+    result is memoized by file path and modification time (and the time range
+    and domain requested), so the checks, renaming, rolling and trimming are
+    only done once per build rather than once per month.
+    """
+    try:
+        mtime = os.stat(file_name).st_mtime
+    except FileNotFoundError:
+        die(f"File {file_name} for field {field_name} could not be found")
+    key = (field_name, str(file_name), mtime, ctx.get("start"), ctx.get("end"), repr(ctx.get("domain_with_buffer")))
+    session = ctx.session
+    with session.lock:
+        if key in session.custom_fields:
+            log.debug(f"Using previously loaded custom field {field_name} from {file_name}")
+            return session.custom_fields[key].copy(deep=False)
+    da = load_custom_field(ctx, field_name, file_name)
+    with session.lock:
+        session.custom_fields[key] = da
+    return da.copy(deep=False)
+
+
+def load_custom_field(ctx: RunContext, field_name: str, file_name: str) -> xr.DataArray:
     """
     Handle custom fields to load in place of standard catalogue fields
     The rules for files containing these fields are:
@@ -126,7 +288,7 @@ def handle_custom_field(field_name: str, file_name: str) -> xr.DataArray:
     """
     log.info(f"Searching for custom field {field_name} in {file_name}")
     try:
-        ds = xr.open_dataset(file_name)
+        ds = file_pool.open_dataset(ctx, file_name)
         log.debug("Opened dataset")
     except FileNotFoundError:
         die(f"File {file_name} for field {field_name} could not be found")
@@ -152,8 +314,9 @@ def handle_custom_field(field_name: str, file_name: str) -> xr.DataArray:
         log.debug("Dataset has time coord")
         if da.time.size > 1:
             log.debug("File has more than one time point")
-            tr = conf.get_time_range()
+            tr = ctx.get_time_range()
             try:
+                # Only the requested time steps are read
                 da = da.sel(time=tr)
                 log.debug("Dataset contains required time range")
             except KeyError:
@@ -195,25 +358,22 @@ def handle_custom_field(field_name: str, file_name: str) -> xr.DataArray:
                 da = da.roll(longitude=da.sizes["longitude"] // 2, roll_coords=True)
             log.debug("Reset lon to 0-360")
             da = da.assign_coords(longitude=(da.longitude + 360) % 360)
-            da.sort_by(da.longitude)
+            da = da.sortby("longitude")
 
     # Does our custom field contain the whole domain we've requested?
-    lat_buffer_range, lon_buffer_range = conf.get("domain_with_buffer")
-    lat_range, lon_range = conf.get("domain")
-    if conf.get("regrid_options") != "weight_file":
-        da = da.sel(latitude=lat_buffer_range, longitude=lon_buffer_range)
+    lat_range, lon_range = ctx.get("domain")
+    da = select(da, *read_domain(ctx, da))
 
     log.debug("Check domain is complete")
-    if (
-        da.latitude.min().data > lat_range.stop
-        or da.latitude.max().data < lat_range.start
-        or da.longitude.min().data > lon_range.start
-        or da.longitude.max().data < lon_range.stop
-    ):
+    if not covers(da, lat_range, lon_range):
         die("Domain of data: "
             f"({da.latitude.min().data},{da.longitude.min().data}) - ({da.latitude.max().data},{da.longitude.max().data}) "
-            "does not fill the requested domain: "
-            f"({lat_range.stop},{lon_range.start}) - ({lat_range.start},{lon_range.stop})")
+            f"does not fill the requested domain: {describe(lat_range, lon_range)}")
+
+    # Files are opened unchunked, chunk what's left so only the requested
+    # time steps are read, a few at a time
+    if "time" in da.dims:
+        da = da.chunk(chunking.custom_field_chunks(ctx, da))
 
     # If everything checks out, add the source attribute
     da.attrs["source"] = file_name
@@ -221,26 +381,22 @@ def handle_custom_field(field_name: str, file_name: str) -> xr.DataArray:
     return da
 
 
-def remaining_list(fields: Dict[Tuple[str, str], Era5field], dataset=None) -> list[str]:
+def remaining_list(ctx: RunContext, fields: Dict[Tuple[str, str], Era5field], dataset=None) -> list[str]:
     if dataset:
         field_list = [i for (i, ds), field in fields.items() if (ds == dataset and not field.is_complete())]
     else:
         field_list = [i for (i, _), field in fields.items() if not field.is_complete()]
     # Add in equivalents
     field_list = field_list + [
-        j for i, j in conf.get("equivalent_vars", {}).items() if i in field_list
+        j for i, j in ctx.get("equivalent_vars", {}).items() if i in field_list
     ]
     log.debug(f"Fields remaining: {field_list}")
     return field_list
 
 
-def get_data(cats: list[Union[intake_esm.core.esm_datastore, NamedTuple]], t: Timestamp) -> Dict[Tuple[str, str], Era5field]:
-    datasets = [k for k in conf.get("fields").keys()]
-    inverse_equivs = {v: k for k, v in (conf.get("equivalent_vars", {})).items()}
-    lat_buffer_range, lon_buffer_range = conf.get("domain_with_buffer")
-    static_fields = conf.get("static", {})
-    custom_field_cat_key = conf.get("custom_field_catalogue_key")
-    cat_names = [i.name for i in cats]
+def init_fields(ctx: RunContext, field_type: Type[Era5field] = Era5field) -> Dict[Tuple[str, str], Era5field]:
+    datasets = [k for k in ctx.get("fields").keys()]
+    static_fields = ctx.get("static", {})
 
     # CDO seems to want fields in a specific order
     #   - single level
@@ -251,20 +407,52 @@ def get_data(cats: list[Union[intake_esm.core.esm_datastore, NamedTuple]], t: Ti
     fields = OrderedDict()
     for ds_type in datasets:
         log.debug(f"get dynamic field names with {ds_type}")
-        for field_name in conf.get("fields")[ds_type]:
+        for field_name in ctx.get("fields")[ds_type]:
             static = static_fields.get(ds_type, [])
             log.debug(f"static fields for {ds_type}: {static}")
             if field_name not in static:
                 log.debug(f"Initialise {field_name},{ds_type}")
-                fields[(field_name, ds_type)] = Era5field(field_name)
+                fields[(field_name, ds_type)] = field_type(field_name, ctx)
     for ds_type in datasets:
         log.debug(f"get dynamic static names with {ds_type}")
         for field_name in static_fields.get(ds_type, []):
             log.debug(f"Initialise static {field_name} {ds_type}")
-            fields[(field_name, ds_type)] = Era5field(field_name)
+            fields[(field_name, ds_type)] = field_type(field_name, ctx)
+    return fields
+
+
+def field_key(fields: Dict[Tuple[str, str], Era5field], field_name: str, dataset: Optional[str]) -> Optional[Tuple[str, str]]:
+    """
+    The field a catalogue variable fills: the field in the catalogue's
+    dataset, or the first field of that name for catalogues without datasets
+    """
+    if dataset is not None:
+        return (field_name, dataset) if (field_name, dataset) in fields else None
+    return next(((f, d) for (f, d) in fields if f == field_name), None)
 
-    if "custom_fields" in conf:
-        if custom_field_cat_key not in cat_names:
+
+# A catalogue search for the fields still missing in a month
+Resolved = namedtuple("Resolved", ["cat", "dataset", "result", "file_var_map", "file_levels", "domain"])
+
+
+def resolve_catalogues(
+    ctx: RunContext,
+    cats: List[Union[intake_esm.core.esm_datastore, NamedTuple]],
+    t: Timestamp,
+    fields: Dict[Tuple[str, str], Era5field],
+) -> Iterator[Resolved]:
+    """
+    Search each catalogue in turn for the fields still missing in the month
+    ending at t, reserving the realms each search result will fill so later
+    catalogues skip them. Only catalogue tables are read. The custom field
+    catalogue is yielded without a search result.
+    """
+    inverse_equivs = {v: k for k, v in (ctx.get("equivalent_vars", {})).items()}
+    custom_field_cat_key = ctx.get("custom_field_catalogue_key")
+
+    cats = list(cats)
+    if "custom_fields" in ctx:
+        if custom_field_cat_key not in [i.name for i in cats]:
             log.info("Custom fields found, but no order specified, inserting at top")
             # We have custom fields, but the user has not told
             # us where they go, so they'll be processed first
@@ -275,66 +463,92 @@ def get_data(cats: list[Union[intake_esm.core.esm_datastore, NamedTuple]], t: Ti
     for cat in cats:
         log.info(f"Searching for remaining fields in {cat}")
         if cat.name == custom_field_cat_key:
-            log.info("Handling custom fields")
-            for field, fn in conf.get("custom_fields").items():
-                da = handle_custom_field(field, fn)
-                realm = conf.get(f"custom_field_flags.{field}", "global")
-                log.debug(f"{field} from {fn} defined on {realm}")
-                if realm == "subdomain":
-                    raise (NotImplementedError("TODO"))
-                # Can only handle single-level custom fields
-                fields[(field, "single-levels")].add_dataarray(da, realm)
+            for field in ctx.get("custom_fields"):
+                fields[(field, "single-levels")].reserve(ctx.get(f"custom_field_flags.{field}", "global"))
+            yield Resolved(cat, None, None, {}, {}, None)
+            continue
+        region = ctx.get(f"catalogue_flags.{cat.name}.region")
+        if region is not None:
+            # e.g. a mirror of part of the archive
+            region = from_bounds(**region)
+            needed = catalogue_domain(ctx, cat.name)
+            if not contains(region, needed):
+                log.info(f"Skipping {cat.name}, it only holds {describe(*region)} and {describe(*needed)} is needed")
+                continue
+        if "dataset" in cat.df:
+            dataset = cat.df["dataset"].unique()[0]
+            result = cat.search(parameter=remaining_list(ctx, fields, dataset), year=t.year, month=t.month)
         else:
-            if "dataset" in cat.df:
-                dataset = cat.df["dataset"].unique()[0]
-                result = cat.search(parameter=remaining_list(fields, dataset), year=t.year, month=t.month)
-            else:
-                result = cat.search(parameter=remaining_list(fields), year=t.year, month=t.month)
-            if len(result.df) == 0:
-                log.debug("None Found")
+            dataset = None
+            result = cat.search(parameter=remaining_list(ctx, fields), year=t.year, month=t.month)
+        if len(result.df) == 0:
+            log.debug("None Found")
+            continue
+        log.debug(f"Found: {result.df['file_variable']}")
+        file_var_map = dict(zip(result.df["file_variable"], result.df["parameter"]))
+        file_levels = {}
+        for file_var, param in file_var_map.items():
+            field_name = inverse_equivs.get(param, param)
+            key = field_key(fields, field_name, dataset)
+            file_levels[file_var] = levels_for(ctx, field_name, dataset if key is None else key[1])
+            if key is not None:
+                fields[key].reserve(field_realm(ctx, cat.name, field_name))
+        yield Resolved(cat, dataset, result, file_var_map, file_levels, catalogue_domain(ctx, cat.name))
+
+
+def get_data(ctx: RunContext, cats: list[Union[intake_esm.core.esm_datastore, NamedTuple]], t: Timestamp) -> Dict[Tuple[str, str], Era5field]:
+    inverse_equivs = {v: k for k, v in (ctx.get("equivalent_vars", {})).items()}
+    custom_field_cat_key = ctx.get("custom_field_catalogue_key")
+    fields = init_fields(ctx)
+
+    # Searches only need the catalogue tables, so resolve every catalogue
+    # first, reserving the realms each will fill, and open all of their
+    # files at once. Data arrays are added afterwards in catalogue order.
+    jobs = []
+    with ThreadPoolExecutor(ctx.get("open_threads", _default_open_threads)) as pool:
+        for r in resolve_catalogues(ctx, cats, t, fields):
+            if r.cat.name == custom_field_cat_key:
+                jobs.append((r, None))
                 continue
-            log.debug(f"Found: {result.df['file_variable']}")
-            file_var_map = dict(zip(result.df["file_variable"], result.df["parameter"]))
-            chunks = conf.get(f"catalogue_flags.{cat.name}.chunks", "auto")
-            log.debug("Creating dataset dict")
-            if conf.get("data_types", 32) == 32:
-                # Force 32-bit right from the start
-                d = cat_to_dataset_dict(result, chunks)
-            else:
-                # Don't care what it ends up as
-                d = result.to_dataset_dict(
-                    xarray_open_kwargs={"chunks": chunks}, progressbar=False
-                )
+            chunks = ctx.get(f"catalogue_flags.{r.cat.name}.chunks")
+            if chunks is None:
+                path = r.result.df[r.result.esmcat.assets.column_name].iloc[0]
+                n_levels = max((len(i) for i in r.file_levels.values() if i is not None), default=None)
+                chunks = chunking.plan_chunks(ctx, r.cat.name, r.dataset or r.cat.name, path, t, r.domain, n_levels)
+            elif isinstance(chunks, Mapping):
+                # xarray wants a real dict, not a read-only config view
+                chunks = dict(chunks)
+            log.debug("Opening files")
+            opened = submit_result(ctx, pool, r.result, r.domain, t, r.file_levels)
+            jobs.append((r, (opened, chunks, r.file_levels)))
+
+        for r, pending in jobs:
+            if r.cat.name == custom_field_cat_key:
+                log.info("Handling custom fields")
+                for field, fn in ctx.get("custom_fields").items():
+                    da = handle_custom_field(ctx, field, fn)
+                    realm = ctx.get(f"custom_field_flags.{field}", "global")
+                    log.debug(f"{field} from {fn} defined on {realm}")
+                    if realm == "subdomain":
+                        raise (NotImplementedError("TODO"))
+                    # Can only handle single-level custom fields
+                    fields[(field, "single-levels")].add_dataarray(da, realm)
+                continue
+            d = open_result(ctx, t, *pending)
             for ds in d.values():
                 for da in ds:
                     log.debug(f"Handling {da}")
-                    # Dataset realm
-                    realm = conf.get(f"catalogue_flags.{cat.name}.realm", "global")
-                    field_name = inverse_equivs.get(file_var_map[da], file_var_map[da])
-                    if conf.get("regrid_options") == "weight_file":
-                        log.debug("Not Trimming to buffered domain")
-                        out_da = ds[da]
-                    else:
-                        log.debug("Trimming to buffered domain")
-                        out_da = ds[da].sel(
-                            latitude=lat_buffer_range, longitude=lon_buffer_range
-                        )
-                    out_da.attrs["source"] = cat.name
-                    # Field realm overrides dataset realm
-                    if field_name in conf.get("ocean_only") or []:
-                        realm = "ocean_only"
-                    elif field_name in conf.get("land_only") or []:
-                        realm = "land_only"
-                    if "dataset" in cat.df:
-                        fields[(field_name, dataset)].add_dataarray(out_da, realm)
-                    else:
-                        for (i, _), field in fields.items():
-                            if i == field_name:
-                                field.add_dataarray(out_da, realm)
-                                break
+                    field_name = inverse_equivs.get(r.file_var_map[da], r.file_var_map[da])
+                    key = field_key(fields, field_name, r.dataset)
+                    if key is None:
+                        continue
+                    log.debug("Trimming to buffered domain")
+                    out_da = select(ds[da], *read_domain(ctx, ds[da]))
+                    out_da.attrs["source"] = r.cat.name
+                    fields[key].add_dataarray(out_da, field_realm(ctx, r.cat.name, field_name))
     return fields
 
 
-def load_fields(t: Timestamp) -> Dict[Tuple[str, str], Era5field]:
-    cats = get_catalogues()
-    return get_data(cats, t)
+def load_fields(ctx: RunContext, t: Timestamp) -> Dict[Tuple[str, str], Era5field]:
+    cats = get_catalogues(ctx)
+    return get_data(ctx, cats, t)
@@ -2,7 +2,8 @@ from collections import OrderedDict
 from typing import Any, Callable, Generator, Tuple
 import xarray as xr
 
-from ..config import conf
+from ..config import RunContext
+from ..domain import select
 from ..logging import die
 
 
@@ -14,9 +15,12 @@ _default_regridder = _do_nothing
 
 
 class Era5field:
-    def __init__(self, name):
+    def __init__(self, name: str, ctx: RunContext):
         self.name = name
+        self.ctx = ctx
         self.data_arrays = OrderedDict()
+        # Realms found before their data arrays are opened, in the order found
+        self.reserved = []
         self.data_array_to_merge = None
         self.regridders = {}
 
@@ -31,6 +35,18 @@ class Era5field:
         self.regridders[realm] = _default_regridder
         # Reset encoding attribute
         self.data_arrays[realm].encoding = {}
+        if self.reserved:
+            # Keep the order realms were found in, whatever order they're opened in
+            order = {r: i for i, r in enumerate(self.reserved)}
+            self.data_arrays = OrderedDict(sorted(self.data_arrays.items(), key=lambda i: order.get(i[0], len(order))))
+
+    def reserve(self, realm: str) -> None:
+        """
+        Mark realm as found before its data array has been opened, so later
+        catalogue searches skip the field
+        """
+        if realm not in self.reserved and realm not in self.data_arrays:
+            self.reserved.append(realm)
 
     def get_dataarrays(self) -> Generator[Tuple[str, xr.DataArray], None, None]:
         for realm, da in self.data_arrays.items():
@@ -40,13 +56,14 @@ class Era5field:
         self.regridders[realm] = regridder
 
     def is_complete(self) -> bool:
-        if "global" in self.data_arrays:
+        found = set(self.data_arrays) | set(self.reserved)
+        if "global" in found:
             return True
-        if "land_only" in self.data_arrays and self.name in conf.get("land_only", {}):
+        if "land_only" in found and self.name in self.ctx.get("land_only", ()):
             return True
-        if "ocean_only" in self.data_arrays and self.name in conf.get("ocean_only", {}):
+        if "ocean_only" in found and self.name in self.ctx.get("ocean_only", ()):
             return True
-        if "land_only" in self.data_arrays and "ocean_only" in self.data_arrays:
+        if "land_only" in found and "ocean_only" in found:
             return True
         return False
 
@@ -70,15 +87,15 @@ class Era5field:
 
     def merge(self, land_mask: xr.DataArray, ds_type: str) -> None:
         # Trim the field down to the requested region here
-        lat_range, lon_range = conf.get("domain")
+        lat_range, lon_range = self.ctx.get("domain")
         # ds_tags = conf.get('dataset_tags') or {}
         # static_fields = conf.get('static') or {}
-        ds_tag = conf.get(f"dataset_tags.{ds_type}")
+        ds_tag = self.ctx.get(f"dataset_tags.{ds_type}")
 
         if len(self.data_arrays) == 1:
-            self.data_array_to_merge = next(iter(self.data_arrays.values())).sel(latitude=lat_range, longitude=lon_range)
+            self.data_array_to_merge = select(next(iter(self.data_arrays.values())), lat_range, lon_range)
             name = self.data_array_to_merge.name
-            if name not in conf.get(f"static.{ds_type}", []):
+            if name not in self.ctx.get(f"static.{ds_type}", ()):
                 if ds_tag is not None:
                     self.data_array_to_merge.name = name + "_" + ds_tag
 
@@ -91,14 +108,14 @@ class Era5field:
             return
 
         # Do we want the user to be able to configure landmask handling?
-        lm = land_mask.sel(latitude=lat_range, longitude=lon_range)
+        lm = select(land_mask, lat_range, lon_range)
         # Record whether the previous contribution to the merged field was weighted by the landmask
         prev_weighted = True
         for realm, da in reversed(self.data_arrays.items()):
             # Any remaining field is defined on the whole globe, so
             # Any nan's will cause issues issues when combining fields
             # fill nan's with the field average before attempting to merge
-            da = da.sel(latitude=lat_range, longitude=lon_range)
+            da = select(da, lat_range, lon_range)
             # da = da.fillna(da.mean(dim=('latitude','longitude')))
             if self.data_array_to_merge is None:
                 self.data_array_to_merge = xr.zeros_like(da)
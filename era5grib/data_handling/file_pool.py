@@ -0,0 +1,90 @@
+import threading
+import xarray as xr
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, Tuple, Union
+
+from ..config import RunContext
+from ..logging import log
+from . import reference
+
+_default_size = 64
+
+
+class FilePool:
+    """
+    A bounded LRU pool of open datasets shared by every read of a build. Files
+    such as the land mask, custom fields and regridding reference fields are
+    opened once and reused across months and lookups, along with their HDF5
+    chunk caches, rather than paying for the metadata round trips of a fresh
+    open on every call. Datasets in the pool are shared, so callers must not
+    close or modify them in place. Evicted datasets are closed; lazy arrays
+    that still refer to them reopen the file on access.
+    """
+
+    def __init__(self, maxsize: int = _default_size):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._datasets: "OrderedDict[Tuple[str, Hashable], xr.Dataset]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resize(self, maxsize: int):
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+        # Don't let xarray close the underlying handles behind our back
+        if xr.get_options()["file_cache_maxsize"] < maxsize:
+            xr.set_options(file_cache_maxsize=maxsize)
+
+    def open(self, path: Union[str, Path], opener: Callable[..., xr.Dataset] = xr.open_dataset, **kwargs: Any) -> xr.Dataset:
+        key = (str(path), tuple(sorted(kwargs.items())))
+        with self._lock:
+            if key in self._datasets:
+                self.hits += 1
+                self._datasets.move_to_end(key)
+                return self._datasets[key]
+            self.misses += 1
+        log.debug(f"Opening {path}")
+        ds = opener(path, **kwargs)
+        with self._lock:
+            # Another thread may have beaten us to it
+            if key in self._datasets:
+                ds.close()
+                return self._datasets[key]
+            self._datasets[key] = ds
+            self._evict()
+        return ds
+
+    def _evict(self):
+        while len(self._datasets) > self.maxsize:
+            (path, _), ds = self._datasets.popitem(last=False)
+            log.debug(f"Closing {path}")
+            ds.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "open": len(self._datasets)}
+
+    def close(self):
+        with self._lock:
+            for ds in self._datasets.values():
+                ds.close()
+            self._datasets.clear()
+
+
+def open_dataset(ctx: RunContext, path: Union[str, Path], **kwargs: Any) -> xr.Dataset:
+    """
+    Open a dataset through the file pool of the run's session. The dataset is
+    lazily loaded and unchunked; chunk the result rather than passing chunks
+    here, so the same handle is reused whatever the chunking.
+    """
+    pool = ctx.session.files
+    maxsize = ctx.get("file_pool_size", _default_size)
+    if maxsize != pool.maxsize:
+        pool.resize(maxsize)
+    if ctx.get("read_engine", "netcdf4") == "reference":
+        reference.check_available()
+        index = reference.index_path(ctx, path)
+        if index is not None:
+            return pool.open(index, reference.open_reference, **kwargs)
+    return pool.open(path, **kwargs)
@@ -2,15 +2,15 @@ import intake
 import numpy as np
 from typing import Dict, Union
 
-from ..config import conf
+from ..config import RunContext
 from ..logging import log
 
 
 class Paramdb:
-    def __init__(self):
-        cat_name = conf.get("metadata_catalogue", "").split(".")
+    def __init__(self, ctx: RunContext):
+        cat_name = ctx.get("metadata_catalogue", "").split(".")
 
-        for cat_path in conf.get("catalogue_paths"):
+        for cat_path in ctx.get("catalogue_paths"):
             c = intake.open_catalog(cat_path)
             for subcat in cat_name:
                 if subcat in c:
@@ -20,7 +20,7 @@ class Paramdb:
                     break
 
         if c is None:
-            if conf.get("format") == "grib":
+            if any(t["format"] == "grib" for t in ctx.get("outputs") or [{"format": ctx.get("format")}]):
                 log.warn(
                     "WARNING: Unable to find ECMWF metadata catalogue and GRIB format selected. GRIB field metadata will "
                     "NOT correspond to input field metadata"
@@ -29,7 +29,8 @@ class Paramdb:
                 return
 
         self.params = c.read()
-        self.metadata_mapping = conf.get("metadata_mapping")
+        self.metadata_mapping = ctx.get("metadata_mapping")
+        self.metadata_catalogue = ctx.get("metadata_catalogue")
 
     def __call__(self, field_name: str) -> Dict[str, Union[float, str, np.dtype[np.int32]]]:
         if self.params is None:
@@ -47,7 +48,7 @@ class Paramdb:
         out = {}
         for k, v in self.metadata_mapping.items():
             if v not in p:
-                log.warn(f"WARNING: Metadata parameter {v} not found in metadata catalogue {conf.get('metadata_catalogue')}")
+                log.warn(f"WARNING: Metadata parameter {v} not found in metadata catalogue {self.metadata_catalogue}")
                 continue
             if isinstance(p[v], np.int64):
                 out[k] = np.int32(p[v])
@@ -0,0 +1,121 @@
+import numpy as np
+import scipy.sparse
+import xarray as xr
+from typing import Optional, Tuple, Union
+
+from ..logging import die, log
+from ..parallel import SharedObjects, lookup
+
+_methods = ["bilinear", "nearest_s2d"]
+
+
+def axis_weights(src: np.ndarray, tgt: np.ndarray, method: str, periodic: bool = False) -> Tuple[scipy.sparse.csr_matrix, np.ndarray]:
+    """
+    Return the (n_tgt, n_src) interpolation matrix along a single axis, and
+    a mask of target points that lie outside the source axis. Source
+    coordinates may be ascending or descending.
+    """
+    src = np.asarray(src, dtype=np.float64)
+    tgt = np.asarray(tgt, dtype=np.float64)
+    n_src = src.size
+    src_index = np.arange(n_src)
+
+    if src[0] > src[-1]:
+        src = src[::-1]
+        src_index = src_index[::-1]
+
+    if periodic:
+        # Wrap the first point around so the gap between the last point and 360 is covered
+        src = np.append(src, src[0] + 360)
+        src_index = np.append(src_index, src_index[0])
+        tgt = src[0] + (tgt - src[0]) % 360
+
+    outside = (tgt < src[0]) | (tgt > src[-1])
+    pos = np.interp(tgt, src, np.arange(src.size))
+
+    if method == "nearest_s2d":
+        i0 = np.rint(pos).astype(np.int64)
+        rows = np.arange(tgt.size)
+        cols = src_index[i0]
+        vals = np.ones(tgt.size)
+    else:
+        i0 = np.minimum(np.floor(pos).astype(np.int64), src.size - 2)
+        frac = pos - i0
+        rows = np.repeat(np.arange(tgt.size), 2)
+        cols = np.stack([src_index[i0], src_index[i0 + 1]], axis=1).ravel()
+        vals = np.stack([1 - frac, frac], axis=1).ravel()
+
+    w = scipy.sparse.coo_matrix((vals, (rows, cols)), shape=(tgt.size, n_src)).tocsr()
+    w.eliminate_zeros()
+    return w, outside
+
+
+def _regrid_block(arr: np.ndarray, key: str) -> np.ndarray:
+    # Runs on the workers - weights are looked up, not carried by the task
+    w_lat, w_lon, outside = lookup(key)
+    out = _apply_along_axis(w_lon, arr, -1)
+    out = _apply_along_axis(w_lat, out, -2)
+    if outside.any():
+        out = np.where(outside, np.nan, out)
+    return out.astype(arr.dtype, copy=False)
+
+
+def _apply_along_axis(w: scipy.sparse.csr_matrix, arr: np.ndarray, axis: int) -> np.ndarray:
+    arr = np.moveaxis(arr, axis, -1)
+    shape = arr.shape
+    out = (w @ arr.reshape(-1, shape[-1]).T).T
+    return np.moveaxis(out.reshape(shape[:-1] + (w.shape[0],)), -1, axis)
+
+
+class RectilinearRegridder:
+    """
+    A lightweight replacement for xesmf.Regridder between regular
+    latitude/longitude grids. Bilinear (and nearest neighbour) interpolation
+    between rectilinear grids is separable, so the weights are a pair of
+    sparse 1D matrices applied to each horizontal slice as
+    ``w_lat @ field @ w_lon.T``. No ESMF grid or weight generation is needed.
+    The weights are shared with the Dask workers once, not carried by every
+    task, through shared (a new SharedObjects if not given).
+    """
+
+    def __init__(
+        self,
+        src: Union[xr.Dataset, xr.DataArray],
+        tgt: Union[xr.Dataset, xr.DataArray],
+        method: str = "bilinear",
+        shared: Optional[SharedObjects] = None,
+    ):
+        if method not in _methods:
+            die(f"Regridding method {method} not supported by the rectilinear regridder, must be one of {_methods}")
+        self.method = method
+        self.tgt_lat = tgt.latitude
+        self.tgt_lon = tgt.longitude
+
+        src_lon = src.longitude.values
+        spacing = abs(src_lon[1] - src_lon[0]) if src_lon.size > 1 else 360
+        periodic = bool(np.isclose(src_lon.max() - src_lon.min() + spacing, 360))
+
+        self.w_lat, lat_outside = axis_weights(src.latitude.values, tgt.latitude.values, method)
+        self.w_lon, lon_outside = axis_weights(src_lon, tgt.longitude.values, method, periodic)
+        self.outside = lat_outside[:, None] | lon_outside[None, :]
+        if self.outside.any():
+            log.warning(f"{self.outside.sum()} target points are outside the source grid and will be set to NaN")
+        self.shared = shared if shared is not None else SharedObjects()
+        self.key = None
+
+    def __call__(self, field: xr.DataArray) -> xr.DataArray:
+        if self.key is None:
+            self.key = self.shared.share((self.w_lat, self.w_lon, self.outside))
+        out = xr.apply_ufunc(
+            _regrid_block,
+            field.chunk({"latitude": -1, "longitude": -1}) if field.chunks else field,
+            input_core_dims=[["latitude", "longitude"]],
+            output_core_dims=[["latitude", "longitude"]],
+            exclude_dims={"latitude", "longitude"},
+            kwargs={"key": self.key},
+            dask="parallelized",
+            output_dtypes=[field.dtype],
+            dask_gufunc_kwargs={"output_sizes": {"latitude": self.tgt_lat.size, "longitude": self.tgt_lon.size}},
+            keep_attrs=True,
+        )
+        return out.assign_coords(latitude=self.tgt_lat.values, longitude=self.tgt_lon.values)
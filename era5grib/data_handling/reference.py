@@ -0,0 +1,105 @@
+import argparse
+import functools
+import importlib.util
+import json
+import xarray as xr
+from pathlib import Path
+from typing import Any, List, Optional, Union
+
+from ..config import RunContext
+from ..logging import die, log
+
+# Small variables (coordinates, scalars) are stored in the index itself, so
+# opening a file never has to read them from the archive
+_inline_threshold = 2**16
+# Packages needed to read through an index
+_read_packages = ["fsspec", "zarr"]
+
+
+@functools.lru_cache(maxsize=1)
+def missing_packages() -> List[str]:
+    return [p for p in _read_packages if importlib.util.find_spec(p) is None]
+
+
+def check_available() -> None:
+    """
+    Stop with an error if the packages the reference read engine needs are
+    not installed
+    """
+    missing = missing_packages()
+    if missing:
+        die(f"ERROR: read_engine 'reference' requires the {' and '.join(missing)} package(s),"
+            " install them with e.g. pip install 'era5grib[reference]'")
+
+
+def index_path(ctx: RunContext, path: Union[str, Path]) -> Optional[Path]:
+    """
+    Return the reference index for an archive file, or None if it has not
+    been indexed. Indices mirror the archive layout under the reference_index
+    directory, as either <file>.json or a <file>.parq directory of Parquet
+    references.
+    """
+    root = ctx.get("reference_index")
+    if root is None:
+        return None
+    base = Path(root) / Path(path).resolve().relative_to("/")
+    for suffix in (".json", ".parq"):
+        index = base.with_name(base.name + suffix)
+        if index.exists():
+            return index
+    log.debug(f"No reference index for {path}")
+    return None
+
+
+def open_reference(index: Union[str, Path], **kwargs: Any) -> xr.Dataset:
+    """
+    Open a netCDF4 file through its byte-range reference index. Chunks are
+    fetched with plain file reads and decompressed by numcodecs, so reads are
+    not serialised by the HDF5 library lock.
+    """
+    check_available()
+    return xr.open_dataset(
+        "reference://",
+        engine="zarr",
+        backend_kwargs={
+            "consolidated": False,
+            "storage_options": {"fo": str(index), "remote_protocol": "file"},
+        },
+        **kwargs,
+    )
+
+
+def build_index(path: Union[str, Path], index_root: Union[str, Path]) -> Path:
+    """
+    Write the JSON reference index for a single netCDF4 file under index_root
+    """
+    try:
+        from kerchunk.hdf import SingleHdf5ToZarr
+    except ImportError:
+        die("ERROR: Building reference indices requires the kerchunk package, install it with e.g. pip install 'era5grib[reference]'")
+    path = Path(path).resolve()
+    index = Path(index_root) / path.relative_to("/")
+    index = index.with_name(index.name + ".json")
+    index.parent.mkdir(parents=True, exist_ok=True)
+    refs = SingleHdf5ToZarr(str(path), inline_threshold=_inline_threshold).translate()
+    # Write atomically, other jobs may be reading the index tree
+    tmp = index.with_name(index.name + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(refs, f)
+    tmp.replace(index)
+    log.info(f"Indexed {path} -> {index}")
+    return index
+
+
+def main(in_args: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Build reference indices for the era5grib 'reference' read engine")
+    parser.add_argument("--index-root", help="Directory to write indices to", type=Path, required=True)
+    parser.add_argument("files", help="netCDF4 files to index", type=Path, nargs="+")
+    ns = parser.parse_args(in_args)
+    log.start("info")
+    for fn in ns.files:
+        build_index(fn, ns.index_root)
+
+
+if __name__ == "__main__":
+    main()
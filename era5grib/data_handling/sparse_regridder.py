@@ -0,0 +1,58 @@
+import numpy as np
+import scipy.sparse
+import xarray as xr
+from typing import Optional
+
+from ..parallel import SharedObjects, lookup
+
+
+def _apply_weights(arr: np.ndarray, key: str, shape_out: tuple) -> np.ndarray:
+    # Runs on the workers - weights are looked up, not carried by the task
+    weights = lookup(key)
+    lead = arr.shape[:-2]
+    out = (weights @ arr.reshape(-1, arr.shape[-2] * arr.shape[-1]).T).T
+    return out.reshape(lead + shape_out).astype(arr.dtype, copy=False)
+
+
+class SparseRegridder:
+    """
+    Applies a (n_out, n_in) sparse weight matrix to the flattened horizontal
+    grid of a DataArray. The weight matrix is shared with each Dask worker
+    once and referenced by key from the regridding tasks, so it does not end
+    up in the task graph of every field and chunk. The weights are shared
+    through shared, a new SharedObjects if not given.
+    """
+
+    def __init__(self, weights: scipy.sparse.spmatrix, tgt: xr.DataArray, shared: Optional[SharedObjects] = None):
+        self.weights = scipy.sparse.csr_matrix(weights)
+        self.tgt_lat = tgt.latitude.values
+        self.tgt_lon = tgt.longitude.values
+        self.shared = shared if shared is not None else SharedObjects()
+        self.key: Optional[str] = None
+
+    @classmethod
+    def from_xesmf(cls, regridder, tgt: xr.DataArray, shared: Optional[SharedObjects] = None) -> "SparseRegridder":
+        weights = regridder.weights
+        # xesmf stores the weights as a DataArray wrapping a sparse.COO array
+        weights = getattr(weights, "data", weights)
+        if hasattr(weights, "to_scipy_sparse"):
+            weights = weights.to_scipy_sparse()
+        return cls(weights, tgt, shared)
+
+    def __call__(self, field: xr.DataArray) -> xr.DataArray:
+        if self.key is None:
+            self.key = self.shared.share(self.weights)
+        shape_out = (self.tgt_lat.size, self.tgt_lon.size)
+        out = xr.apply_ufunc(
+            _apply_weights,
+            field.chunk({"latitude": -1, "longitude": -1}) if field.chunks else field,
+            input_core_dims=[["latitude", "longitude"]],
+            output_core_dims=[["latitude", "longitude"]],
+            exclude_dims={"latitude", "longitude"},
+            kwargs={"key": self.key, "shape_out": shape_out},
+            dask="parallelized",
+            output_dtypes=[field.dtype],
+            dask_gufunc_kwargs={"output_sizes": {"latitude": shape_out[0], "longitude": shape_out[1]}},
+            keep_attrs=True,
+        )
+        return out.assign_coords(latitude=self.tgt_lat, longitude=self.tgt_lon)
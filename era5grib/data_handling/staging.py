@@ -0,0 +1,221 @@
+import fcntl
+import hashlib
+import os
+import threading
+import xarray as xr
+from contextlib import contextmanager
+from dask.utils import parse_bytes
+from pathlib import Path
+from pandas import DatetimeIndex
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from ..config import RunContext
+from ..domain import LonRange, select
+from ..logging import log
+from . import file_pool
+from .xarray_legacy_read import open_kwargs
+
+_default_size = "10GiB"
+_suffix = ".nc"
+# Hyperslabs staged at once
+_default_concurrency = 4
+
+_slots: Dict[int, threading.BoundedSemaphore] = {}
+_slots_lock = threading.Lock()
+
+
+def cache_dir(ctx: RunContext) -> Optional[Path]:
+    d = ctx.get("staging_cache")
+    if d is None:
+        return None
+    return Path(os.path.expandvars(str(d)))
+
+
+@contextmanager
+def _locked(lock_file: Path) -> Iterator[None]:
+    # flock is shared by every process on the node, so concurrent jobs
+    # using the same cache directory don't stage or evict the same file at once
+    with open(lock_file, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _entry(root: Path, path: Union[str, Path], file_var: str, selection: Tuple, kwargs: Dict) -> Path:
+    # The archive is treated as immutable, so the source is never stat'ed on a hit
+    key = repr((str(path), file_var, selection, sorted(kwargs.items())))
+    return root / (hashlib.sha1(key.encode()).hexdigest() + _suffix)
+
+
+def _stage_slots(ctx: RunContext) -> threading.BoundedSemaphore:
+    n = ctx.get("staging_concurrency", _default_concurrency)
+    with _slots_lock:
+        return _slots.setdefault(n, threading.BoundedSemaphore(n))
+
+
+def _selection(domain: Tuple[slice, LonRange], times: Optional[DatetimeIndex], levels: Optional[List[float]]) -> Tuple:
+    # Staged time steps are always a regular range from the run's time range
+    time_key = None if times is None or len(times) == 0 else (str(times[0]), str(times[-1]), times.freqstr)
+    return (domain, time_key, None if levels is None else tuple(levels))
+
+
+def _record(ctx: RunContext, hit: bool):
+    session = ctx.session
+    with session.lock:
+        session.staging_stats["hits" if hit else "misses"] += 1
+
+
+def _pin(ctx: RunContext, entry: Path) -> bool:
+    # Hold a shared lock on the entry until the session is released, so no
+    # job evicts it while lazy reads may still reopen it. Returns False if it
+    # was evicted first.
+    session = ctx.session
+    with session.lock:
+        if str(entry) in session.pins:
+            return True
+    try:
+        f = open(entry, "rb")
+    except FileNotFoundError:
+        return False
+    fcntl.flock(f, fcntl.LOCK_SH)
+    if os.fstat(f.fileno()).st_nlink == 0:
+        # Unlinked while we waited for the lock
+        f.close()
+        return False
+    with session.lock:
+        if str(entry) in session.pins:
+            f.close()
+        else:
+            session.pins[str(entry)] = f
+    return True
+
+
+def _unlink_unpinned(f: Path) -> bool:
+    try:
+        fh = open(f, "rb")
+    except FileNotFoundError:
+        return True
+    with fh:
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        f.unlink(missing_ok=True)
+    return True
+
+
+def open_staged(
+    ctx: RunContext,
+    path: Union[str, Path],
+    file_var: str,
+    domain: Tuple[slice, LonRange],
+    times: Optional[DatetimeIndex] = None,
+    levels: Optional[List[float]] = None,
+) -> xr.Dataset:
+    """
+    Open file_var from an archive file, trimmed to domain and the times and
+    levels that will be read, through the node-local staging cache. On a
+    miss, the trimmed hyperslab is read from the archive once and written to
+    the cache; hits never touch the archive. Entries that are opened stay
+    pinned until the session is released, so they are never evicted under a
+    running job. Without a staging_cache directory the archive file is
+    opened directly.
+    """
+    kwargs = open_kwargs(ctx)
+    root = cache_dir(ctx)
+    if root is None:
+        return file_pool.open_dataset(ctx, path, **kwargs)[[file_var]]
+
+    root.mkdir(parents=True, exist_ok=True)
+    entry = _entry(root, path, file_var, _selection(domain, times, levels), kwargs)
+    if not entry.exists():
+        with _locked(entry.with_suffix(".lock")):
+            # Another job may have staged it while we waited
+            if not entry.exists():
+                _record(ctx, False)
+                with _stage_slots(ctx):
+                    stage(ctx, path, file_var, domain, times, levels, entry)
+                # Pin before evicting, in case the new entry alone is over budget
+                _pin(ctx, entry)
+                ds = file_pool.open_dataset(ctx, entry, **kwargs)
+                evict(ctx, root)
+                return ds
+    if not _pin(ctx, entry):
+        # Evicted by another job in the meantime
+        log.debug(f"{entry} evicted before it could be opened")
+        return open_staged(ctx, path, file_var, domain, times, levels)
+    # Mark as recently used for eviction
+    os.utime(entry)
+    ds = file_pool.open_dataset(ctx, entry, **kwargs)
+    _record(ctx, True)
+    return ds
+
+
+def stage(
+    ctx: RunContext,
+    path: Union[str, Path],
+    file_var: str,
+    domain: Tuple[slice, LonRange],
+    times: Optional[DatetimeIndex],
+    levels: Optional[List[float]],
+    entry: Path,
+):
+    """
+    Copy a hyperslab of an archive file to entry. The copy is chunked and
+    computed on the cluster, so no more than a chunk is held in memory at once.
+    Times and levels missing from the file are left for the reader to report.
+    """
+    log.debug(f"Staging {file_var} from {path} to {entry}")
+    ds = file_pool.open_dataset(ctx, path, **open_kwargs(ctx))[[file_var]]
+    if times is not None and "time" in ds.dims:
+        needed = ds.indexes["time"].intersection(times)
+        if len(needed) > 0:
+            ds = ds.sel(time=needed)
+    if levels is not None and "level" in ds.dims:
+        ds = ds.sel(level=[lev for lev in levels if lev in ds.indexes["level"]])
+    ds = select(ds, *domain).chunk("auto")
+    # Drop the source encoding, its chunk sizes won't fit the trimmed data
+    for var in ds.variables.values():
+        var.encoding = {k: var.encoding[k] for k in ("dtype", "units", "calendar") if k in var.encoding}
+    encoding = {file_var: {"zlib": True, "complevel": 1}}
+    tmp = entry.with_name(f"{entry.name}.{os.getpid()}.tmp")
+    try:
+        ds.to_netcdf(tmp, encoding=encoding, compute=False).compute()
+        tmp.replace(entry)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def evict(ctx: RunContext, root: Path):
+    """
+    Remove the least recently used entries until the cache fits its budget.
+    Entries pinned by a running job are skipped, so the cache may stay over
+    budget until they are released.
+    """
+    budget = parse_bytes(str(ctx.get("staging_cache_size", _default_size)))
+    with _locked(root / ".evict.lock"):
+        entries = []
+        for f in root.glob(f"*{_suffix}"):
+            try:
+                st = f.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, f))
+        total = sum(size for _, size, _ in entries)
+        for _, size, f in sorted(entries):
+            if total <= budget:
+                break
+            # Lock files are left behind, another job may be waiting on one
+            if not _unlink_unpinned(f):
+                log.debug(f"Not evicting {f} from staging cache, it is in use")
+                continue
+            log.debug(f"Evicted {f} from staging cache")
+            total -= size
+
+
+def stats(ctx: RunContext) -> Dict[str, int]:
+    session = ctx.session
+    with session.lock:
+        return dict(session.staging_stats)
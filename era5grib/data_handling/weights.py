@@ -0,0 +1,105 @@
+import functools
+import numpy as np
+import scipy.sparse
+import xarray as xr
+from pathlib import Path
+from typing import Optional, Tuple
+
+from .. import domain
+from ..logging import die, log
+from ..parallel import SharedObjects
+from .sparse_regridder import SparseRegridder
+
+# The NCI weight file regrids the global ERA5-Land grid onto the global ERA5 grid
+WEIGHT_FILE = Path(__file__).parent.parent / "nci_regrid_weights.nc"
+SOURCE_SPACING = 0.1
+TARGET_SPACING = 0.25
+
+
+def global_shape(spacing: float) -> Tuple[int, int]:
+    return int(round(180 / spacing)) + 1, int(round(360 / spacing))
+
+
+def grid_spacing(da: xr.DataArray) -> float:
+    return abs(float(da.latitude[1] - da.latitude[0]))
+
+
+def is_source_grid(da: xr.DataArray) -> bool:
+    return da.latitude.size > 1 and np.isclose(grid_spacing(da), SOURCE_SPACING)
+
+
+def grid_index(lat: np.ndarray, lon: np.ndarray, spacing: float) -> np.ndarray:
+    """
+    Return the index of each point of a (lat, lon) grid in the flattened
+    global grid with the given spacing. Latitudes run north to south and
+    longitudes from 0 to 360, as in the weight file.
+    """
+    _, nlon = global_shape(spacing)
+    ilat = np.rint((90 - np.asarray(lat)) / spacing).astype(np.int64)
+    ilon = np.rint((np.asarray(lon) % 360) / spacing).astype(np.int64) % nlon
+    return (ilat[:, None] * nlon + ilon[None, :]).ravel()
+
+
+@functools.lru_cache(maxsize=1)
+def load_weights(weight_file: str = str(WEIGHT_FILE)) -> scipy.sparse.csr_matrix:
+    log.info(f"Loading regridding weights from {weight_file}")
+    with xr.open_dataset(weight_file) as ds:
+        # Weight file indices are 1-based
+        row = ds.row.values - 1
+        col = ds.col.values - 1
+        s = ds.S.values
+    n_out = np.prod(global_shape(TARGET_SPACING))
+    n_in = np.prod(global_shape(SOURCE_SPACING))
+    return scipy.sparse.coo_matrix((s, (row, col)), shape=(n_out, n_in)).tocsr()
+
+
+def source_domain(domain_with_buffer: Tuple[slice, domain.LonRange]) -> Optional[Tuple[slice, domain.LonRange]]:
+    """
+    Return the region of ERA5-Land data needed to regrid every ERA5 point in
+    domain_with_buffer using the weight file. The weight file extrapolates
+    land points over the ocean, so this can extend beyond the domain itself.
+    Returns None for the global domain.
+    """
+    lat_range, lon_range = domain_with_buffer
+    if lat_range == slice(None) and lon_range == slice(None):
+        return None
+
+    nlat, nlon = global_shape(TARGET_SPACING)
+    target = xr.DataArray(
+        np.empty((nlat, nlon), dtype=np.int8),
+        coords={"latitude": np.linspace(90, -90, nlat), "longitude": np.arange(nlon) * TARGET_SPACING},
+        dims=["latitude", "longitude"],
+    )
+    target = domain.select(target, lat_range, lon_range)
+    rows = grid_index(target.latitude.values, target.longitude.values, TARGET_SPACING)
+
+    cols = np.unique(load_weights()[rows].indices)
+    _, src_nlon = global_shape(SOURCE_SPACING)
+    lats = 90 - (cols // src_nlon) * SOURCE_SPACING
+    lons = (cols % src_nlon) * SOURCE_SPACING
+    log.info(f"Weight file stencil needs {len(cols)} of {np.prod(global_shape(SOURCE_SPACING))} source points")
+    # Half a grid space each way so coordinate selection is inclusive
+    return domain.domain_from_coords(lats, lons, False, SOURCE_SPACING / 2)
+
+
+def subset_regridder(src_da: xr.DataArray, tgt_da: xr.DataArray, shared: Optional[SharedObjects] = None) -> SparseRegridder:
+    """
+    Build a regridder between two limited area subsets of the ERA5-Land and
+    ERA5 grids from the relevant rows and columns of the global weight file
+    """
+    rows = grid_index(tgt_da.latitude.values, tgt_da.longitude.values, TARGET_SPACING)
+    cols = grid_index(src_da.latitude.values, src_da.longitude.values, SOURCE_SPACING)
+
+    w = load_weights()[rows].tocoo()
+
+    # Map global column indices on to the local source grid
+    order = np.argsort(cols)
+    pos = np.searchsorted(cols, w.col, sorter=order)
+    pos = np.minimum(pos, len(cols) - 1)
+    local_col = order[pos]
+    if not np.all(cols[local_col] == w.col):
+        die("ERROR: Source data does not cover all points needed by the regridding weight file")
+
+    log.info(f"Regridding with a {len(rows)} x {len(cols)} subset of the weight file")
+    weights = scipy.sparse.coo_matrix((w.data, (w.row, local_col)), shape=(len(rows), len(cols)))
+    return SparseRegridder(weights, tgt_da, shared)
@@ -1,8 +1,8 @@
-import intake_esm
 import numpy as np
 from typing import Dict
 import xarray as xr
 
+from ..config import RunContext
 from ..logging import log
 
 
@@ -27,35 +27,43 @@ def decode_mask(da: xr.DataArray) -> xr.DataArray:
     return da
 
 
-def cat_to_dataset_dict(result: intake_esm.core.esm_datastore, chunks: Dict[str, int]):
-    dataset_dict = result.to_dataset_dict(
-        xarray_open_kwargs={"chunks": chunks, "mask_and_scale": False},
-        progressbar=False,
-    )
-    for ds in dataset_dict.values():
-        for da in ds:
-            ds[da] = decode_mask(ds[da])
-
-            if "scale_factor" not in ds[da].attrs and "add_offset" not in ds[da].attrs:
-                log.debug(f"{da} has no scale_factor or add_offset - skipping")
-                continue
-
-            if "scale_factor" in ds[da].attrs:
-                scale_factor = ds[da].attrs["scale_factor"]
-                log.debug(f"scale_factor found: {ds[da].attrs['scale_factor']}")
-                del ds[da].attrs["scale_factor"]
-            else:
-                scale_factor = 1.0
-            if "add_offset" in ds[da].attrs:
-                offset = ds[da].attrs["add_offset"]
-                log.debug(f"add_offset found: {ds[da].attrs['add_offset']}")
-                del ds[da].attrs["add_offset"]
-            else:
-                offset = 0.0
-
-            attrs = ds[da].attrs
-            # These operations drop attributes
-            ds[da] = ds[da].astype(np.float32) * scale_factor + offset
-            ds[da].attrs = attrs
-
-    return dataset_dict
+def open_kwargs(ctx: RunContext) -> Dict[str, bool]:
+    """
+    Keyword arguments for opening catalogue files. When forcing 32-bit data,
+    packed data is decoded by decode_dataset instead of by xarray.
+    """
+    return {"mask_and_scale": ctx.get("data_types", 32) != 32}
+
+
+def decode_dataset(ds: xr.Dataset) -> xr.Dataset:
+    """
+    Decode packed data straight to 32-bit floats. Returns a new dataset, so
+    datasets shared through the file pool are left untouched.
+    """
+    ds = ds.copy()
+    for da in ds:
+        ds[da] = decode_mask(ds[da])
+
+        if "scale_factor" not in ds[da].attrs and "add_offset" not in ds[da].attrs:
+            log.debug(f"{da} has no scale_factor or add_offset - skipping")
+            continue
+
+        if "scale_factor" in ds[da].attrs:
+            scale_factor = ds[da].attrs["scale_factor"]
+            log.debug(f"scale_factor found: {ds[da].attrs['scale_factor']}")
+            del ds[da].attrs["scale_factor"]
+        else:
+            scale_factor = 1.0
+        if "add_offset" in ds[da].attrs:
+            offset = ds[da].attrs["add_offset"]
+            log.debug(f"add_offset found: {ds[da].attrs['add_offset']}")
+            del ds[da].attrs["add_offset"]
+        else:
+            offset = 0.0
+
+        attrs = ds[da].attrs
+        # These operations drop attributes
+        ds[da] = ds[da].astype(np.float32) * scale_factor + offset
+        ds[da].attrs = attrs
+
+    return ds
@@ -3,17 +3,61 @@ import xarray as xr
 import mule
 
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple, Union
 
 from .logging import log, die
 
+# A longitude range is either a single slice in 0-360 space, or, for domains
+# that cross the Greenwich meridian, a pair of slices (western hyperslab,
+# eastern hyperslab) that are stitched together after reading
+LonRange = Union[slice, Tuple[slice, slice]]
+
+
+# Number of source grid points either side of a target point used by each
+# regridding method
+_stencil_cells = {
+    "bilinear": 1,
+    "nearest_s2d": 1,
+    "patch": 2,
+}
+
+
+def stencil_cells(method: str) -> int:
+    return _stencil_cells.get(method, 2)
+
+
+def unrotate_pole(
+    rot_lats: numpy.ndarray, rot_lons: numpy.ndarray, pole_lat: float, pole_lon: float
+) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Convert rotated-pole coordinates to true latitudes and longitudes. The
+    pole position follows the UM convention, i.e. the true position of the
+    rotated north pole.
+    """
+    phi = numpy.deg2rad(rot_lats)
+    lam = numpy.deg2rad(rot_lons)
+    phi_p = numpy.deg2rad(pole_lat)
+
+    lats = numpy.arcsin(numpy.sin(phi) * numpy.sin(phi_p) + numpy.cos(phi) * numpy.cos(lam) * numpy.cos(phi_p))
+    lons = numpy.arctan2(
+        numpy.cos(phi) * numpy.sin(lam),
+        numpy.sin(phi_p) * numpy.cos(phi) * numpy.cos(lam) - numpy.cos(phi_p) * numpy.sin(phi),
+    )
+    return numpy.rad2deg(lats), (numpy.rad2deg(lons) + pole_lon + 180) % 360
+
 
 def domain_from_ds(ds: xr.Dataset, polar: bool) -> Tuple[numpy.array, numpy.array]:
+    # Include the staggered points, metgrid interpolates to those too. WRF
+    # stores true lat/lon for every projection so nothing else is needed
+    lat_names = [i for i in ("XLAT_M", "XLAT_U", "XLAT_V", "XLAT_C") if i in ds]
+    lon_names = [i.replace("XLAT", "XLONG") for i in lat_names]
+    lats = numpy.concatenate([ds[i].values.ravel() for i in lat_names])
     if not polar:
-        lons = ds.XLONG_M.where(ds.XLONG_M > 0, ds.XLONG_M + 360).values
+        lons = numpy.concatenate([ds[i].values.ravel() for i in lon_names])
+        lons = numpy.where(lons > 0, lons, lons + 360)
     else:
         lons = numpy.array([0, 359.75])
-    return ds.XLAT_M.values, lons
+    return lats, lons
 
 
 def domain_from_um(mf, polar: bool) -> Tuple[numpy.array, numpy.array]:
@@ -27,73 +71,95 @@ def domain_from_um(mf, polar: bool) -> Tuple[numpy.array, numpy.array]:
     dx = mf.real_constants.col_spacing
 
     lat = y0 + numpy.arange(ny) * dy
-    if not polar:
-        lon = x0 + numpy.arange(nx) * dx
-    else:
+    lon = x0 + numpy.arange(nx) * dx
+
+    pole_lat = mf.real_constants.north_pole_lat
+    pole_lon = mf.real_constants.north_pole_lon
+    if pole_lat != 90.0:
+        log.info(f"Rotated pole grid: pole at ({pole_lat:.2f},{pole_lon:.2f})")
+        rot_lon, rot_lat = numpy.meshgrid(lon, lat)
+        lat, lon = unrotate_pole(rot_lat, rot_lon, pole_lat, pole_lon)
+        lat = lat.ravel()
+        lon = lon.ravel()
+
+    if polar:
         lon = numpy.array([0, 359.75])
 
     return lat, lon
 
 
-def get_domain(fn: Optional[Path], polar: bool) -> Tuple[slice, slice]:
+def get_domain_coords(fn: Path, polar: bool) -> Tuple[numpy.ndarray, numpy.ndarray]:
     """
-    Return the model domain from a given file path. Accepts either
-    WRF geo_em files or UM.
+    Return the latitudes and longitudes of the model grid in a given file.
+    Accepts either WRF geo_em files or UM.
     """
+    try:
+        log.info("Attempting to open domain as netCDF file with Xarray")
+        ds = xr.open_dataset(fn, engine="netcdf4")
+    except FileNotFoundError:
+        log.error("Input domain data file not found")
+    except AttributeError:
+        log.error("Input dataset is not a valid geogrid file")
+    except OSError:
+        log.info("Not Found")
+        pass
+    else:
+        log.info("Found")
+        return domain_from_ds(ds, polar)
 
-    lats = numpy.array([-90, 90])
-    lons = numpy.array([0, 359.75])
+    try:
+        log.info("Attempting to open domain as UM file with mule")
+        mf = mule.load_umfile(str(fn))
+    except ValueError:
+        die(f"Invalid input file for domain: {fn}")
+    log.info("Found")
+    return domain_from_um(mf, polar)
 
-    found = False
 
-    if fn:
-        try:
-            log.info("Attempting to open domain as netCDF file with Xarray")
-            ds = xr.open_dataset(fn, engine="netcdf4")
-        except FileNotFoundError:
-            log.error("Input domain data file not found")
-        except AttributeError:
-            log.error("Input dataset is not a valid geogrid file")
-        except OSError:
-            log.info("Not Found")
-            pass
-        else:
-            log.info("Found")
-            lats, lons = domain_from_ds(ds, polar)
-            found = True
-
-        if not found:
-            try:
-                log.info("Attempting to open domain as UM file with mule")
-                mf = mule.load_umfile(str(fn))
-            except ValueError:
-                die(f"Invalid input file for domain: {fn}")
-            log.info("Found")
-            lats, lons = domain_from_um(mf, polar)
-
-        log.info(f"Latitudes: Target ({lats.min():.2f}:{lats.max():.2f})")
-        log.info(f"Longitudes: Target ({lons.min():.2f}:{lons.max():.2f})")
-
-        # Return a slightly bigger region so the interpolation goes OK
-        # An extra degree should be sufficient
-        lat_min = lats.min() - 1
-        if lat_min <= -90.0:
-            lat_min = None
+def domain_from_coords(lats: numpy.ndarray, lons: numpy.ndarray, polar: bool, halo: float = 1.0) -> Tuple[slice, LonRange]:
+    """
+    Return the region of ERA5 data needed to cover a set of target grid
+    coordinates, extended by halo degrees so the model's interpolation has
+    the points it needs around the edge of the domain
+    """
+    log.info(f"Latitudes: Target ({lats.min():.2f}:{lats.max():.2f})")
 
-        lat_max = lats.max() + 1
-        if lat_max >= 90.0:
-            lat_max = None
+    lat_min = lats.min() - halo
+    if lat_min <= -90.0:
+        lat_min = None
 
-        lon_min = lons.min() - 1
-        if lon_min <= 0.0:
-            lon_min = None
+    lat_max = lats.max() + halo
+    if lat_max >= 90.0:
+        lat_max = None
+
+    extent = None if polar else lon_extent(lons)
+    if extent is None:
+        lon_range = slice(None)
+    else:
+        lon_min, lon_max = extent
+        log.info(f"Longitudes: Target ({lon_min:.2f}:{lon_max:.2f})")
+        if lon_min > lon_max:
+            log.info("Domain crosses the Greenwich meridian - reading as two hyperslabs")
+            lon_min = lon_min - halo
+            lon_max = lon_max + halo
+            if lon_min <= lon_max:
+                lon_range = slice(None)
+            else:
+                lon_range = (slice(lon_min, None), slice(None, lon_max))
+        else:
+            lon_range = extend_lon_range(lon_min, lon_max, halo)
+
+    # Lats are backwards in ERA5
+    return slice(lat_max, lat_min), lon_range
 
-        lon_max = lons.max() + 1
-        if lon_max >= 359.75:
-            lon_max = None
 
-        # Lats are backwards in ERA5
-        return slice(lat_max, lat_min), slice(lon_min, lon_max)
+def get_domain(fn: Optional[Path], polar: bool, halo: float = 1.0) -> Tuple[slice, LonRange]:
+    """
+    Return the model domain from a given file path. Accepts either
+    WRF geo_em files or UM.
+    """
+    if fn:
+        return domain_from_coords(*get_domain_coords(fn, polar), polar, halo)
     else:
         log.warn(
             "Outputting the global domain - use qrparm.mask (for UM) or Geogrid file (for WRF) to restrict to limited area"
@@ -101,35 +167,203 @@ def get_domain(fn: Optional[Path], polar: bool) -> Tuple[slice, slice]:
         return slice(None), slice(None)
 
 
-def get_domain_with_buffer(lat_range: slice, lon_range: slice) -> Tuple[slice, slice]:
+def get_union_domain(fns: List[Path], polar: bool, halo: float = 1.0) -> Tuple[Tuple[slice, LonRange], List[Tuple[slice, LonRange]]]:
+    """
+    Return the region covering every domain in a list of files, along with
+    the region of each individual domain
+    """
+    all_lats = []
+    all_lons = []
+    domains = []
+    for fn in fns:
+        lats, lons = get_domain_coords(fn, polar)
+        all_lats.append(numpy.ravel(lats))
+        all_lons.append(numpy.ravel(lons))
+        domains.append(domain_from_coords(lats, lons, polar, halo))
+    log.info("Union of all domains:")
+    union = domain_from_coords(numpy.concatenate(all_lats), numpy.concatenate(all_lons), polar, halo)
+    return union, domains
+
+
+def lon_extent(lons: numpy.ndarray) -> Optional[Tuple[float, float]]:
+    """
+    Return the western and eastern edges (in 0-360 space) of the smallest arc
+    of longitude containing all of lons. If west > east the arc crosses the
+    Greenwich meridian. Returns None if the longitudes cover the globe.
+    """
+    u = numpy.unique(numpy.asarray(lons) % 360)
+    gaps = numpy.diff(u, append=u[0] + 360)
+    i = int(numpy.argmax(gaps))
+    # No meaningful gap means a global grid
+    if gaps[i] < 2.0:
+        return None
+    return float(u[(i + 1) % len(u)]), float(u[i])
+
+
+def extend_lon_range(lon_min: float, lon_max: float, halo: float) -> LonRange:
+    """
+    Extend a range of longitudes in 0-360 space by halo degrees, splitting
+    it into two hyperslabs if the extended range crosses the Greenwich
+    meridian
+    """
+    west = lon_min - halo
+    east = lon_max + halo
+    if east - west >= 360.0:
+        return slice(None)
+    if west < 0.0:
+        return (slice(west + 360.0, None), slice(None, east))
+    if east > 360.0:
+        return (slice(west, None), slice(None, east - 360.0))
+    return slice(west, east)
+
+
+def is_split(lon_range: LonRange) -> bool:
+    return isinstance(lon_range, tuple)
+
+
+def select(da: Union[xr.DataArray, xr.Dataset], lat_range: slice, lon_range: LonRange) -> Union[xr.DataArray, xr.Dataset]:
+    """
+    Trim a DataArray or Dataset on a 0-360 longitude grid to the given domain. Split
+    longitude ranges are read as two hyperslabs and stitched into a single
+    monotonic longitude axis running from negative to positive longitudes.
+    Data already interpolated to sites is returned as is.
+    """
+    if "latitude" not in da.dims:
+        return da
+    stitched = bool(da.longitude.min() < 0)
+    if not is_split(lon_range):
+        if stitched and lon_range.start is not None and lon_range.start > 180:
+            # Region sits entirely in the western half of already stitched data
+            stop = None if lon_range.stop is None else lon_range.stop - 360
+            lon_range = slice(lon_range.start - 360, stop)
+        return da.sel(latitude=lat_range, longitude=lon_range)
+    if stitched:
+        west, east = lon_range
+        return da.sel(latitude=lat_range, longitude=slice(west.start - 360, east.stop))
+    west = da.sel(latitude=lat_range, longitude=lon_range[0])
+    west = west.assign_coords(longitude=west.longitude - 360)
+    east = da.sel(latitude=lat_range, longitude=lon_range[1])
+    # data_vars is only accepted when concatenating Datasets
+    options = {"data_vars": "minimal"} if isinstance(da, xr.Dataset) else {}
+    return xr.concat([west, east], "longitude", coords="minimal", compat="override", **options)
+
+
+def covers(da: xr.DataArray, lat_range: slice, lon_range: LonRange) -> bool:
+    """
+    Check whether the coordinates of a DataArray span the given domain
+    """
+    lat_min = da.latitude.min().data
+    lat_max = da.latitude.max().data
+    # Lats are backwards in ERA5
+    if lat_range.stop is not None and lat_min > lat_range.stop:
+        return False
+    if lat_range.start is not None and lat_max < lat_range.start:
+        return False
+
+    if is_split(lon_range):
+        west, east = lon_range
+        lons = (da.longitude + 180) % 360 - 180
+        return bool(lons.min().data <= west.start - 360 and lons.max().data >= east.stop)
+
+    lons = da.longitude % 360
+    if lon_range.start is not None and lons.min().data > lon_range.start:
+        return False
+    if lon_range.stop is not None and lons.max().data < lon_range.stop:
+        return False
+    return True
+
+
+def bounds(lat_range: slice, lon_range: LonRange) -> Tuple[float, float, float, float]:
+    """
+    South, north, west and east edges of a domain. West is greater than east
+    for a domain across the Greenwich meridian.
+    """
+    if is_split(lon_range):
+        west, east = lon_range[0].start, lon_range[1].stop
+    else:
+        west, east = lon_range.start, lon_range.stop
+    south = -90.0 if lat_range.stop is None else lat_range.stop
+    north = 90.0 if lat_range.start is None else lat_range.start
+    return float(south), float(north), 0.0 if west is None else float(west), 360.0 if east is None else float(east)
+
+
+def from_bounds(south: float, north: float, west: float, east: float) -> Tuple[slice, LonRange]:
+    """
+    The domain with the given edges, the reverse of bounds()
+    """
+    lat_range = slice(None if north >= 90.0 else north, None if south <= -90.0 else south)
+    if west > east:
+        return lat_range, (slice(west, None), slice(None, east))
+    return lat_range, slice(None if west <= 0.0 else west, None if east >= 360.0 else east)
+
+
+def contains(outer: Tuple[slice, LonRange], inner: Tuple[slice, LonRange]) -> bool:
+    """
+    Check whether the domain inner lies entirely within the domain outer
+    """
+    o_south, o_north, o_west, o_east = bounds(*outer)
+    i_south, i_north, i_west, i_east = bounds(*inner)
+    if i_south < o_south or i_north > o_north:
+        return False
+    # Unwrap domains across Greenwich to a continuous range
+    o_west = o_west - 360.0 if o_west > o_east else o_west
+    i_west = i_west - 360.0 if i_west > i_east else i_west
+    if o_east - o_west >= 360.0:
+        return True
+    return any(o_west <= i_west + k and i_east + k <= o_east for k in (-360.0, 0.0, 360.0))
+
+
+def describe(lat_range: slice, lon_range: LonRange) -> str:
+    if is_split(lon_range):
+        lon_min, lon_max = lon_range[0].start - 360, lon_range[1].stop
+    else:
+        lon_min, lon_max = lon_range.start, lon_range.stop
+    return f"({lat_range.stop},{lon_min}) - ({lat_range.start},{lon_max})"
+
+
+def get_domain_with_buffer(lat_range: slice, lon_range: LonRange, halo: float = 1.0) -> Tuple[slice, LonRange]:
+    """
+    Extend a domain by halo degrees so the regridder has every source point
+    its stencil needs for target points on the domain edge
+    """
     # Lats are backwards in ERA5
     lat_min = lat_range.stop
-    if lat_min:
-        if lat_min <= -89.0:
+    if lat_min is not None:
+        if lat_min - halo <= -90.0:
             lat_min = None
         else:
-            lat_min = lat_min - 1
+            lat_min = lat_min - halo
 
     lat_max = lat_range.start
-    if lat_max:
-        if lat_max >= 89.0:
+    if lat_max is not None:
+        if lat_max + halo >= 90.0:
             lat_max = None
         else:
-            lat_max = lat_max + 1
+            lat_max = lat_max + halo
+
+    if is_split(lon_range):
+        lon_min = lon_range[0].start - halo
+        lon_max = lon_range[1].stop + halo
+        if lon_min <= lon_max:
+            return slice(lat_max, lat_min), slice(None)
+        return slice(lat_max, lat_min), (slice(lon_min, None), slice(None, lon_max))
+
+    if lon_range.start is not None and lon_range.stop is not None:
+        return slice(lat_max, lat_min), extend_lon_range(lon_range.start, lon_range.stop, halo)
 
     lon_min = lon_range.start
-    if lon_min:
-        if lon_min <= 1:
+    if lon_min is not None:
+        if lon_min - halo <= 0.0:
             lon_min = None
         else:
-            lon_min = lon_min - 1
+            lon_min = lon_min - halo
 
     lon_max = lon_range.stop
-    if lon_max:
-        if lon_max >= 358.75:
+    if lon_max is not None:
+        if lon_max + halo >= 359.75:
             lon_max = None
         else:
-            lon_max = lon_max + 1
+            lon_max = lon_max + halo
 
     # Lats are backwards in ERA5
     return slice(lat_max, lat_min), slice(lon_min, lon_max)
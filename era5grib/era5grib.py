@@ -14,11 +14,72 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from contextlib import nullcontext
 from pathlib import Path
-from .main import main
+from typing import Any, Mapping, Optional, Tuple, Union
 
+import xarray as xr
 from pandas import Timestamp
 
+from . import command_line
+from .config import Era5gribConfig
+from .domain import LonRange, get_domain
+from .main import build as build_dataset
+from .main import main
+from .session import Session
+
+
+def build(
+    config: Union[str, Path, Mapping[str, Any]],
+    start: Union[str, Timestamp],
+    end: Optional[Union[str, Timestamp]] = None,
+    domain: Optional[Union[str, Path, Tuple[slice, LonRange]]] = None,
+    client=None,
+    polar: bool = False,
+    session: Optional[Session] = None,
+    **options: Any,
+) -> xr.Dataset:
+    """
+    Return the combined ERA5 dataset without writing it.
+
+    config is the name of a built-in configuration (e.g. 'wrf_era5land'), the
+    path to a YAML configuration file, or a dict of configuration options.
+    Any further keyword arguments override configuration options.
+
+    domain is a WRF geo_em or UM file to trim to, a (lat_range, lon_range)
+    tuple of slices, or None for the whole globe.
+
+    The dataset is lazy. Any Dask work done while building it, such as
+    sharing regridding weights with the workers, uses client if it is given,
+    otherwise the current client if there is one. The regridding weights
+    shared with the workers and the input files stay open for computing the
+    dataset. They belong to session, which is new for every call if not
+    given; call session.release() once the dataset is no longer needed.
+    """
+    conf = Era5gribConfig()
+    conf.update(config)
+    for k, v in options.items():
+        conf.set(k, v)
+
+    start = Timestamp(start).floor("h")
+    end = start if end is None else Timestamp(end).ceil("h")
+    conf.set("start", start)
+    conf.set("end", end)
+    conf.set("output_interval", command_line.get_interval(conf, None))
+    conf.set("polar", polar)
+
+    if domain is None:
+        conf.set("domain", get_domain(None, polar))
+    elif isinstance(domain, (str, Path)):
+        conf.set("domain", get_domain(Path(domain), polar, command_line.get_halos(conf)[0]))
+    else:
+        conf.set("domain", tuple(domain))
+    command_line.set_read_domain(conf)
+
+    ctx = conf.freeze().replace({"session": session if session is not None else Session()})
+    with client.as_current() if client is not None else nullcontext():
+        return build_dataset(ctx)
+
 
 def era5grib_wrf(
     start=None,
@@ -1,7 +1,11 @@
+import json
 import logging
+import os
+import threading
+import time
 import warnings
 import sys
-from typing import NoReturn, Union, Optional, List
+from typing import Any, NoReturn, Union, Optional, List, TextIO
 
 _filtered_warnings = [
     "The specified chunks separate",
@@ -32,6 +36,89 @@ class UserWarningFilter(logging.Filter):
         return True
 
 
+class ProgressEmitter:
+    """
+    Writes machine-readable progress events as JSON lines for workflow
+    managers. Each event has the wall clock time, the seconds elapsed since
+    the run started and an event name. Events that report ``done`` and
+    ``total`` also get an ETA for the current stage. Does nothing until a
+    target is opened.
+    """
+
+    def __init__(self):
+        self.stream: Optional[TextIO] = None
+        self.lock = threading.Lock()
+        self.t0 = time.monotonic()
+        self.stage = None
+        self.stage_t0 = self.t0
+
+    def open(self, target: Union[str, int, os.PathLike]):
+        """
+        Open a progress target: a file name, '-' for stdout, or an integer
+        file descriptor (also accepted as 'fd:N')
+        """
+        if self.stream is not None:
+            return
+        if isinstance(target, str) and target.startswith("fd:"):
+            target = int(target[3:])
+        if isinstance(target, int):
+            self.stream = os.fdopen(target, "w", buffering=1, closefd=False)
+        elif str(target) == "-":
+            self.stream = sys.stdout
+        else:
+            self.stream = open(target, "a", buffering=1)
+        self.t0 = time.monotonic()
+        self.stage_t0 = self.t0
+
+    @property
+    def enabled(self) -> bool:
+        return self.stream is not None
+
+    def emit(self, event: str, done: Optional[int] = None, total: Optional[int] = None, **fields: Any):
+        if self.stream is None:
+            return
+        now = time.monotonic()
+        record = {"time": time.time(), "elapsed": round(now - self.t0, 3), "event": event}
+        if self.stage is not None:
+            record["stage"] = self.stage
+        if done is not None and total is not None:
+            record["done"] = done
+            record["total"] = total
+            if 0 < done:
+                record["eta"] = round((now - self.stage_t0) / done * (total - done), 1)
+        record |= fields
+        with self.lock:
+            self.stream.write(json.dumps(record, default=str) + "\n")
+
+    def stage_start(self, stage: str, **fields: Any):
+        self.stage = stage
+        self.stage_t0 = time.monotonic()
+        self.emit("stage_start", **fields)
+
+    def stage_end(self, **fields: Any):
+        self.emit("stage_end", duration=round(time.monotonic() - self.stage_t0, 3), **fields)
+        self.stage = None
+
+    def close(self):
+        if self.stream is not None and self.stream is not sys.stdout:
+            self.stream.close()
+        self.stream = None
+
+
+class ProgressHandler(logging.Handler):
+    """
+    Forward warnings and errors to the progress stream, so a workflow manager
+    sees why a run is failing without scraping the log
+    """
+
+    def __init__(self, progress: ProgressEmitter):
+        super().__init__(logging.WARNING)
+        self.progress = progress
+
+    def emit(self, record):
+        self.progress.emit("log", level=record.levelname, message=record.getMessage())
+
+
 class Era5GribLogger(logging.Logger):
     def __init__(self):
         super().__init__("Era5grib")
@@ -42,6 +129,37 @@ class Era5GribLogger(logging.Logger):
             logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
         )
         self.addFilter(self.uw_filter)
+        self.progress = ProgressEmitter()
+        self.progress_handler = ProgressHandler(self.progress)
+
+    def start_progress(self, target: Optional[Union[str, int, os.PathLike]]):
+        """
+        Start emitting JSON lines progress events for a run to target, see
+        ProgressEmitter.open. Log messages move to stderr while progress
+        events go to stdout.
+        """
+        if target is None:
+            return
+        self.stop_progress()
+        self.progress = ProgressEmitter()
+        self.progress.open(target)
+        if self.progress.stream is sys.stdout:
+            self.stream_handler.setStream(sys.stderr)
+        self.progress_handler = ProgressHandler(self.progress)
+        self.addHandler(self.progress_handler)
+        self.progress.emit("start", pid=os.getpid())
+
+    def stop_progress(self):
+        """
+        Close the progress target of a run, if there is one
+        """
+        if not self.progress.enabled:
+            return
+        self.removeHandler(self.progress_handler)
+        self.progress.close()
+        self.progress = ProgressEmitter()
+        self.progress_handler = ProgressHandler(self.progress)
+        self.stream_handler.setStream(sys.stdout)
 
     def start(self, level: Optional[Union[str, int]]):
         if self.started:
@@ -111,4 +229,5 @@ def die(msg: str) -> NoReturn:
         log.setLevel(logging.WARNING)
         log._captured_warnings = True
     log.error(msg)
+    log.progress.emit("failed", message=msg)
     sys.exit(-1)
@@ -5,28 +5,130 @@ ERA5 and ERA5Land fields. Can read from custom or standard catalogues and can ac
 replacement files for individual fields
 """
 
-from .data_handling import data_read, data_combine
-from . import command_line
-from .config import conf
-from .parallel import DaskClusterManager
+from .data_handling import data_read, data_combine, staging
+from . import command_line, mirror, output_drivers, plan
+from .config import RunContext
+from .logging import log
+from .parallel import DaskClusterManager, worker_threads
 
+import os
 import sys
+import xarray as xr
 from typing import Optional, List
 
 
 def main(in_args: Optional[List[str]] = None):
     if in_args is None:
         in_args = sys.argv[1:]
+    if in_args and in_args[0] == "mirror":
+        mirror.main(in_args[1:])
+        return
 
-    command_line.parse_args(in_args)
-    with DaskClusterManager():
-        fields = {}
-        for t in conf.get_month_range():
-            fields[t] = data_read.load_fields(t)
-        ds = data_combine.combine(fields)
-        conf.get("writer")(ds)
+    ctx = command_line.parse_args(in_args)
+    try:
+        if ctx.get("plan"):
+            # No cluster needed, nothing is computed
+            sys.exit(plan.run_plan(ctx))
+        threads = worker_threads(ctx)
+        with DaskClusterManager(threads):
+            run(ctx)
+    finally:
+        # run releases its session while the cluster is still up, this is for planning
+        ctx.session.release()
+        log.stop_progress()
 
-    conf.reset()
+
+def run(ctx: RunContext) -> None:
+    progress = log.progress
+    try:
+        ds = build(ctx)
+
+        progress.stage_start("write")
+        write(ctx, ds)
+        progress.stage_end()
+        pool_stats = ctx.session.files.stats()
+    finally:
+        # Nothing more will be computed from the weights or files
+        ctx.session.release()
+
+    log.info(f"File pool: {pool_stats['hits']} hits, {pool_stats['misses']} misses")
+    staging_stats = staging.stats(ctx)
+    if staging.cache_dir(ctx) is not None:
+        lookups = staging_stats["hits"] + staging_stats["misses"]
+        rate = staging_stats["hits"] / lookups if lookups else 0.0
+        log.info(f"Staging cache: {staging_stats['hits']} hits, {staging_stats['misses']} misses ({rate:.0%} hit rate)")
+    progress.emit("finished", file_pool=pool_stats, staging_cache=staging_stats)
+
+
+def build(ctx: RunContext) -> xr.Dataset:
+    """
+    Load every month and return the lazily combined dataset
+    """
+    progress = log.progress
+    months = ctx.get_month_range()
+
+    progress.stage_start("load", months=len(months))
+    fields = {}
+    for i, t in enumerate(months):
+        fields[t] = data_read.load_fields(ctx, t)
+        # Only the lazy graph is built here, so this isn't counted as progress
+        progress.emit("month_opened", month=t.strftime("%Y-%m"), fields=len(fields[t]))
+    progress.stage_end()
+
+    progress.stage_start("combine")
+    try:
+        ds = data_combine.combine(ctx, fields)
+    finally:
+        ctx.session.clear_caches()
+    progress.stage_end(variables=len(ds.data_vars), timesteps=ds.sizes.get("time", 0))
+    return ds
+
+
+def write(ctx: RunContext, ds: xr.Dataset) -> None:
+    domains = ctx.get("domains")
+    if not domains:
+        outputs = output_drivers.write(ctx, ds)
+        report_written(ds.sizes.get("time", 0), outputs, 1, 1)
+        return
+
+    # Nested domains are all trimmed from the union footprint, so each
+    # block is computed once and shared between the drivers
+    log.info(f"Writing {len(domains)} nested domains from shared data")
+    domain_ctxs = []
+    for d in domains:
+        domain_ctx = ctx.replace(
+            {
+                "domain": d["domain"],
+                "start": d["start"],
+                "end": d["end"],
+                "output": d["output"],
+                "outputs": d["outputs"],
+                "domains": None,
+            }
+        )
+        log.info(f"Writing domain {d['name']} to {', '.join(t['output'] for t in d['outputs'])}")
+        domain_ctxs.append(domain_ctx)
+    written = output_drivers.write_domains(ctx, ds, domain_ctxs)
+    for i, (d, domain_ctx, outputs) in enumerate(zip(domains, domain_ctxs, written)):
+        report_written(len(domain_ctx.get_time_range()), outputs, i + 1, len(domains), domain=d["name"])
+
+
+def report_written(timesteps: int, outputs: List, done: int, total: int, **fields) -> None:
+    if not log.progress.enabled:
+        return
+    for t in outputs:
+        output = t["output"]
+        nbytes = os.path.getsize(output) if os.path.exists(output) else None
+        log.progress.emit(
+            "output_written",
+            done=done,
+            total=total,
+            output=output,
+            format=t["format"],
+            timesteps=timesteps,
+            bytes=nbytes,
+            **fields,
+        )
 
 
 if __name__ == "__main__":
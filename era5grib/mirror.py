@@ -0,0 +1,256 @@
+"""
+Build a regional mirror of the ERA5 archive. The configured fields are
+extracted for a region and period into a local store, chunked in small
+tiles of time, latitude and longitude so both time series and maps can be
+read without touching much more than is needed, along with an intake
+catalogue so later runs can read the mirror in place of the archive.
+"""
+
+import argparse
+import json
+import os
+import pandas
+import shutil
+import textwrap
+import yaml
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from . import command_line
+from .config import RunContext
+from .data_handling import data_read
+from .domain import LonRange, bounds, describe
+from .logging import die, log
+from .parallel import DaskClusterManager, worker_threads
+
+# Chunks of the mirrored data, a compromise between time series and map access
+_default_chunks = {"time": 168, "level": 1, "latitude": 32, "longitude": 32}
+_columns = ["parameter", "file_variable", "dataset", "year", "month", "path"]
+# Flags describing the data that carry over from the source catalogue
+_copied_flags = ["realm", "grid_spacing"]
+
+
+def region_key(lat_range: slice, lon_range: LonRange) -> str:
+    """
+    Name of the region a mirror holds, e.g. 20S-10S_139.75E-150.25E. Entries
+    for different regions are kept apart by it.
+    """
+    south, north, west, east = bounds(lat_range, lon_range)
+
+    def lat(v):
+        return f"{abs(v):g}{'S' if v < 0 else 'N'}"
+
+    return f"{lat(south)}-{lat(north)}_{west:g}E-{east:g}E"
+
+
+def mirror_name(ctx: RunContext, source: str) -> str:
+    return f"{ctx.get('mirror_name', 'mirror')}_{region_key(*ctx.get('domain_with_buffer'))}_{source}"
+
+
+def source_flags(ctx: RunContext, source: str) -> Dict:
+    """
+    Flags of the catalogue data was mirrored from. Preferred sub-collections
+    take the flags of the catalogue they were found in.
+    """
+    for cat in ctx.get("catalogues"):
+        if source in (cat, ctx.get(f"catalogue_flags.{cat}.sub_collection_pref")):
+            return {k: ctx.get(f"catalogue_flags.{cat}.{k}") for k in _copied_flags
+                    if ctx.get(f"catalogue_flags.{cat}.{k}") is not None}
+    return {}
+
+
+def entry_path(root: Path, region: str, source: str, dataset: str, field_name: str, t: pandas.Timestamp, store: str) -> Path:
+    suffix = ".zarr" if store == "zarr" else ".nc"
+    return root / region / source / dataset / field_name / f"{field_name}_{t.strftime('%Y%m')}{suffix}"
+
+
+def write_entry(ctx: RunContext, da, path: Path, store: str) -> None:
+    """
+    Write a single field for a month, replacing any existing entry atomically
+    """
+    chunk_conf = ctx.get("mirror_chunks") or {}
+    chunks = {d: min(da.sizes[d], chunk_conf.get(d, _default_chunks.get(d, da.sizes[d]))) for d in da.dims}
+    ds = da.chunk(chunks).to_dataset()
+    for var in ds.variables.values():
+        var.encoding = {}
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    log.info(f"Writing {da.name} to {path}")
+    if store == "zarr":
+        ds.to_zarr(tmp, mode="w", consolidated=True)
+    else:
+        encoding = {da.name: {"zlib": True, "complevel": 1, "chunksizes": [chunks[d] for d in da.dims]}}
+        ds.to_netcdf(tmp, encoding=encoding)
+    if path.is_dir():
+        shutil.rmtree(path)
+    tmp.replace(path)
+
+
+def mirror_month(ctx: RunContext, root: Path, t: pandas.Timestamp, store: str) -> List[Dict]:
+    """
+    Extract every field for the month ending at t from the archive
+    catalogues, returning the catalogue rows of the entries written. The
+    month must be complete in the archive.
+    """
+    rows = []
+    region = region_key(*ctx.get("domain_with_buffer"))
+    fields = data_read.load_fields(ctx, t)
+    for (field_name, ds_type), field in fields.items():
+        for _, da in field.get_dataarrays():
+            source = da.attrs["source"]
+            if source in ctx.get("custom_fields", {}).values():
+                log.info(f"Not mirroring custom field {field_name} from {source}")
+                continue
+            path = entry_path(root, region, source, ds_type, field_name, t, store)
+            write_entry(ctx, da, path, store)
+            rows.append(
+                {
+                    "catalogue": mirror_name(ctx, source),
+                    "source": source,
+                    "parameter": field_name,
+                    "file_variable": da.name,
+                    "dataset": ds_type,
+                    "year": t.year,
+                    "month": t.month,
+                    "path": str(path.resolve()),
+                }
+            )
+    return rows
+
+
+def write_catalogues(ctx: RunContext, root: Path, rows: List[Dict], store: str) -> Path:
+    """
+    Write an intake-esm datastore for each mirrored catalogue, merged with
+    any entries already in the mirror, and an intake catalogue listing them.
+    Returns the path of the intake catalogue.
+    """
+    new = pandas.DataFrame(rows)
+    sources = {}
+    for name, df in new.groupby("catalogue"):
+        source = df.source.iloc[0]
+        csv = root / f"{name}.csv"
+        df = df[_columns]
+        if csv.exists():
+            old = pandas.read_csv(csv)
+            df = pandas.concat([old[~old.path.isin(df.path)], df])
+        df.sort_values(["dataset", "parameter", "year", "month"]).to_csv(csv, index=False)
+
+        esmcat = {
+            "esmcat_version": "0.1.0",
+            "id": name,
+            "description": f"era5grib mirror of {source} over {describe(*ctx.get('domain_with_buffer'))}",
+            "catalog_file": csv.name,
+            "attributes": [{"column_name": c} for c in _columns if c != "path"],
+            "assets": {"column_name": "path", "format": store},
+            "aggregation_control": {
+                "variable_column_name": "file_variable",
+                "groupby_attrs": ["dataset", "parameter", "year", "month"],
+                "aggregations": [{"type": "join_existing", "attribute_name": "month", "options": {"dim": "time"}}],
+            },
+        }
+        with open(root / f"{name}.json", "w") as f:
+            json.dump(esmcat, f, indent=2)
+        sources[name] = {
+            "description": esmcat["description"],
+            "driver": "intake_esm.esm_datastore",
+            "args": {"obj": f"{{{{CATALOG_DIR}}}}/{name}.json"},
+        }
+
+    cat_path = root / "catalogue.yaml"
+    if cat_path.exists():
+        with open(cat_path) as f:
+            sources = (yaml.safe_load(f).get("sources") or {}) | sources
+    with open(cat_path, "w") as f:
+        yaml.safe_dump({"sources": sources}, f)
+    return cat_path
+
+
+def config_fragment(ctx: RunContext, cat_path: Path, names: Dict[str, str]) -> Dict:
+    """
+    Configuration that puts the mirror's catalogues (names mapped to the
+    catalogue each was mirrored from) ahead of the archive catalogues. Each
+    catalogue records the region it holds, so runs outside it skip the mirror.
+    """
+    region = dict(zip(["south", "north", "west", "east"], bounds(*ctx.get("domain_with_buffer"))))
+    flags = {name: source_flags(ctx, source) | {"region": region} for name, source in names.items()}
+    return {
+        "catalogue_paths": [str(cat_path.resolve())] + [p for p in ctx.get("catalogue_paths") if p != str(cat_path.resolve())],
+        "catalogues": list(names) + [c for c in ctx.get("catalogues") if c not in names],
+        "catalogue_flags": flags,
+    }
+
+
+def run_mirror(ctx: RunContext, root: Path, store: str) -> None:
+    rows = []
+    months = ctx.get_month_range()
+    log.progress.stage_start("mirror", months=len(months))
+    for i, t in enumerate(months):
+        rows.extend(mirror_month(ctx, root, t, store))
+        log.progress.emit("month_mirrored", done=i + 1, total=len(months), month=t.strftime("%Y-%m"))
+    log.progress.stage_end()
+    if not rows:
+        die("Error! Nothing was found to mirror")
+
+    cat_path = write_catalogues(ctx, root, rows, store)
+    names = {r["catalogue"]: r["source"] for r in rows}
+    fragment = root / f"era5grib_{region_key(*ctx.get('domain_with_buffer'))}.yaml"
+    with open(fragment, "w") as f:
+        yaml.safe_dump(config_fragment(ctx, cat_path, names), f, sort_keys=False)
+    log.warning(
+        f"Mirrored {len(rows)} entries to {root}. Add the settings in {fragment} to your configuration "
+        "to read from the mirror ahead of the archive"
+    )
+
+
+def main(in_args: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="era5grib mirror",
+        description=textwrap.dedent(__doc__),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('model', nargs='?', help="Legacy entry points, must be one of 'wrf' or 'um'")
+    parser.add_argument('-f', '--file', help="YAML configuration file", type=Path)
+    parser.add_argument("--root", help="Directory to write the mirror to", type=Path, required=True)
+    parser.add_argument("--name", help="Prefix for the mirror's catalogue names", default="mirror")
+    parser.add_argument("--store", help="Storage format", choices=["netcdf", "zarr"], default="netcdf")
+    parser.add_argument("--namelist", help="Read start and end dates from WPS namelist", type=Path)
+    parser.add_argument("--start", help="Mirror start time", type=pandas.to_datetime)
+    parser.add_argument("--end", help="Mirror end time", type=pandas.to_datetime)
+    parser.add_argument("--geo", help="Geogrid file(s) defining the region", type=Path, nargs="+")
+    parser.add_argument("--target", help="UM file on the target grid defining the region", type=Path)
+    parser.add_argument("--era5land", help="Use era5land over land", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--polar", help="Include all longitudes", action=argparse.BooleanOptionalAction)
+    parser.add_argument("--debug", help="Debug output", action="store_true")
+    parser.add_argument("--progress", help="Write JSON lines progress events to a file, '-' for stdout or 'fd:N' for a file descriptor")
+    ns = parser.parse_args(in_args)
+
+    root = ns.root.resolve()
+    ctx = command_line.handle_args(
+        model=ns.model,
+        file=ns.file,
+        output=root,
+        namelist=ns.namelist,
+        geo=ns.geo,
+        target=ns.target,
+        start=ns.start,
+        end=ns.end,
+        era5land=ns.era5land,
+        polar=ns.polar,
+        debug=ns.debug,
+        progress=ns.progress,
+    )
+    # Entries hold whole months, so mirroring another period adds to the
+    # mirror instead of replacing part of a month. Every hour is mirrored,
+    # whatever the output interval
+    start = ctx.get("start").to_period("M").start_time
+    end = ctx.get("end").to_period("M").end_time.floor("h")
+    if start != ctx.get("start") or end != ctx.get("end"):
+        log.warning(f"Mirroring whole months from {start} to {end}")
+    ctx = ctx.replace({"start": start, "end": end, "output_interval": 1, "mirror_name": ns.name})
+    root.mkdir(parents=True, exist_ok=True)
+    try:
+        with DaskClusterManager(worker_threads(ctx)):
+            run_mirror(ctx, root, ns.store)
+    finally:
+        ctx.session.release()
+        log.stop_progress()
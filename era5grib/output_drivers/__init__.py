@@ -0,0 +1,363 @@
+import collections
+import functools
+import importlib
+import pandas
+import re
+import xarray as xr
+from concurrent.futures import ThreadPoolExecutor
+from dask.distributed import as_completed, get_client
+from types import ModuleType
+from typing import Dict, Iterator, List, Optional, Tuple, Type
+
+from ..config import RunContext
+from ..domain import LonRange, select
+from ..logging import die, log
+from ..parallel import task_count
+
+# Blocks computed ahead of the one being written
+_default_write_ahead = 2
+# Tasks submitted to the scheduler at once
+_default_graph_budget = 200000
+# Shards written at once
+_default_shard_writers = 4
+# Placeholders in shard names, with an optional format
+_shard_fields = re.compile(r"{(seq|index|time)(?::([^}]*))?}")
+
+
+class OutputDriver:
+    """
+    Base class for incremental output drivers. A driver module in this
+    package defines a ``Driver`` subclass. The write stage calls ``open``
+    once with the whole (lazy) dataset, ``write_timestep`` with each computed
+    block of time steps and the index of its first time step, and ``close``
+    at the end, so writing overlaps with computing later blocks.
+
+    Drivers that set ``unordered`` accept blocks in any order, and are given
+    each block as soon as it is computed. Otherwise blocks arrive in time order.
+    Drivers that clear ``incremental`` are only opened and closed, and write
+    the whole dataset themselves.
+    """
+
+    unordered = False
+    incremental = True
+
+    def __init__(self, ctx: RunContext):
+        self.ctx = ctx
+
+    def open(self, ds: xr.Dataset) -> None:
+        pass
+
+    def write_timestep(self, block: xr.Dataset, index: int) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class WholeDatasetDriver(OutputDriver):
+    """
+    Adapts a driver module that only has a ``write(ds, ctx)`` function
+    """
+
+    incremental = False
+
+    def __init__(self, ctx: RunContext, module: ModuleType):
+        super().__init__(ctx)
+        self.module = module
+
+    def open(self, ds: xr.Dataset) -> None:
+        self.ds = ds
+
+    def write_timestep(self, block: xr.Dataset, index: int) -> None:
+        pass
+
+    def close(self) -> None:
+        self.module.write(self.ds, self.ctx)
+
+
+class SubsetDriver(OutputDriver):
+    """
+    Hands a driver only the part of each block inside a domain and a range
+    of time steps, so several domains or shards can be written from a single
+    stream of blocks. Indexes are relative to the first of those time steps.
+    """
+
+    def __init__(self, driver: OutputDriver, domain: Optional[Tuple[slice, LonRange]], times: pandas.DatetimeIndex):
+        super().__init__(driver.ctx)
+        self.driver = driver
+        self.domain = domain
+        self.times = times
+        self.unordered = driver.unordered
+        self.incremental = driver.incremental
+
+    def trim(self, ds: xr.Dataset) -> xr.Dataset:
+        if self.domain is not None:
+            ds = select(ds, *self.domain)
+        if "time" in ds.dims:
+            ds = ds.isel(time=ds.indexes["time"].isin(self.times))
+        return ds
+
+    def open(self, ds: xr.Dataset) -> None:
+        self.driver.open(self.trim(ds))
+
+    def write_timestep(self, block: xr.Dataset, index: int) -> None:
+        block = self.trim(block)
+        if "time" not in block.dims:
+            self.driver.write_timestep(block, index)
+        elif block.sizes["time"] > 0:
+            self.driver.write_timestep(block, self.times.get_loc(block.indexes["time"][0]))
+
+    def close(self) -> None:
+        self.driver.close()
+
+
+def get_driver(fmt: str) -> Type[OutputDriver]:
+    """
+    Return the driver class for an output format
+    """
+    try:
+        module = importlib.import_module(f"era5grib.output_drivers.{fmt}")
+    except ModuleNotFoundError:
+        die("Error! Invalid format specifier. A format must have a corresponding"
+            " python source file in output_drivers and contain a 'Driver' class or 'write' function")
+    if hasattr(module, "Driver"):
+        return module.Driver
+    if hasattr(module, "write"):
+        log.debug(f"Output driver for {fmt} writes the whole dataset at once")
+        return functools.partial(WholeDatasetDriver, module=module)
+    die(f"Error! Output driver for {fmt} does not have a 'Driver' class or 'write' function")
+
+
+def time_blocks(ctx: RunContext, ds: xr.Dataset) -> List[Tuple[int, int]]:
+    """
+    Split the time axis into blocks, by default along the dataset's time
+    chunks. Blocks are shrunk (to no less than a time chunk) so the graph
+    submitted for each stays under graph_budget tasks.
+    """
+    n_t = ds.sizes.get("time", 1)
+    chunk = 1
+    for v in ds.data_vars.values():
+        if v.chunks and "time" in v.dims:
+            chunk = v.chunks[v.dims.index("time")][0]
+            break
+    size = ctx.get("write_block") or chunk
+
+    tasks = task_count(ds)
+    budget = ctx.get("graph_budget", _default_graph_budget)
+    per_step = tasks / n_t
+    if budget and size * per_step > budget:
+        size = max(chunk, int(budget / per_step))
+    blocks = [(i, min(i + size, n_t)) for i in range(0, n_t, size)]
+    log.info(f"Graph of about {tasks} tasks, computed in {len(blocks)} blocks of up to {size} time steps")
+    log.progress.emit("graph", tasks=tasks, blocks=len(blocks), block_size=size)
+    return blocks
+
+
+def computed_blocks(ctx: RunContext, ds: xr.Dataset, unordered: bool) -> Iterator[Tuple[xr.Dataset, int]]:
+    """
+    Yield computed blocks of ds with the index of their first time step.
+    With a distributed client, up to write_ahead blocks are computed while the
+    current one is being written, which bounds the memory held by results.
+    """
+    if "time" not in ds.dims:
+        yield ds.compute(), 0
+        return
+    blocks = time_blocks(ctx, ds)
+    try:
+        client = get_client()
+    except ValueError:
+        for i0, i1 in blocks:
+            yield ds.isel(time=slice(i0, i1)).compute(), i0
+        return
+
+    ahead = ctx.get("write_ahead", _default_write_ahead)
+    pending = collections.deque(blocks)
+    in_flight = {}
+
+    def submit():
+        i0, i1 = pending.popleft()
+        future = client.compute(ds.isel(time=slice(i0, i1)))
+        in_flight[future.key] = i0
+        return future
+
+    if unordered:
+        futures = as_completed([submit() for _ in range(min(ahead + 1, len(pending)))])
+        for future in futures:
+            i0 = in_flight.pop(future.key)
+            if pending:
+                futures.add(submit())
+            yield future.result(), i0
+    else:
+        queue = collections.deque(submit() for _ in range(min(ahead + 1, len(pending))))
+        while queue:
+            future = queue.popleft()
+            i0 = in_flight.pop(future.key)
+            if pending:
+                queue.append(submit())
+            yield future.result(), i0
+
+
+def stream(ctx: RunContext, drivers: List[OutputDriver], ds: xr.Dataset) -> None:
+    """
+    Write ds through each driver block by block. Every block is computed
+    once and handed to all of the drivers in turn. Progress is reported as
+    blocks are written, and as the last time step of each month is.
+    """
+    n_t = ds.sizes.get("time", 1)
+    incremental = [d for d in drivers if d.incremental]
+    for driver in drivers:
+        driver.open(ds)
+    if incremental:
+        outputs = [d.ctx.get("output") for d in incremental]
+        unordered = all(d.unordered for d in incremental)
+        months = pandas.DatetimeIndex(ds.time.values).strftime("%Y-%m") if "time" in ds.dims else pandas.Index([])
+        remaining = collections.Counter(months)
+        n_months = len(remaining)
+        written = 0
+        for block, i0 in computed_blocks(ctx, ds, unordered):
+            for driver in incremental:
+                driver.write_timestep(block, i0)
+            n = block.sizes.get("time", 1)
+            written += n
+            log.progress.emit("timesteps_written", done=written, total=n_t, outputs=outputs)
+            for month in months[i0:i0 + n]:
+                remaining[month] -= 1
+                if remaining[month] == 0:
+                    done = sum(1 for v in remaining.values() if v == 0)
+                    log.progress.emit("month_written", done=done, total=n_months, month=month, outputs=outputs)
+    for driver in drivers:
+        driver.close()
+
+
+def write(ctx: RunContext, ds: xr.Dataset) -> List[Dict]:
+    """
+    Write ds to every output target, split into shards along time if
+    'shard' is set. Shards are written concurrently by independent drivers.
+    Returns the targets written, with the name of each shard.
+    """
+    bounds = shards(ctx, ds)
+    if len(bounds) == 1:
+        stream(ctx, open_drivers(ctx), ds)
+        return list(ctx.get("outputs"))
+
+    shard_ctxs = shard_contexts(ctx, ds, bounds)
+    log.info(f"Writing {len(bounds)} shards")
+
+    def write_shard(shard_ctx: RunContext, i0: int, i1: int):
+        stream(shard_ctx, open_drivers(shard_ctx), ds.isel(time=slice(i0, i1)))
+
+    with ThreadPoolExecutor(ctx.get("shard_writers", _default_shard_writers)) as pool:
+        futures = [pool.submit(write_shard, c, i0, i1) for c, (i0, i1) in zip(shard_ctxs, bounds)]
+        for f in futures:
+            # Re-raise any errors from the writers
+            f.result()
+    return [t for c in shard_ctxs for t in c.get("outputs")]
+
+
+def write_domains(ctx: RunContext, ds: xr.Dataset, domain_ctxs: List[RunContext]) -> List[List[Dict]]:
+    """
+    Write several domains trimmed from ds, such as nested WRF domains, each
+    to its own targets and time range from its context. Every block of ds is
+    computed once and each domain's drivers (one per shard, if 'shard' is
+    set) are handed their part of it, so nothing is held beyond a block.
+    Returns the targets written for each domain.
+    """
+    drivers = []
+    written = []
+    for domain_ctx in domain_ctxs:
+        domain_ds = select(ds, *domain_ctx.get("domain"))
+        if "time" in ds.dims:
+            domain_ds = domain_ds.sel(time=domain_ctx.get_time_range())
+        bounds = shards(domain_ctx, domain_ds)
+        shard_ctxs = [domain_ctx] if len(bounds) == 1 else shard_contexts(domain_ctx, domain_ds, bounds)
+        for shard_ctx, (i0, i1) in zip(shard_ctxs, bounds):
+            times = domain_ds.indexes["time"][i0:i1] if "time" in domain_ds.dims else None
+            drivers.extend(SubsetDriver(d, domain_ctx.get("domain"), times) for d in open_drivers(shard_ctx))
+        written.append([t for c in shard_ctxs for t in c.get("outputs")])
+    if any(d.incremental for d in drivers) and not all(d.incremental for d in drivers):
+        die("Error! Output formats that write the whole dataset at once can't be combined with other output"
+            " formats in the same run")
+    stream(ctx, drivers, ds)
+    return written
+
+
+def shard_contexts(ctx: RunContext, ds: xr.Dataset, bounds: List[Tuple[int, int]]) -> List[RunContext]:
+    """
+    A context for each shard of ds, with the shard's output names
+    """
+    shard_ctxs = []
+    for i, (i0, i1) in enumerate(bounds):
+        t0 = pandas.Timestamp(ds.time.values[i0])
+        outputs = [t | {"output": shard_name(t["output"], i, t0)} for t in ctx.get("outputs")]
+        shard_ctxs.append(ctx.replace({"outputs": outputs, "output": outputs[0]["output"]}))
+    return shard_ctxs
+
+
+def shards(ctx: RunContext, ds: xr.Dataset) -> List[Tuple[int, int]]:
+    """
+    Split the time axis into shards: every 'shard' time steps if it is a
+    number, or by calendar 'day' or 'month'
+    """
+    spec = ctx.get("shard")
+    if spec is None or "time" not in ds.dims:
+        return [(0, ds.sizes.get("time", 1))]
+    times = pandas.DatetimeIndex(ds.time.values)
+    if isinstance(spec, int) and spec > 0:
+        starts = list(range(0, len(times), spec))
+    elif spec in ("day", "month"):
+        keys = times.floor("D") if spec == "day" else times.to_period("M").start_time
+        starts = [i for i in range(len(times)) if i == 0 or keys[i] != keys[i - 1]]
+    else:
+        die(f"Error! 'shard' must be a number of time steps, 'day' or 'month', got {spec}")
+    return list(zip(starts, starts[1:] + [len(times)]))
+
+
+def wps_sequence(i: int) -> str:
+    """
+    The i'th suffix in the sequence used by WPS link_grib.csh: AAA, AAB, ... AAZ, ABA, ...
+    """
+    if i >= 26**3:
+        die("Error! Too many shards for a three letter sequence")
+    return "".join(chr(ord("A") + (i // 26**p) % 26) for p in (2, 1, 0))
+
+
+def shard_name(output: str, i: int, t0: pandas.Timestamp) -> str:
+    """
+    Name of the i'th shard of output, whose first time step is t0. '{seq}'
+    (the WPS sequence), '{index}' and '{time}' (e.g. '{time:%Y%m%d}') in output
+    are replaced, and any other braces are left alone. Otherwise a trailing
+    '.AAA' is replaced by the sequence, or the sequence is appended.
+    """
+    output = str(output)
+
+    def field(m: re.Match) -> str:
+        name, spec = m.group(1), m.group(2)
+        if name == "seq":
+            return wps_sequence(i)
+        if name == "index":
+            return format(i, spec or "")
+        return t0.strftime(spec or "%Y-%m-%dT%H")
+
+    if _shard_fields.search(output):
+        return _shard_fields.sub(field, output)
+    if output.endswith(".AAA"):
+        return output[:-3] + wps_sequence(i)
+    return f"{output}.{wps_sequence(i)}"
+
+
+def open_drivers(ctx: RunContext) -> List[OutputDriver]:
+    """
+    Create a driver for each of the run's output targets. Drivers that write
+    the whole dataset would compute it again, so they can't be combined with
+    incremental drivers.
+    """
+    drivers = [t["driver"](target_context(ctx, t)) for t in ctx.get("outputs")]
+    whole = [d.ctx.get("format") for d in drivers if not d.incremental]
+    if whole and len(whole) < len(drivers):
+        die(f"Error! Output formats {', '.join(whole)} write the whole dataset at once and can't be combined"
+            " with other output formats in the same run")
+    return drivers
+
+
+def target_context(ctx: RunContext, target: Dict) -> RunContext:
+    return ctx.replace({"output": str(target["output"]), "format": target["format"]})
@@ -1,12 +1,17 @@
 import os
+import shutil
 import subprocess
 import tempfile
 import xarray as xr
 
-from ..config import conf
+from ..config import RunContext
+from . import OutputDriver
 
 
-def write(ds: xr.Dataset):
+def to_grib(ds: xr.Dataset, out_name: str):
+    """
+    Convert ds to GRIB1 with CDO, by way of a temporary netCDF file
+    """
     ds.time.encoding["units"] = "hours since 1970-01-01"
 
     encoding = {k: {"complevel": 0, "chunksizes": None, "_FillValue": -1e10} for k in ds.keys()}
@@ -15,4 +20,30 @@ def write(ds: xr.Dataset):
     with tempfile.NamedTemporaryFile(dir=os.environ.get("TMPDIR", "/tmp")) as f:
         tmp_name = f.name
         ds.to_netcdf(tmp_name, encoding=encoding)
-        subprocess.run(["cdo", "-v", "-f", "grb1", "-t", "ecmwf", "copy", tmp_name, conf.get("output")], check=True)
+        subprocess.run(["cdo", "-v", "-f", "grb1", "-t", "ecmwf", "copy", tmp_name, out_name], check=True)
+
+
+class Driver(OutputDriver):
+    """
+    GRIB1 files are a sequence of self-contained messages, so each block of
+    time steps is converted on its own and appended to the output. Time
+    invariant fields are only written with the first block.
+    """
+
+    def open(self, ds: xr.Dataset) -> None:
+        self.output = open(self.ctx.get("output"), "wb")
+
+    def write_timestep(self, block: xr.Dataset, index: int) -> None:
+        if index > 0:
+            block = block.drop_vars([k for k, v in block.data_vars.items() if "time" not in v.dims])
+        with tempfile.NamedTemporaryFile(dir=os.environ.get("TMPDIR", "/tmp"), suffix=".grib") as f:
+            to_grib(block, f.name)
+            with open(f.name, "rb") as g:
+                shutil.copyfileobj(g, self.output)
+
+    def close(self) -> None:
+        self.output.close()
+
+
+def write(ds: xr.Dataset, ctx: RunContext):
+    to_grib(ds, ctx.get("output"))
@@ -1,13 +1,17 @@
+import netCDF4
+import pandas
 import xarray as xr
+from xarray.backends.locks import HDF5_LOCK
 
-from ..config import conf
+from ..config import RunContext
+from . import OutputDriver
 
 
-def write(ds: xr.Dataset):
+def get_encoding(ds: xr.Dataset, ctx: RunContext):
     ds.time.encoding["units"] = "hours since 1970-01-01"
     # Correct chunking if we know what the chunks should be
     if "source" in ds.attrs:
-        chunkspec = conf.get(f"catalogue_flags.{ds.attrs['source']}.chunks", "auto")
+        chunkspec = ctx.get(f"catalogue_flags.{ds.attrs['source']}.chunks", "auto")
     else:
         chunkspec = "auto"
         chunks = None
@@ -25,5 +29,44 @@ def write(ds: xr.Dataset):
         else:
             chunks = None
         encoding[field_name] = {"chunksizes": chunks} | ds[field_name].encoding
+    return encoding
 
-    ds.to_netcdf(conf.get("output"), encoding=encoding)
+
+class Driver(OutputDriver):
+    """
+    The file is created up front with an unlimited time dimension and no
+    time steps, then each block of time steps is written into its slot, so
+    blocks can arrive in any order
+    """
+
+    unordered = True
+
+    def open(self, ds: xr.Dataset) -> None:
+        encoding = get_encoding(ds, self.ctx)
+        # xarray takes the HDF5 lock itself
+        ds.isel(time=slice(0, 0)).to_netcdf(self.ctx.get("output"), encoding=encoding, unlimited_dims=["time"])
+        with HDF5_LOCK:
+            self.nc = netCDF4.Dataset(self.ctx.get("output"), "r+")
+
+    def write_timestep(self, block: xr.Dataset, index: int) -> None:
+        # HDF5 isn't thread safe, and shards may be written from several threads
+        n = block.sizes["time"]
+        with HDF5_LOCK:
+            time = self.nc.variables["time"]
+            time[index:index + n] = netCDF4.date2num(
+                pandas.to_datetime(block.time.values).to_pydatetime(), time.units, getattr(time, "calendar", "standard")
+            )
+            for k, v in block.variables.items():
+                if "time" not in v.dims or k == "time":
+                    continue
+                key = tuple(slice(index, index + n) if d == "time" else slice(None) for d in v.dims)
+                self.nc.variables[k][key] = v.values
+
+    def close(self) -> None:
+        # Time invariant variables were written with the empty file
+        with HDF5_LOCK:
+            self.nc.close()
+
+
+def write(ds: xr.Dataset, ctx: RunContext):
+    ds.to_netcdf(ctx.get("output"), encoding=get_encoding(ds, ctx))
@@ -2,10 +2,19 @@ import logging
 import os
 import resource
 import socket
+import threading
+import uuid
+from typing import Any, Dict, List, Optional
 
-from dask.distributed import Client
+from dask.base import is_dask_collection
+from dask.distributed import Client, get_client
 from dask.distributed.diagnostics.plugin import WorkerPlugin
 
+from .logging import log
+
+# Objects shared with the workers by every SharedObjects in this process,
+# by key. Keys are unique, so owners only ever add and remove their own.
+_shared_objects: Dict[str, Any] = {}
 
 class CaptureWarningsPlugin(WorkerPlugin):
     def setup(self, worker):
@@ -15,6 +24,115 @@ class CaptureWarningsPlugin(WorkerPlugin):
         logging.captureWarnings(False)
 
 
+class SharedObjectPlugin(WorkerPlugin):
+    def __init__(self, key: str, obj: Any):
+        self.key = key
+        self.obj = obj
+        self.name = f"era5grib-shared-{key}"
+
+    def setup(self, worker):
+        _shared_objects[self.key] = self.obj
+
+    def teardown(self, worker):
+        _shared_objects.pop(self.key, None)
+
+
+class SharedObjects:
+    """
+    Large read-only objects (e.g. regridding weights) shared with every
+    worker, so tasks can refer to them by key instead of carrying a copy
+    each. Each build owns one, and release() only removes the objects and
+    worker plugins it registered itself, so builds in the same process don't
+    affect each other.
+    """
+
+    def __init__(self):
+        self.keys: List[str] = []
+        self.plugins: List[str] = []
+        self._lock = threading.Lock()
+
+    def share(self, obj: Any) -> str:
+        """
+        Make obj available to every worker once and return the key to look
+        it up with inside tasks. Workers that start later get it through the
+        plugin too. Without a distributed client, the object is only
+        registered locally.
+        """
+        key = uuid.uuid4().hex
+        _shared_objects[key] = obj
+        with self._lock:
+            self.keys.append(key)
+        try:
+            client = get_client()
+        except ValueError:
+            return key
+        plugin = SharedObjectPlugin(key, obj)
+        client.register_worker_plugin(plugin, name=plugin.name)
+        with self._lock:
+            self.plugins.append(plugin.name)
+        return key
+
+    def release(self, client: Optional[Client] = None) -> None:
+        """
+        Forget the objects shared through this instance, removing them from
+        the workers of client (or the current client). Only call once nothing
+        that was built with them will be computed again.
+        """
+        with self._lock:
+            keys, names = self.keys, self.plugins
+            self.keys, self.plugins = [], []
+        for key in keys:
+            _shared_objects.pop(key, None)
+        if not names:
+            return
+        if client is None:
+            try:
+                client = get_client()
+            except ValueError:
+                return
+        for name in names:
+            try:
+                client.unregister_worker_plugin(name)
+            except ValueError:
+                # Already gone, e.g. the workers were restarted
+                log.debug(f"Worker plugin {name} was not registered")
+
+
+def lookup(key: str) -> Any:
+    return _shared_objects[key]
+
+
+def worker_threads(ctx: Any) -> int:
+    """
+    Threads per worker for a run. HDF5 serialises reads within a process,
+    so threads only help when reads go through the reference engine.
+    """
+    return ctx.get("threads_per_worker") or (4 if ctx.get("read_engine") == "reference" else 1)
+
+
+def task_count(obj: Any) -> int:
+    """
+    Estimate the number of tasks in the graph of a Dataset or DataArray
+    without materialising it. Layers that are already materialised are
+    counted exactly, other layers as one task per chunk of the largest
+    variable built from them.
+    """
+    variables = obj.variables.values() if hasattr(obj, "data_vars") else [obj.variable]
+    layers = {}
+    for var in variables:
+        if not is_dask_collection(var.data):
+            continue
+        graph = var.data.__dask_graph__()
+        for name, layer in getattr(graph, "layers", {id(graph): graph}).items():
+            if name in layers:
+                layers[name] = max(layers[name], var.data.npartitions)
+            elif getattr(layer, "is_materialized", lambda: True)():
+                layers[name] = len(layer)
+            else:
+                layers[name] = var.data.npartitions
+    return sum(layers.values())
+
+
 class DaskClusterManager:
     @staticmethod
     def cpus_from_cpuset() -> int:
@@ -51,7 +169,10 @@ class DaskClusterManager:
 
         return len(cpuset)
 
-    def __init__(self):
+    def __init__(self, threads_per_worker: int = 1):
+        # netCDF4/HDF5 reads are serialised within a process, so only use
+        # threads when reads don't go through HDF5
+        self.threads_per_worker = threads_per_worker
         self.client = None
 
     def __enter__(self):
@@ -65,7 +186,8 @@ class DaskClusterManager:
             # On a login node
             n_procs = 2
             mem = "3GB"
-        self.client = Client(n_workers=n_procs, threads_per_worker=1, memory_limit=mem)
+        n_workers = max(1, n_procs // self.threads_per_worker)
+        self.client = Client(n_workers=n_workers, threads_per_worker=self.threads_per_worker, memory_limit=mem)
         self.client.register_worker_plugin(CaptureWarningsPlugin())
         self.client.forward_logging()
 
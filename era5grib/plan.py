@@ -0,0 +1,202 @@
+import math
+import os
+import sys
+from collections import namedtuple
+from dask.utils import format_bytes, parse_bytes
+from pandas import DatetimeIndex, Timestamp
+from typing import Dict, List, NamedTuple, Optional, TextIO, Tuple
+
+from .config import RunContext
+from .data_handling import chunking, data_read, file_pool
+from .data_handling.era5field import Era5field
+from .data_handling.xarray_legacy_read import open_kwargs
+from .domain import describe, select
+from .logging import log
+from .parallel import worker_threads
+
+# Rough throughput of a single process reading compressed ERA5 data from
+# Lustre, used for the walltime estimate
+_default_read_rate = "50MiB"
+# Approximate tasks per chunk: open, trim, decode, regrid, merge, write
+_tasks_per_chunk = 6
+
+Hyperslab = namedtuple("Hyperslab", ["month", "catalogue", "path", "variable", "domain", "times", "levels", "nbytes", "chunks"])
+
+
+class PlannedField(Era5field):
+    """
+    An Era5field that records the hyperslabs that would be read instead of
+    holding data, so catalogue searches can be resolved without reading
+    """
+
+    def add_dataarray(self, slab: Hyperslab, realm: str) -> None:
+        self.data_arrays[realm] = slab
+
+
+def plan_month(ctx: RunContext, cats: List[NamedTuple], t: Timestamp) -> Tuple[Dict[Tuple[str, str], PlannedField], List[str]]:
+    """
+    Resolve the catalogue searches for a month as data_read.get_data does,
+    recording the hyperslabs to read. Only catalogue tables and file
+    metadata are read: the layout of the first file of each catalogue and
+    the time coordinate of every file, to find hours missing from the files.
+    Returns the planned fields and a list of problems.
+    """
+    inverse_equivs = {v: k for k, v in (ctx.get("equivalent_vars", {})).items()}
+    custom_field_cat_key = ctx.get("custom_field_catalogue_key")
+    problems = []
+    # The hours open_result reads, static fields included
+    needed = data_read.month_times(ctx, t)
+
+    fields = data_read.init_fields(ctx, PlannedField)
+    for r in data_read.resolve_catalogues(ctx, cats, t, fields):
+        if r.cat.name == custom_field_cat_key:
+            for field, fn in ctx.get("custom_fields").items():
+                if not os.path.exists(fn):
+                    problems.append(f"Custom field {field}: {fn} does not exist")
+                    continue
+                realm = ctx.get(f"custom_field_flags.{field}", "global")
+                slab = Hyperslab(t, custom_field_cat_key, fn, field, ctx.get("domain_with_buffer"), 0, 1, 0, {})
+                fields[(field, "single-levels")].add_dataarray(slab, realm)
+            continue
+
+        dataset = r.dataset or r.cat.name
+        path_col = r.result.esmcat.assets.column_name
+        file_times = {}
+        for _, row in r.result.df.iterrows():
+            path = row[path_col]
+            field_name = inverse_equivs.get(row["parameter"], row["parameter"])
+            key = data_read.field_key(fields, field_name, r.dataset)
+            if key is None:
+                continue
+            sizes, _, coords = chunking.disk_layout(ctx, r.cat.name, dataset, path)
+            coords = select(coords, *r.domain)
+            points = coords.sizes["latitude"] * coords.sizes["longitude"]
+
+            levels = sizes.get("level", 1)
+            selected = r.file_levels.get(row["file_variable"])
+            if "level" in sizes and selected is not None:
+                levels = len(selected)
+            chunks = ctx.get(f"catalogue_flags.{r.cat.name}.chunks")
+            if chunks is None:
+                chunks = chunking.plan_chunks(ctx, r.cat.name, dataset, path, t, r.domain, levels)
+            nbytes = len(needed) * levels * points * chunking._bytes_per_value
+
+            realm = data_read.field_realm(ctx, r.cat.name, field_name)
+            slab = Hyperslab(t, r.cat.name, path, row["file_variable"], r.domain, len(needed), levels, nbytes, dict(chunks))
+            fields[key].add_dataarray(slab, realm)
+
+            ds = file_pool.open_dataset(ctx, path, **open_kwargs(ctx))
+            if "time" in ds.indexes:
+                file_times[key] = ds.indexes["time"].union(file_times[key]) if key in file_times else ds.indexes["time"]
+
+        # As open_result checks, across the files of each field
+        for key, times in file_times.items():
+            missing = missing_times(needed, times)
+            if missing is not None:
+                problems.append(
+                    f"{key[0]} ({key[1]}) for {t.strftime('%Y-%m')}: {len(missing)} time steps from {missing[0]}"
+                    f" to {missing[-1]} are not in {r.cat.name}"
+                )
+
+    for (field_name, ds_type), field in fields.items():
+        if not field.is_complete():
+            found = ", ".join(field.data_arrays) or "nowhere"
+            problems.append(f"{field_name} ({ds_type}) for {t.strftime('%Y-%m')}: only found on {found}")
+    return fields, problems
+
+
+def missing_times(needed: DatetimeIndex, times: DatetimeIndex) -> Optional[DatetimeIndex]:
+    """
+    The time steps in needed that are not in a field's files, or None if none
+    are missing. Files with none of the time steps hold time-invariant data.
+    """
+    found = times.intersection(needed)
+    if len(found) == 0 or len(found) == len(needed):
+        return None
+    return needed.difference(found)
+
+
+def n_chunks(slab: Hyperslab) -> int:
+    n = math.ceil(max(slab.times, 1) / max(slab.chunks.get("time", 1), 1))
+    lev = slab.chunks.get("level", -1)
+    if lev and lev > 0:
+        n *= math.ceil(slab.levels / lev)
+    return n
+
+
+def run_plan(ctx: RunContext, out: Optional[TextIO] = None) -> int:
+    """
+    Report what a run would read and estimates of its cost to out, without
+    reading any data. The report goes to stdout by default, or to stderr if
+    progress events are written to stdout. Returns non-zero if any inputs
+    are missing.
+    """
+    if out is None:
+        out = sys.stderr if log.progress.stream is sys.stdout else sys.stdout
+
+    def report(line: str) -> None:
+        out.write(line + "\n")
+
+    cats = data_read.get_catalogues(ctx)
+    slabs = []
+    problems = []
+    output_fields = {}
+    for t in ctx.get_month_range():
+        fields, month_problems = plan_month(ctx, list(cats), t)
+        problems.extend(month_problems)
+        for (field_name, ds_type), field in fields.items():
+            for slab in field.data_arrays.values():
+                slabs.append(slab)
+                output_fields[(field_name, ds_type)] = max(output_fields.get((field_name, ds_type), 1), slab.levels)
+
+    report(f"Time range: {ctx.get('start')} - {ctx.get('end')} ({len(ctx.get_time_range())} steps)")
+    report(f"Domain: {describe(*ctx.get('domain'))}")
+    report(f"Read domain: {describe(*ctx.get('domain_with_buffer'))}")
+    report("Hyperslabs to read:")
+    for s in slabs:
+        if s.catalogue == ctx.get("custom_field_catalogue_key"):
+            report(f"  {s.month.strftime('%Y-%m')} {s.variable:>8} {s.path} (custom field)")
+            continue
+        report(
+            f"  {s.month.strftime('%Y-%m')} {s.variable:>8} {s.path} "
+            f"[{describe(*s.domain)}, {s.times} times, {s.levels} levels] {format_bytes(s.nbytes)}"
+        )
+
+    # Estimates
+    bytes_read = sum(s.nbytes for s in slabs)
+    max_chunk = max((s.nbytes / n_chunks(s) for s in slabs if s.nbytes), default=0)
+    threads = worker_threads(ctx)
+    peak = int(max_chunk * chunking._budget_fraction * threads)
+    tasks = sum(n_chunks(s) for s in slabs) * _tasks_per_chunk
+
+    lat_range, lon_range = ctx.get("domain")
+    target_spacing = ctx.get(f"catalogue_flags.{ctx.get('regrid')}.grid_spacing") or 0.25
+    if ctx.get("sites"):
+        target_points = len(ctx.get("sites"))
+    else:
+        target_points = chunking.domain_points((lat_range, lon_range), target_spacing)
+    bytes_per_value = 2 if ctx.get("format") == "grib" else ctx.get("data_types", 32) // 8
+    output_size = len(ctx.get_time_range()) * sum(output_fields.values()) * target_points * bytes_per_value
+
+    max_tasks_per_month = max((sum(n_chunks(s) for s in slabs if s.month == t) for t in ctx.get_month_range()), default=1)
+    ncpus = min(48, max(1, max_tasks_per_month))
+    mem_gb = max(4, math.ceil(peak * max(1, ncpus // threads) * 1.2 / 2**30))
+    read_rate = parse_bytes(str(ctx.get("plan_read_rate", _default_read_rate)))
+    walltime = bytes_read / (read_rate * ncpus)
+    # Twice the estimate, rounded up to 15 minutes
+    wall_mins = max(15, math.ceil(2 * walltime / 60 / 15) * 15)
+
+    report("Estimates:")
+    report(f"  Data read (uncompressed): {format_bytes(bytes_read)} in {len(slabs)} hyperslabs")
+    report(f"  Peak memory per worker: {format_bytes(peak)}")
+    report(f"  Tasks: ~{tasks}")
+    report(f"  Output size: {format_bytes(output_size)}")
+    report(f"  Suggested PBS request: -l ncpus={ncpus},mem={mem_gb}GB,walltime={wall_mins // 60:02d}:{wall_mins % 60:02d}:00")
+
+    if problems:
+        report("Missing inputs:")
+        for p in problems:
+            report(f"  {p}")
+        log.error(f"{len(problems)} problems found with inputs")
+        return 1
+    return 0
@@ -0,0 +1,50 @@
+import threading
+from typing import IO, Any, Dict, Tuple
+
+from .data_handling.file_pool import FilePool
+from .parallel import SharedObjects
+
+
+class Session:
+    """
+    The state belonging to a single build: the file pool, the objects shared
+    with the workers, and caches that only hold for its configuration. A
+    session travels in the RunContext (``ctx.session``), so builds in the same
+    process never see or release each other's files and weights.
+    """
+
+    def __init__(self):
+        self.files = FilePool()
+        self.shared = SharedObjects()
+        # Custom fields are the same for every month, so only resolve them once
+        self.custom_fields: Dict[Tuple, Any] = {}
+        # File layouts by catalogue and dataset
+        self.layouts: Dict[Tuple[str, str], Any] = {}
+        self.staging_stats = {"hits": 0, "misses": 0}
+        # Staged cache entries in use, locked against eviction by path
+        self.pins: Dict[str, IO] = {}
+        self.lock = threading.Lock()
+
+    def clear_caches(self) -> None:
+        """
+        Forget the custom fields and file layouts seen while building, the
+        dataset holds what it uses
+        """
+        with self.lock:
+            self.custom_fields.clear()
+            self.layouts.clear()
+
+    def release(self, client=None) -> None:
+        """
+        Free the objects shared with the workers of client (or the current
+        client), close the files opened by this session and unpin its staged
+        cache entries. Datasets built with it can no longer be computed
+        afterwards. Other sessions are not affected.
+        """
+        self.clear_caches()
+        self.shared.release(client)
+        self.files.close()
+        with self.lock:
+            pins, self.pins = self.pins, {}
+        for f in pins.values():
+            f.close()
@@ -0,0 +1,97 @@
+import csv
+import numpy
+import xarray as xr
+from pathlib import Path
+from typing import Dict, Mapping, Tuple
+
+from . import domain
+from .data_handling.rectilinear import axis_weights
+from .logging import die, log
+
+
+def read_sites(fn: Path) -> Dict[str, Tuple[float, float]]:
+    """
+    Read sites from a CSV file of name,latitude,longitude lines. Blank lines,
+    lines starting with '#' and a header line are skipped.
+    """
+    sites = {}
+    with open(fn, newline="") as f:
+        for row in csv.reader(f):
+            if not row or row[0].strip().startswith("#"):
+                continue
+            if len(row) != 3:
+                die(f"Error! Sites must be given as name,latitude,longitude, got {','.join(row)}")
+            name, lat, lon = (i.strip() for i in row)
+            try:
+                sites[name] = (float(lat), float(lon))
+            except ValueError:
+                if not sites:
+                    # Header line
+                    continue
+                die(f"Error! Invalid coordinates for site {name}: {lat},{lon}")
+    if not sites:
+        die(f"Error! No sites found in {fn}")
+    return sites
+
+
+def site_domain(sites: Mapping[str, Tuple[float, float]]) -> Tuple[slice, domain.LonRange]:
+    """
+    The smallest domain containing every site. The regridding buffer around
+    it provides the interpolation stencil.
+    """
+    lats = numpy.array([lat for lat, _ in sites.values()])
+    lons = numpy.array([lon for _, lon in sites.values()]) % 360
+    if (numpy.abs(lats) > 90).any():
+        die("Error! Site latitudes must be between -90 and 90")
+    log.info(f"Extracting {len(sites)} sites")
+    return domain.domain_from_coords(lats, lons, False, 0.0)
+
+
+def _stencil(src: numpy.ndarray, tgt: numpy.ndarray, periodic: bool = False) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    # The two source points either side of each target and their weights
+    w, outside = axis_weights(src, tgt, "bilinear", periodic)
+    if outside.any():
+        die(f"Error! Sites at {tgt[outside]} are outside the data read")
+    w = w.toarray()
+    idx = numpy.argsort(-w, axis=1, kind="stable")[:, :2]
+    return idx, numpy.take_along_axis(w, idx, axis=1)
+
+
+class SiteInterpolator:
+    """
+    Bilinearly interpolates a field to a set of sites, in place of a
+    regridder. Only the four grid points around each site are indexed, so
+    each chunk of the source data is read once for all of the sites in it.
+    Corners with no data (e.g. ERA5-Land over the ocean) are left out and
+    the remaining weights renormalised, so land and ocean fields can still
+    be blended with the land mask at each site.
+    """
+
+    def __init__(self, sites: Mapping[str, Tuple[float, float]]):
+        self.names = list(sites)
+        self.lats = numpy.array([sites[n][0] for n in self.names])
+        self.lons = numpy.array([sites[n][1] for n in self.names]) % 360
+
+    def __call__(self, field: xr.DataArray) -> xr.DataArray:
+        # Longitudes may have been stitched across the Greenwich meridian
+        src_lon = field.longitude.values
+        spacing = abs(src_lon[1] - src_lon[0]) if src_lon.size > 1 else 360
+        periodic = bool(numpy.isclose(src_lon.max() - src_lon.min() + spacing, 360))
+        lat_idx, lat_w = _stencil(field.latitude.values, self.lats)
+        lon_idx, lon_w = _stencil(src_lon, src_lon[0] + (self.lons - src_lon[0]) % 360, periodic)
+
+        dims = ["site", "corner"]
+        corners = field.isel(
+            latitude=xr.DataArray(numpy.repeat(lat_idx, 2, axis=1), dims=dims),
+            longitude=xr.DataArray(numpy.tile(lon_idx, (1, 2)), dims=dims),
+        ).drop_vars(["latitude", "longitude"])
+        weights = xr.DataArray(numpy.repeat(lat_w, 2, axis=1) * numpy.tile(lon_w, (1, 2)), dims=dims)
+        weights = weights.where(corners.notnull(), 0)
+        out = (corners.fillna(0) * weights).sum("corner") / weights.sum("corner")
+
+        out = out.astype(field.dtype).assign_coords(
+            site=self.names, latitude=("site", self.lats), longitude=("site", self.lons)
+        )
+        out.name = field.name
+        out.attrs = field.attrs
+        return out
@@ -0,0 +1,60 @@
+import numpy
+import pandas
+import xarray as xr
+
+from era5grib.config import RunContext
+from era5grib.data_handling.chunking import domain_points, plan_chunks, time_chunk
+from era5grib.session import Session
+
+
+def test_domain_points_split_domain():
+    assert domain_points((slice(10.0, 0.0), slice(0.0, 9.0)), 1.0) == 110
+    assert domain_points((slice(10.0, 0.0), (slice(355.0, None), slice(None, 4.0))), 1.0) == 110
+
+
+def test_time_chunk_bounded_by_month_and_budget():
+    ctx = RunContext(
+        {
+            "start": pandas.Timestamp("2020-01-31T12:00"),
+            "end": pandas.Timestamp("2020-02-02T23:00"),
+            "catalogues": ["era5", "era5_land"],
+            "catalogue_flags": {"era5": {"grid_spacing": 0.25}, "era5_land": {"grid_spacing": 0.1}},
+            "domain_with_buffer": (slice(10.0, 0.0), slice(0.0, 9.9)),
+        }
+    )
+    t = pandas.Timestamp("2020-01-31")
+    assert time_chunk(ctx, t, 2**30) == 12
+    assert time_chunk(ctx, pandas.Timestamp("2020-02-29"), 2**30) == 48
+    # 101 x 100 points on the 0.1 degree grid
+    assert time_chunk(ctx, t, 101 * 100 * 4 * 5) == 5
+
+
+def test_time_chunk_follows_disk_chunks(tmp_path):
+    time = pandas.date_range("2020-01-01", periods=24, freq="h")
+    lat = numpy.arange(10.0, -0.5, -1.0)
+    lon = numpy.arange(0.0, 10.0, 1.0)
+    path = tmp_path / "t.nc"
+    xr.DataArray(
+        numpy.zeros((time.size, lat.size, lon.size), dtype="f4"),
+        coords={"time": time, "latitude": lat, "longitude": lon},
+        dims=["time", "latitude", "longitude"],
+        name="t",
+    ).to_netcdf(path, encoding={"t": {"zlib": True, "chunksizes": (4, lat.size, lon.size)}})
+    step = lat.size * lon.size * 4
+    ctx = RunContext(
+        {
+            "session": Session(),
+            "start": time[0],
+            "end": time[-1],
+            "catalogues": ["era5"],
+            "catalogue_flags": {"era5": {"grid_spacing": 1.0}},
+            "domain_with_buffer": (slice(10.0, 0.0), slice(0.0, 9.0)),
+        }
+    )
+    t = ctx.get_month_range()[0]
+    dom = ctx.get("domain_with_buffer")
+    # Rounded down to a multiple of the disk chunk, and never less than one
+    assert plan_chunks(ctx.replace({"chunk_memory": 10 * step}), "era5", "t", str(path), t, dom)["time"] == 8
+    ctx.session.clear_caches()
+    assert plan_chunks(ctx.replace({"chunk_memory": 3 * step}), "era5", "t", str(path), t, dom)["time"] == 4
+    ctx.session.release()
@@ -0,0 +1,48 @@
+import pandas
+import pytest
+
+from era5grib.config import Era5gribConfig, RunContext
+
+
+def test_freeze_flattens_keys():
+    conf = Era5gribConfig()
+    conf.update("wrf_era5")
+    conf.set("start", pandas.Timestamp("2020-01-31T12:00"))
+    conf.set("end", pandas.Timestamp("2020-02-01T12:00"))
+    ctx = conf.freeze()
+
+    assert ctx.get("catalogue_flags.era5.grid_spacing") == 0.25
+    assert ctx.get("catalogue_flags.era5")["sub_collection_pref"] == "era5-1"
+    assert "stl1" in ctx.get("land_only")
+    assert ctx.get("not.a.key", "default") == "default"
+    assert "custom_fields" not in ctx
+    assert len(ctx.get_time_range()) == 25
+    assert len(ctx.get_month_range()) == 2
+
+
+def test_context_is_immutable():
+    ctx = RunContext({"fields": {"single-levels": ["2t"]}})
+    with pytest.raises(AttributeError):
+        ctx.foo = 1
+    with pytest.raises(TypeError):
+        ctx.get("fields")["pressure-levels"] = ["t"]
+    with pytest.raises(AttributeError):
+        ctx.get("fields.single-levels").append("sp")
+
+
+def test_replace_recalculates_time_range():
+    ctx = RunContext({"start": pandas.Timestamp("2020-01-01T00:00"), "end": pandas.Timestamp("2020-01-01T05:00")})
+    new_ctx = ctx.replace({"end": pandas.Timestamp("2020-01-01T11:00"), "catalogue_flags.era5.chunks.time": 1})
+
+    assert len(ctx.get_time_range()) == 6
+    assert len(new_ctx.get_time_range()) == 12
+    assert new_ctx.get("catalogue_flags.era5.chunks") == {"time": 1}
+    assert "catalogue_flags.era5.chunks" not in ctx
+
+
+def test_output_interval_subsamples_time_range():
+    ctx = RunContext(
+        {"start": pandas.Timestamp("2020-01-01T00:00"), "end": pandas.Timestamp("2020-01-02T00:00"), "output_interval": 6}
+    )
+    assert list(ctx.get_time_range().hour) == [0, 6, 12, 18, 0]
+    assert len(ctx.replace({"output_interval": 3}).get_time_range()) == 9
@@ -0,0 +1,85 @@
+import numpy
+import pandas
+import xarray as xr
+
+from era5grib.config import RunContext
+from era5grib.data_handling.data_combine import batch_regrid
+from era5grib.data_handling.era5field import Era5field
+from era5grib.data_handling.rectilinear import RectilinearRegridder
+
+
+def field_da(name, scale, levels=None):
+    lat = numpy.arange(-20, -30.05, -0.1)
+    lon = numpy.arange(140, 150.05, 0.1)
+    time = pandas.date_range("2020-01-01", periods=2, freq="h")
+    lat2, lon2 = numpy.meshgrid(lat, lon, indexing="ij")
+    data = numpy.broadcast_to(scale * (2 * lat2 + 0.5 * lon2), (2, lat.size, lon.size))
+    da = xr.DataArray(
+        data, coords={"time": time, "latitude": lat, "longitude": lon}, dims=["time", "latitude", "longitude"], name=name
+    )
+    if levels is not None:
+        da = da.expand_dims({"level": levels}, axis=1)
+    da.attrs["source"] = "era5land"
+    return da.chunk({"time": 1})
+
+
+def test_batch_regrid_matches_single():
+    ctx = RunContext({"chunk_memory": "64MiB"})
+    tgt = field_da("t", 1).isel(time=0, drop=True)
+    tgt = tgt.sel(latitude=slice(-21, -29), longitude=slice(141, 149)).coarsen(latitude=2, longitude=2, boundary="trim").mean()
+    regridders = {"era5land": RectilinearRegridder(field_da("x", 1), tgt, "bilinear")}
+
+    fields = {}
+    for name, scale, levels in [("a", 1, None), ("b", 2, None), ("c", 3, [850, 500]), ("d", 4, [1000, 700])]:
+        fields[(name, "single-levels")] = Era5field(name, ctx)
+        fields[(name, "single-levels")].add_dataarray(field_da(name, scale, levels), "land_only")
+    expected = {k: regridders["era5land"](f.data_arrays["land_only"]) for k, f in fields.items()}
+
+    done = batch_regrid(ctx, fields, regridders)
+    assert len(done) == 4
+    for k, f in fields.items():
+        out = f.data_arrays["land_only"]
+        assert out.name == k[0]
+        assert out.dims == expected[k].dims
+        numpy.testing.assert_allclose(out.values, expected[k].values, rtol=1e-10)
+    # Levels are not mixed up between fields with the same number of levels
+    assert list(fields[("d", "single-levels")].data_arrays["land_only"].level.values) == [1000, 700]
+
+
+def test_reserved_realms_count_towards_complete():
+    ctx = RunContext({"land_only": ["swvl1"], "ocean_only": ["sst"]})
+
+    # A reserved realm and an opened realm
+    field = Era5field("2t", ctx)
+    field.reserve("ocean_only")
+    field.add_dataarray(field_da("2t", 1), "land_only")
+    assert field.is_complete()
+    assert len(field) == 1
+    assert list(field.reserved) == ["ocean_only"]
+
+    # A reserved realm only, that doesn't cover the field
+    field = Era5field("2t", ctx)
+    field.reserve("land_only")
+    assert not field.is_complete()
+    assert len(field) == 0
+
+    # A reserved realm that does cover the field
+    field = Era5field("swvl1", ctx)
+    field.reserve("land_only")
+    assert field.is_complete()
+
+    # Realms that are already opened are not reserved again
+    field = Era5field("2t", ctx)
+    field.add_dataarray(field_da("2t", 1), "ocean_only")
+    field.reserve("ocean_only")
+    assert field.reserved == []
+    assert not field.is_complete()
+
+
+def test_opened_realms_keep_reserved_order():
+    field = Era5field("2t", RunContext({}))
+    field.reserve("land_only")
+    field.reserve("ocean_only")
+    field.add_dataarray(field_da("2t", 2), "ocean_only")
+    field.add_dataarray(field_da("2t", 1), "land_only")
+    assert [realm for realm, _ in field.get_dataarrays()] == ["land_only", "ocean_only"]
@@ -0,0 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import numpy
+import pandas
+import pytest
+import xarray as xr
+
+from era5grib.config import RunContext
+from era5grib.data_handling.data_read import handle_custom_field, open_result, submit_result
+from era5grib.session import Session
+
+
+def level_file(path, time):
+    lat = numpy.arange(2.0, -0.5, -1.0)
+    lon = numpy.arange(0.0, 3.0, 1.0)
+    da = xr.DataArray(
+        numpy.random.rand(time.size, 3, lat.size, lon.size).astype("f4"),
+        coords={"time": time, "level": [1000.0, 850.0, 500.0], "latitude": lat, "longitude": lon},
+        dims=["time", "level", "latitude", "longitude"],
+        name="t",
+    )
+    da.to_netcdf(path)
+    return da
+
+
+def test_open_result(tmp_path):
+    # A month split over two files, listed out of order
+    first = level_file(tmp_path / "t_a.nc", pandas.date_range("2020-01-01T00", periods=3, freq="h"))
+    second = level_file(tmp_path / "t_b.nc", pandas.date_range("2020-01-01T03", periods=5, freq="h"))
+    df = pandas.DataFrame({"file_variable": ["t", "t"], "path": [str(tmp_path / "t_b.nc"), str(tmp_path / "t_a.nc")]})
+    result = SimpleNamespace(df=df, esmcat=SimpleNamespace(assets=SimpleNamespace(column_name="path")))
+
+    ctx = RunContext({"session": Session(), "start": pandas.Timestamp("2020-01-01T00"), "end": pandas.Timestamp("2020-01-01T05")})
+    t = ctx.get_month_range()[0]
+    domain = (slice(2.0, 0.0), slice(0.0, 2.0))
+    file_levels = {"t": [850.0]}
+    with ThreadPoolExecutor(2) as pool:
+        opened = submit_result(ctx, pool, result, domain, t, file_levels)
+        assert opened["t"][0] == [str(tmp_path / "t_a.nc"), str(tmp_path / "t_b.nc")]
+        out = open_result(ctx, t, opened, {"time": 2, "latitude": -1, "longitude": -1}, file_levels)
+
+    ds = out["t"]
+    assert (ds.indexes["time"] == ctx.get_time_range()).all()
+    assert ds.level.values.tolist() == [850.0]
+    assert ds.t.chunks[0] == (2, 2, 2)
+    assert ds.t.dtype == numpy.float32
+    expected = xr.concat([first, second], "time").sel(level=[850.0]).isel(time=slice(0, 6))
+    numpy.testing.assert_array_equal(ds.t.values, expected.values)
+
+    # Hours missing from the files
+    late = ctx.replace({"end": pandas.Timestamp("2020-01-01T09")})
+    with ThreadPoolExecutor(2) as pool:
+        opened = submit_result(late, pool, result, domain, t, file_levels)
+        with pytest.raises(SystemExit):
+            open_result(late, t, opened, {"time": 2}, file_levels)
+    ctx.session.release()
+
+
+def test_custom_field_chunks(tmp_path):
+    time = pandas.date_range("2020-01-01T00", periods=10, freq="h")
+    lat = numpy.arange(10.0, -10.5, -1.0)
+    lon = numpy.arange(100.0, 120.5, 1.0)
+    xr.DataArray(
+        numpy.random.rand(time.size, lat.size, lon.size).astype("f4"),
+        coords={"time": time, "latitude": lat, "longitude": lon},
+        dims=["time", "latitude", "longitude"],
+        name="sst",
+    ).to_netcdf(tmp_path / "sst.nc")
+
+    # 13 x 13 points in the buffered domain, three time steps per chunk
+    ctx = RunContext({
+        "session": Session(),
+        "start": pandas.Timestamp("2020-01-01T00"),
+        "end": pandas.Timestamp("2020-01-01T05"),
+        "domain": (slice(5.0, -5.0), slice(105.0, 115.0)),
+        "domain_with_buffer": (slice(6.0, -6.0), slice(104.0, 116.0)),
+        "chunk_memory": "2100B",
+    })
+    da = handle_custom_field(ctx, "sst", tmp_path / "sst.nc")
+    assert da.chunks == ((3, 3), (13,), (13,))
+    assert (da.indexes["time"] == ctx.get_time_range()).all()
+
+    # Loaded once per build
+    again = handle_custom_field(ctx, "sst", tmp_path / "sst.nc")
+    assert len(ctx.session.custom_fields) == 1
+    assert again.data.name == da.data.name
+    ctx.session.release()
@@ -0,0 +1,85 @@
+import numpy
+import xarray as xr
+
+from era5grib import domain
+
+
+def era5_like():
+    lat = numpy.arange(90, -90.25, -0.25)
+    lon = numpy.arange(0, 360, 0.25)
+    return xr.DataArray(
+        numpy.broadcast_to(lon, (lat.size, lon.size)),
+        coords={"latitude": lat, "longitude": lon},
+        dims=["latitude", "longitude"],
+    )
+
+
+def test_lon_extent():
+    assert domain.lon_extent(numpy.array([100, 120, 150])) == (100, 150)
+    # Crosses Greenwich
+    assert domain.lon_extent(numpy.array([-10, 0, 10])) == (350, 10)
+    assert domain.lon_extent(numpy.array([355, 360, 370])) == (355, 10)
+    # Global
+    assert domain.lon_extent(numpy.arange(0, 360, 0.25)) is None
+
+
+def test_buffer_split_domain():
+    lat_range, lon_range = domain.get_domain_with_buffer(slice(60, 30), (slice(349, None), slice(None, 11)))
+    assert lat_range == slice(61, 29)
+    assert lon_range == (slice(348, None), slice(None, 12))
+
+
+def test_select_split_domain():
+    da = era5_like()
+    lon_range = (slice(349, None), slice(None, 11))
+    out = domain.select(da, slice(60, 30), lon_range)
+
+    assert out.longitude.size == (11 + 11) * 4 + 1
+    assert numpy.all(numpy.diff(out.longitude) > 0)
+    assert out.longitude[0] == -11
+    assert out.longitude[-1] == 11
+    assert domain.covers(out, slice(60, 30), lon_range)
+    assert not domain.covers(out, slice(60, 30), (slice(340, None), slice(None, 11)))
+    # Selecting again from stitched data is a no-op
+    assert domain.select(out, slice(60, 30), lon_range).equals(out)
+
+
+def test_unrotate_pole():
+    # Rotated origin of the UKV grid sits at (52.5, -2.5)
+    lat, lon = domain.unrotate_pole(numpy.array([0.0]), numpy.array([0.0]), 37.5, 177.5)
+    numpy.testing.assert_allclose(lat, [52.5])
+    numpy.testing.assert_allclose(lon, [357.5])
+
+    # Unrotated pole is the identity
+    lat, lon = domain.unrotate_pole(numpy.array([-30.0, 10.0]), numpy.array([140.0, 20.0]), 90.0, 180.0)
+    numpy.testing.assert_allclose(lat, [-30.0, 10.0], atol=1e-10)
+    numpy.testing.assert_allclose(lon, [140.0, 20.0], atol=1e-10)
+
+
+def test_halo_size():
+    lat_range, lon_range = domain.domain_from_coords(numpy.array([-40.0, -20.0]), numpy.array([110.0, 150.0]), False, 0.5)
+    assert lat_range == slice(-19.5, -40.5)
+    assert lon_range == slice(109.5, 150.5)
+
+
+def test_halo_crossing_greenwich():
+    # Target east of Greenwich whose halo reaches across it
+    lat_range, lon_range = domain.domain_from_coords(numpy.array([40.0, 50.0]), numpy.array([0.5, 10.0]), False, 1.0)
+    assert lon_range == (slice(359.5, None), slice(None, 11.0))
+    lat_range, lon_range = domain.get_domain_with_buffer(slice(50, 40), slice(0.5, 10.0))
+    assert lon_range == (slice(359.5, None), slice(None, 11.0))
+
+
+def test_contains():
+    region = (slice(-10.0, -20.0), slice(139.75, 150.25))
+    assert domain.from_bounds(*domain.bounds(*region)) == region
+    assert domain.contains(region, (slice(-12.0, -18.0), slice(140.0, 150.0)))
+    assert not domain.contains(region, (slice(-12.0, -21.0), slice(140.0, 150.0)))
+    assert not domain.contains(region, (slice(-12.0, -18.0), slice(140.0, 151.0)))
+    # Across Greenwich
+    split = (slice(60.0, 30.0), (slice(348.0, None), slice(None, 12.0)))
+    assert domain.from_bounds(*domain.bounds(*split)) == split
+    assert domain.contains(split, (slice(50.0, 40.0), slice(350.0, 359.0)))
+    assert domain.contains(split, (slice(50.0, 40.0), slice(1.0, 10.0)))
+    assert not domain.contains(split, (slice(50.0, 40.0), slice(10.0, 20.0)))
+    assert domain.contains((slice(None), slice(None)), split)
@@ -0,0 +1,23 @@
+import numpy as np
+import xarray as xr
+
+from era5grib.data_handling.file_pool import FilePool
+
+
+def test_pool_reuses_and_evicts(tmp_path):
+    paths = []
+    for i in range(3):
+        paths.append(tmp_path / f"f{i}.nc")
+        xr.Dataset({"a": ("x", np.arange(3) + i)}).to_netcdf(paths[-1])
+
+    pool = FilePool(maxsize=2)
+    ds = pool.open(paths[0])
+    assert pool.open(paths[0]) is ds
+    pool.open(paths[1])
+    pool.open(paths[2])
+    assert pool.stats() == {"hits": 1, "misses": 3, "open": 2}
+    # Evicted files are reopened
+    assert pool.open(paths[0]) is not ds
+    assert int(pool.open(paths[2]).a[0]) == 2
+    pool.close()
+    assert pool.stats()["open"] == 0
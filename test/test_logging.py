@@ -0,0 +1,66 @@
+import json
+
+import numpy
+import pandas
+import pytest
+import xarray as xr
+
+from era5grib.config import RunContext
+from era5grib.logging import ProgressEmitter, die, log
+from era5grib.output_drivers import OutputDriver, stream
+
+
+def events(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_progress_events(tmp_path):
+    progress = ProgressEmitter()
+    progress.emit("ignored")
+    progress.open(str(tmp_path / "progress.jsonl"))
+    progress.stage_start("write")
+    progress.emit("timesteps_written", done=1, total=4)
+    progress.stage_end()
+    progress.close()
+
+    start, written, end = events(tmp_path / "progress.jsonl")
+    assert start["event"] == "stage_start" and start["stage"] == "write"
+    assert written["done"] == 1 and written["total"] == 4 and "eta" in written
+    assert end["event"] == "stage_end" and "duration" in end
+
+
+@pytest.fixture
+def progress_file(tmp_path):
+    path = tmp_path / "progress.jsonl"
+    log.progress.open(str(path))
+    yield path
+    log.progress.close()
+
+
+def test_die_emits_failed(progress_file):
+    with pytest.raises(SystemExit):
+        die("Error! Something broke")
+    assert events(progress_file)[-1] | {"time": 0, "elapsed": 0} == {
+        "time": 0, "elapsed": 0, "event": "failed", "message": "Error! Something broke"
+    }
+
+
+def test_write_progress(progress_file):
+    time = pandas.date_range("2020-01-31T20", periods=8, freq="h")
+    ds = xr.Dataset({"t": ("time", numpy.arange(time.size))}, coords={"time": time}).chunk({"time": 2})
+
+    class Null(OutputDriver):
+        def write_timestep(self, block, index):
+            pass
+
+    ctx = RunContext({"output": "out.nc"})
+    stream(ctx, [Null(ctx)], ds)
+    written = [e for e in events(progress_file) if e["event"] in ("timesteps_written", "month_written")]
+    assert [(e["event"], e["done"], e["total"]) for e in written] == [
+        ("timesteps_written", 2, 8),
+        ("timesteps_written", 4, 8),
+        ("month_written", 1, 2),
+        ("timesteps_written", 6, 8),
+        ("timesteps_written", 8, 8),
+        ("month_written", 2, 2),
+    ]
@@ -0,0 +1,49 @@
+import json
+import yaml
+
+from era5grib.config import RunContext
+from era5grib.mirror import config_fragment, region_key, write_catalogues
+
+
+def test_catalogues(tmp_path):
+    ctx = RunContext(
+        {
+            "catalogues": ["era5_land", "era5"],
+            "catalogue_paths": ["/archive/catalogue.yaml"],
+            "catalogue_flags": {
+                "era5_land": {"realm": "land_only", "grid_spacing": 0.1},
+                "era5": {"sub_collection_pref": "era5-1", "grid_spacing": 0.25},
+            },
+            "domain_with_buffer": (slice(-10, -20), slice(140, 150)),
+        }
+    )
+    rows = [
+        {"catalogue": "mirror_era5_land", "source": "era5_land", "parameter": "2t", "file_variable": "t2m",
+         "dataset": "single-levels", "year": 2020, "month": m, "path": f"/m/2t_2020{m:02d}.nc"}
+        for m in (1, 2)
+    ] + [
+        {"catalogue": "mirror_era5-1", "source": "era5-1", "parameter": "u", "file_variable": "u",
+         "dataset": "pressure-levels", "year": 2020, "month": 1, "path": "/m/u_202001.nc"}
+    ]
+    cat_path = write_catalogues(ctx, tmp_path, rows, "netcdf")
+    # Extending the mirror keeps the existing entries
+    write_catalogues(ctx, tmp_path, rows[1:2], "netcdf")
+
+    assert (tmp_path / "mirror_era5_land.csv").read_text().count("\n") == 3
+    esmcat = json.loads((tmp_path / "mirror_era5-1.json").read_text())
+    assert esmcat["assets"]["column_name"] == "path"
+    cat = yaml.safe_load(cat_path.read_text())
+    assert set(cat["sources"]) == {"mirror_era5_land", "mirror_era5-1"}
+
+    conf = config_fragment(ctx, cat_path, {r["catalogue"]: r["source"] for r in rows})
+    assert conf["catalogue_paths"] == [str(cat_path), "/archive/catalogue.yaml"]
+    assert conf["catalogues"] == ["mirror_era5_land", "mirror_era5-1", "era5_land", "era5"]
+    region = {"south": -20.0, "north": -10.0, "west": 140.0, "east": 150.0}
+    assert conf["catalogue_flags"]["mirror_era5_land"] == {"realm": "land_only", "grid_spacing": 0.1, "region": region}
+    assert conf["catalogue_flags"]["mirror_era5-1"] == {"grid_spacing": 0.25, "region": region}
+
+
+def test_region_key():
+    assert region_key(slice(-10, -20), slice(139.75, 150.25)) == "20S-10S_139.75E-150.25E"
+    assert region_key(slice(60, 30), (slice(349, None), slice(None, 11))) == "30N-60N_349E-11E"
+    assert region_key(slice(None), slice(None)) == "90S-90N_0E-360E"
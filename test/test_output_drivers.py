@@ -0,0 +1,142 @@
+import numpy
+import pandas
+import pytest
+import xarray as xr
+
+from era5grib.command_line import domain_output
+from era5grib.config import RunContext
+from era5grib.output_drivers import OutputDriver, WholeDatasetDriver, grib, netcdf, open_drivers, shard_name, shards
+from era5grib.output_drivers import stream, wps_sequence, write_domains
+
+
+def test_wps_sequence():
+    assert [wps_sequence(i) for i in (0, 1, 25, 26, 27)] == ["AAA", "AAB", "AAZ", "ABA", "ABB"]
+
+
+def test_shards():
+    time = pandas.date_range("2020-01-30T18", "2020-02-01T06", freq="6h")
+    ds = xr.Dataset({"t": ("time", numpy.zeros(len(time)))}, coords={"time": time})
+
+    assert shards(RunContext({}), ds) == [(0, 7)]
+    assert shards(RunContext({"shard": 3}), ds) == [(0, 3), (3, 6), (6, 7)]
+    assert shards(RunContext({"shard": "day"}), ds) == [(0, 1), (1, 5), (5, 7)]
+    assert shards(RunContext({"shard": "month"}), ds) == [(0, 5), (5, 7)]
+
+
+def test_shard_name():
+    t0 = pandas.Timestamp("2020-01-31T06")
+    assert shard_name("GRIBFILE.AAA", 27, t0) == "GRIBFILE.ABB"
+    assert shard_name("era5.{time:%Y%m%d}.nc", 1, t0) == "era5.20200131.nc"
+    assert shard_name("{other}/era5.{index:03d}.{time}.nc", 1, t0) == "{other}/era5.001.2020-01-31T06.nc"
+    assert shard_name("out.grib", 0, t0) == "out.grib.AAA"
+
+
+def test_domain_output():
+    assert domain_output("met_em.grib", "d02") == "met_em.grib.d02"
+    assert domain_output("{domain}/GRIBFILE.{seq}", "d01") == "d01/GRIBFILE.{seq}"
+
+
+def test_write_domains():
+    time = pandas.date_range("2020-01-01", periods=4, freq="h")
+    lat = numpy.arange(10.0, -0.5, -1.0)
+    lon = numpy.arange(0.0, 10.0, 1.0)
+    ds = xr.Dataset(
+        {"t": (("time", "latitude", "longitude"), numpy.random.rand(time.size, lat.size, lon.size))},
+        coords={"time": time, "latitude": lat, "longitude": lon},
+    ).chunk({"time": 1})
+
+    drivers = {}
+
+    class Recorder(OutputDriver):
+        def open(self, ds):
+            drivers[self.ctx.get("output")] = self
+            self.ds = ds
+            self.blocks = []
+
+        def write_timestep(self, block, index):
+            self.blocks.append((index, block))
+
+    domain_ctxs = []
+    for name, dom, start, end in [
+        ("d01", (slice(10.0, 0.0), slice(0.0, 9.0)), time[0], time[-1]),
+        ("d02", (slice(5.0, 2.0), slice(3.0, 6.0)), time[1], time[2]),
+    ]:
+        outputs = [{"output": domain_output("out.nc", name), "format": "netcdf", "driver": Recorder}]
+        domain_ctxs.append(
+            RunContext({"domain": dom, "start": start, "end": end, "output_interval": 1, "outputs": outputs, "output": outputs[0]["output"]})
+        )
+
+    written = write_domains(RunContext({}), ds, domain_ctxs)
+    assert [[t["output"] for t in w] for w in written] == [["out.nc.d01"], ["out.nc.d02"]]
+    assert [i for i, _ in drivers["out.nc.d01"].blocks] == [0, 1, 2, 3]
+    d02 = drivers["out.nc.d02"]
+    assert dict(d02.ds.sizes) == {"time": 2, "latitude": 4, "longitude": 4}
+    assert [i for i, _ in d02.blocks] == [0, 1]
+    for i, block in d02.blocks:
+        expected = ds.t.sel(time=time[1 + i : 2 + i], latitude=slice(5.0, 2.0), longitude=slice(3.0, 6.0))
+        numpy.testing.assert_array_equal(block.t.values, expected.values)
+
+
+def blocks_dataset():
+    time = pandas.date_range("2020-01-01", periods=6, freq="h")
+    lat = numpy.arange(2.0, -0.5, -1.0)
+    lon = numpy.arange(0.0, 4.0, 1.0)
+    return xr.Dataset(
+        {
+            "t": (("time", "latitude", "longitude"), numpy.random.rand(time.size, lat.size, lon.size).astype("f4")),
+            "lsm": (("latitude", "longitude"), numpy.ones((lat.size, lon.size), dtype="f4")),
+        },
+        coords={"time": time, "latitude": lat, "longitude": lon},
+    )
+
+
+def test_netcdf_unordered_blocks(tmp_path):
+    ds = blocks_dataset()
+    out = tmp_path / "out.nc"
+    driver = netcdf.Driver(RunContext({"output": str(out)}))
+    driver.open(ds)
+    for i0 in (4, 0, 2):
+        driver.write_timestep(ds.isel(time=slice(i0, i0 + 2)), i0)
+    driver.close()
+
+    with xr.open_dataset(out) as written:
+        assert written.time.equals(ds.time)
+        numpy.testing.assert_array_equal(written.t.values, ds.t.values)
+        numpy.testing.assert_array_equal(written.lsm.values, ds.lsm.values)
+
+
+def test_grib_appends_blocks(tmp_path, monkeypatch):
+    def fake_to_grib(block, out_name):
+        with open(out_name, "w") as f:
+            f.write(f"{sorted(block.data_vars)} {block.sizes['time']}\n")
+
+    monkeypatch.setattr(grib, "to_grib", fake_to_grib)
+    ds = blocks_dataset()
+    out = tmp_path / "out.grib"
+    driver = grib.Driver(RunContext({"output": str(out)}))
+    driver.open(ds)
+    for i0 in (0, 2, 4):
+        driver.write_timestep(ds.isel(time=slice(i0, i0 + 2)), i0)
+    driver.close()
+    # Time invariant fields only come with the first block
+    assert out.read_text().splitlines() == ["['lsm', 't'] 2", "['t'] 2", "['t'] 2"]
+
+
+def test_open_drivers_rejects_mixed(tmp_path):
+    whole = lambda ctx: WholeDatasetDriver(ctx, netcdf)  # noqa: E731
+    outputs = [
+        {"output": str(tmp_path / "a.nc"), "format": "netcdf", "driver": netcdf.Driver},
+        {"output": str(tmp_path / "b.nc"), "format": "whole", "driver": whole},
+    ]
+    with pytest.raises(SystemExit):
+        open_drivers(RunContext({"outputs": outputs}))
+    assert len(open_drivers(RunContext({"outputs": outputs[1:]}))) == 1
+
+
+def test_stream_writes_every_block(tmp_path):
+    ds = blocks_dataset().chunk({"time": 2})
+    out = tmp_path / "out.nc"
+    ctx = RunContext({"output": str(out)})
+    stream(ctx, [netcdf.Driver(ctx)], ds)
+    with xr.open_dataset(out) as written:
+        numpy.testing.assert_array_equal(written.t.values, ds.t.values)
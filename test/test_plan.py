@@ -0,0 +1,63 @@
+import io
+from types import SimpleNamespace
+
+import numpy
+import pandas
+import xarray as xr
+
+from era5grib.config import RunContext
+from era5grib.plan import plan_month, run_plan
+from era5grib.session import Session
+
+
+class Catalogue:
+    # Just enough of an intake-esm datastore for catalogue searches
+    def __init__(self, name, df):
+        self.name = name
+        self.df = df
+
+    def search(self, parameter, year, month):
+        df = self.df[self.df.parameter.isin(parameter) & (self.df.year == year) & (self.df.month == month)]
+        return SimpleNamespace(df=df, esmcat=SimpleNamespace(assets=SimpleNamespace(column_name="path")))
+
+
+def test_plan_reports_missing_hour(tmp_path):
+    # Like the ERA5-Land archive, which starts at 1981-01-01 01Z
+    time = pandas.date_range("2020-01-01T01", "2020-01-01T23", freq="h")
+    lat = numpy.arange(10.0, -0.5, -1.0)
+    lon = numpy.arange(0.0, 10.0, 1.0)
+    path = tmp_path / "2t_202001.nc"
+    xr.DataArray(
+        numpy.zeros((time.size, lat.size, lon.size), dtype="f4"),
+        coords={"time": time, "latitude": lat, "longitude": lon},
+        dims=["time", "latitude", "longitude"],
+        name="t2m",
+    ).to_netcdf(path)
+    df = pandas.DataFrame([{"parameter": "2t", "file_variable": "t2m", "year": 2020, "month": 1, "path": str(path)}])
+    cat = Catalogue("era5_land", df)
+
+    ctx = RunContext(
+        {
+            "session": Session(),
+            "start": pandas.Timestamp("2020-01-01T00"),
+            "end": pandas.Timestamp("2020-01-01T06"),
+            "fields": {"single-levels": ["2t"]},
+            "catalogues": ["era5_land"],
+            "catalogue_flags": {"era5_land": {"grid_spacing": 1.0}},
+            "domain": (slice(8.0, 2.0), slice(2.0, 8.0)),
+            "domain_with_buffer": (slice(9.0, 1.0), slice(1.0, 9.0)),
+        }
+    )
+    t = ctx.get_month_range()[0]
+    fields, problems = plan_month(ctx, [cat], t)
+    assert fields[("2t", "single-levels")].is_complete()
+    assert problems == ["2t (single-levels) for 2020-01: 1 time steps from 2020-01-01 00:00:00 to 2020-01-01 00:00:00 are not in era5_land"]
+
+    # Nothing missing once the run starts after the gap
+    later = ctx.replace({"start": pandas.Timestamp("2020-01-01T01")})
+    assert plan_month(later, [cat], t)[1] == []
+
+    out = io.StringIO()
+    assert run_plan(ctx.replace({"catalogue_paths": []}), out) == 1
+    assert "Missing inputs:" in out.getvalue()
+    ctx.session.release()
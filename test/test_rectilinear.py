@@ -0,0 +1,48 @@
+import numpy
+import pytest
+import xarray as xr
+
+from era5grib.data_handling.rectilinear import RectilinearRegridder
+
+
+def grid(lat, lon, f=None):
+    lat2, lon2 = numpy.meshgrid(lat, lon, indexing="ij")
+    data = 2 * lat2 + 0.5 * lon2 if f is None else f(lat2, lon2)
+    return xr.DataArray(data, coords={"latitude": lat, "longitude": lon}, dims=["latitude", "longitude"], name="f")
+
+
+def test_bilinear_reproduces_linear_field():
+    # ERA5-Land like source, ERA5 like target, both with descending latitudes
+    src = grid(numpy.arange(-20, -40.05, -0.1), numpy.arange(140, 160.05, 0.1))
+    tgt = grid(numpy.arange(-22, -38.01, -0.25), numpy.arange(142, 158.01, 0.25))
+
+    out = RectilinearRegridder(src, tgt, "bilinear")(src.chunk({"latitude": 50}))
+    numpy.testing.assert_allclose(out.values, tgt.values, rtol=1e-10, atol=1e-12)
+    assert out.latitude.equals(tgt.latitude)
+
+
+def test_nearest():
+    src = grid(numpy.arange(0, 10.0), numpy.arange(0, 10.0))
+    tgt = grid(numpy.array([0.4, 5.6]), numpy.array([2.2, 8.9]))
+
+    out = RectilinearRegridder(src, tgt, "nearest_s2d")(src)
+    numpy.testing.assert_allclose(out.values, src.sel(latitude=[0, 6], longitude=[2, 9]).values)
+
+
+def test_periodic_longitude():
+    src = grid(numpy.arange(-10, 10.1, 1.0), numpy.arange(0, 360, 1.0), lambda lat, lon: numpy.cos(numpy.deg2rad(lon)))
+    tgt = grid(numpy.array([0.0]), numpy.array([359.5]))
+
+    out = RectilinearRegridder(src, tgt, "bilinear")(src)
+    numpy.testing.assert_allclose(out.values, (numpy.cos(numpy.deg2rad(359)) + 1) / 2)
+
+
+def test_matches_xesmf():
+    xesmf = pytest.importorskip("xesmf")
+    f = lambda lat, lon: numpy.sin(numpy.deg2rad(3 * lat)) * numpy.cos(numpy.deg2rad(5 * lon))  # noqa: E731
+    src = grid(numpy.arange(-20, -40.05, -0.1), numpy.arange(140, 160.05, 0.1), f)
+    tgt = grid(numpy.arange(-22, -38.01, -0.25), numpy.arange(142, 158.01, 0.25), f)
+
+    expected = xesmf.Regridder(src.to_dataset(), tgt.to_dataset(), "bilinear")(src)
+    out = RectilinearRegridder(src, tgt, "bilinear")(src)
+    numpy.testing.assert_allclose(out.values, expected.values, atol=1e-4)
@@ -0,0 +1,53 @@
+import numpy
+import pytest
+import xarray as xr
+
+from era5grib.config import RunContext
+from era5grib.data_handling import file_pool, reference
+from era5grib.session import Session
+
+
+def test_index_path(tmp_path):
+    path = tmp_path / "archive" / "2t_202001.nc"
+    root = tmp_path / "index"
+    ctx = RunContext({"reference_index": str(root)})
+    assert reference.index_path(ctx, path) is None
+    assert reference.index_path(RunContext({}), path) is None
+
+    # Indices mirror the archive layout under the index root
+    base = root / path.resolve().relative_to("/")
+    base.parent.mkdir(parents=True)
+    parq = base.with_name(base.name + ".parq")
+    parq.mkdir()
+    assert reference.index_path(ctx, path) == parq
+    # JSON indices are preferred
+    json_index = base.with_name(base.name + ".json")
+    json_index.write_text("{}")
+    assert reference.index_path(ctx, path) == json_index
+
+
+def test_open_reference(tmp_path):
+    pytest.importorskip("kerchunk")
+    pytest.importorskip("fsspec")
+    pytest.importorskip("zarr")
+    path = tmp_path / "archive" / "t.nc"
+    path.parent.mkdir()
+    ds = xr.Dataset(
+        {"t": (("time", "latitude"), numpy.random.rand(4, 3).astype("f4"))},
+        coords={"time": numpy.arange(4), "latitude": [1.0, 0.0, -1.0]},
+    )
+    ds.to_netcdf(path, engine="netcdf4", encoding={"t": {"zlib": True, "chunksizes": (2, 3)}})
+    index = reference.build_index(path, tmp_path / "index")
+
+    ctx = RunContext({"read_engine": "reference", "reference_index": str(tmp_path / "index"), "session": Session()})
+    assert reference.index_path(ctx, path) == index
+    opened = file_pool.open_dataset(ctx, path)
+    numpy.testing.assert_array_equal(opened.t.values, ds.t.values)
+    ctx.session.release()
+
+
+def test_missing_packages(tmp_path, monkeypatch):
+    monkeypatch.setattr(reference, "missing_packages", lambda: ["zarr"])
+    ctx = RunContext({"read_engine": "reference", "reference_index": str(tmp_path), "session": Session()})
+    with pytest.raises(SystemExit):
+        file_pool.open_dataset(ctx, tmp_path / "t.nc")
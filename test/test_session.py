@@ -0,0 +1,77 @@
+import numpy
+import pytest
+import xarray as xr
+
+from era5grib import parallel
+from era5grib.config import RunContext
+from era5grib.data_handling import file_pool
+from era5grib.data_handling.rectilinear import RectilinearRegridder
+from era5grib.session import Session
+
+
+def grid(lat, lon):
+    lat2, lon2 = numpy.meshgrid(lat, lon, indexing="ij")
+    return xr.DataArray(2 * lat2 + 0.5 * lon2, coords={"latitude": lat, "longitude": lon}, dims=["latitude", "longitude"], name="f")
+
+
+def test_release_only_affects_own_build(tmp_path):
+    src = grid(numpy.arange(-20, -30.05, -0.1), numpy.arange(140, 150.05, 0.1))
+    tgt = grid(numpy.arange(-21, -29.01, -0.25), numpy.arange(141, 149.01, 0.25))
+    path = tmp_path / "f.nc"
+    src.to_netcdf(path)
+
+    sessions = [Session(), Session()]
+    outs = []
+    for s in sessions:
+        ctx = RunContext({"session": s})
+        field = file_pool.open_dataset(ctx, path).f.chunk({"latitude": 50})
+        # Weights are shared lazily, when the regridder is applied
+        outs.append(RectilinearRegridder(src, tgt, "bilinear", shared=s.shared)(field))
+
+    sessions[0].release()
+    assert sessions[0].files.stats()["open"] == 0
+    assert sessions[1].files.stats()["open"] == 1
+    numpy.testing.assert_allclose(outs[1].values, tgt.values, rtol=1e-10)
+    with pytest.raises(KeyError):
+        outs[0].compute()
+    sessions[1].release()
+
+
+class FakeClient:
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+
+    def register_worker_plugin(self, plugin):
+        pass
+
+    def forward_logging(self):
+        pass
+
+    def shutdown(self):
+        pass
+
+
+@pytest.mark.parametrize("threads,workers", [(1, 2), (2, 1), (4, 1)])
+def test_cluster_threads_per_worker(monkeypatch, threads, workers):
+    monkeypatch.delenv("PBS_ENVIRONMENT", raising=False)
+    monkeypatch.setattr(parallel, "Client", FakeClient)
+    manager = parallel.DaskClusterManager(threads)
+    with manager:
+        assert manager.client.kwargs["threads_per_worker"] == threads
+        assert manager.client.kwargs["n_workers"] == workers
+    assert manager.client is None
+
+
+def test_worker_threads():
+    assert parallel.worker_threads(RunContext({})) == 1
+    assert parallel.worker_threads(RunContext({"read_engine": "reference"})) == 4
+    assert parallel.worker_threads(RunContext({"read_engine": "reference", "threads_per_worker": 2})) == 2
+
+
+def test_task_count():
+    da = grid(numpy.arange(10.0), numpy.arange(8.0))
+    assert parallel.task_count(da) == 0
+    chunked = da.chunk({"latitude": 5, "longitude": 4})
+    assert parallel.task_count(chunked) >= 4
+    # Each operation adds a task per chunk
+    assert parallel.task_count((chunked + 1).to_dataset()) == parallel.task_count(chunked) + 4
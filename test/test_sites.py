@@ -0,0 +1,42 @@
+import numpy
+import xarray as xr
+
+from era5grib.sites import SiteInterpolator, read_sites, site_domain
+
+
+def grid(lat, lon):
+    lat2, lon2 = numpy.meshgrid(lat, lon, indexing="ij")
+    return xr.DataArray(
+        2 * lat2 + 0.5 * lon2, coords={"latitude": lat, "longitude": lon}, dims=["latitude", "longitude"], name="f"
+    )
+
+
+def test_linear_field():
+    src = grid(numpy.arange(-20, -40.05, -0.25), numpy.arange(140, 160.05, 0.25))
+    sites = {"a": (-25.1, 145.3), "b": (-33.87, 151.21)}
+
+    out = SiteInterpolator(sites)(src.chunk({"latitude": 20, "longitude": 20}))
+    assert out.dims == ("site",)
+    assert list(out.site.values) == ["a", "b"]
+    numpy.testing.assert_allclose(out.values, [2 * lat + 0.5 * lon for lat, lon in sites.values()], rtol=1e-10)
+
+
+def test_missing_corners():
+    # Land-only data next to the coast - only the land corners are used
+    src = grid(numpy.array([-30.0, -31.0]), numpy.array([150.0, 151.0]))
+    src[:, 1] = numpy.nan
+
+    out = SiteInterpolator({"coast": (-30.5, 150.5)})(src)
+    numpy.testing.assert_allclose(out.values, [2 * -30.5 + 0.5 * 150])
+
+
+def test_read_sites(tmp_path):
+    fn = tmp_path / "sites.csv"
+    fn.write_text("name,lat,lon\n# comment\nsyd, -33.87, 151.21\nlon,51.5,-0.13\n")
+    sites = read_sites(fn)
+    assert sites == {"syd": (-33.87, 151.21), "lon": (51.5, -0.13)}
+
+    # Crosses the Greenwich meridian the long way round
+    lat_range, lon_range = site_domain(sites)
+    assert lat_range == slice(51.5, -33.87)
+    assert isinstance(lon_range, tuple)
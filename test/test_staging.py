@@ -0,0 +1,65 @@
+import fcntl
+import os
+
+import numpy
+import pandas
+import xarray as xr
+
+from era5grib.config import RunContext
+from era5grib.data_handling import staging
+from era5grib.session import Session
+
+
+def archive_file(path):
+    time = pandas.date_range("2020-01-01", periods=6, freq="h")
+    lat = numpy.arange(10.0, -10.5, -1.0)
+    lon = numpy.arange(0.0, 20.0, 1.0)
+    da = xr.DataArray(
+        numpy.random.rand(time.size, 2, lat.size, lon.size).astype("f4"),
+        coords={"time": time, "level": [850.0, 500.0], "latitude": lat, "longitude": lon},
+        dims=["time", "level", "latitude", "longitude"],
+        name="t",
+    )
+    da.to_netcdf(path)
+    return time
+
+
+def test_hit_and_miss(tmp_path):
+    src = tmp_path / "t.nc"
+    time = archive_file(src)
+    ctx = RunContext({"staging_cache": str(tmp_path / "cache"), "session": Session()})
+    domain = (slice(5.0, -5.0), slice(2.0, 8.0))
+
+    ds = staging.open_staged(ctx, src, "t", domain, time[1:4], [850.0])
+    assert dict(ds.t.sizes) == {"time": 3, "level": 1, "latitude": 11, "longitude": 7}
+    staging.open_staged(ctx, src, "t", domain, time[1:4], [850.0])
+    assert staging.stats(ctx) == {"hits": 1, "misses": 1}
+
+    # The key changes with the time and level selection
+    staging.open_staged(ctx, src, "t", domain, time[2:4], [850.0])
+    staging.open_staged(ctx, src, "t", domain, time[1:4], [850.0, 500.0])
+    assert staging.stats(ctx) == {"hits": 1, "misses": 3}
+    assert len(list((tmp_path / "cache").glob("*.nc"))) == 3
+    ctx.session.release()
+
+    # Stats belong to the session
+    assert staging.stats(RunContext({"session": Session()})) == {"hits": 0, "misses": 0}
+
+
+def test_evict_respects_budget_and_pins(tmp_path):
+    for i, name in enumerate("abc"):
+        f = tmp_path / f"{name}.nc"
+        f.write_bytes(b"x" * 100)
+        os.utime(f, (i, i))
+    ctx = RunContext({"staging_cache_size": 150})
+
+    with open(tmp_path / "b.nc", "rb") as pin:
+        fcntl.flock(pin, fcntl.LOCK_SH)
+        staging.evict(ctx, tmp_path)
+    # Oldest first, skipping the pinned entry
+    assert sorted(f.name for f in tmp_path.glob("*.nc")) == ["b.nc"]
+
+    (tmp_path / "c.nc").write_bytes(b"x" * 100)
+    os.utime(tmp_path / "c.nc", (5, 5))
+    staging.evict(ctx, tmp_path)
+    assert sorted(f.name for f in tmp_path.glob("*.nc")) == ["c.nc"]
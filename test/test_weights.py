@@ -0,0 +1,81 @@
+import numpy
+import pytest
+import xarray as xr
+
+from era5grib import domain
+from era5grib.data_handling import weights
+
+
+def global_grid(spacing, f=None):
+    nlat, nlon = weights.global_shape(spacing)
+    lat = 90 - numpy.arange(nlat) * spacing
+    lon = numpy.arange(nlon) * spacing
+    lat2, lon2 = numpy.meshgrid(lat, lon, indexing="ij")
+    data = numpy.zeros_like(lat2) if f is None else f(lat2, lon2)
+    return xr.DataArray(data, coords={"latitude": lat, "longitude": lon}, dims=["latitude", "longitude"])
+
+
+def stencil(lat, lon):
+    # Each ERA5 point takes the mean of the two ERA5-Land points either side
+    # of it in longitude, wrapping around Greenwich
+    _, src_nlon = weights.global_shape(weights.SOURCE_SPACING)
+    ilat = numpy.rint((90 - lat) / weights.TARGET_SPACING).astype(int) * 25 // 10
+    ilon = numpy.rint((lon % 360) / weights.TARGET_SPACING).astype(int) * 25 // 10
+    return ilat, (ilon - 1) % src_nlon, (ilon + 1) % src_nlon
+
+
+@pytest.fixture
+def weight_file(tmp_path, monkeypatch):
+    rows, cols = [], []
+    _, src_nlon = weights.global_shape(weights.SOURCE_SPACING)
+    tgt = global_grid(weights.TARGET_SPACING)
+    for region in [(slice(-9.0, -21.0), slice(139.0, 151.0)), (slice(-9.0, -21.0), (slice(349.0, None), slice(None, 11.0)))]:
+        t = domain.select(tgt, *region)
+        lat2, lon2 = numpy.meshgrid(t.latitude.values, t.longitude.values, indexing="ij")
+        row = weights.grid_index(t.latitude.values, t.longitude.values, weights.TARGET_SPACING)
+        ilat, west, east = stencil(lat2.ravel(), lon2.ravel())
+        rows += [row, row]
+        cols += [ilat * src_nlon + west, ilat * src_nlon + east]
+    rows, cols = numpy.concatenate(rows), numpy.concatenate(cols)
+    path = tmp_path / "weights.nc"
+    # Indices in the weight file are 1-based
+    xr.Dataset({"row": ("n", rows + 1), "col": ("n", cols + 1), "S": ("n", numpy.full(rows.size, 0.5))}).to_netcdf(path)
+
+    load = weights.load_weights
+    monkeypatch.setattr(weights, "load_weights", lambda: load(str(path)))
+    yield path
+    load.cache_clear()
+
+
+@pytest.mark.parametrize(
+    "dom, stencil_lons",
+    [
+        ((slice(-10.0, -20.0), slice(140.0, 150.0)), slice(139.9, 150.1)),
+        ((slice(-10.0, -20.0), (slice(350.0, None), slice(None, 10.0))), (slice(349.9, None), slice(None, 10.1))),
+    ],
+    ids=["contiguous", "split"],
+)
+def test_subset_regridder(weight_file, dom, stencil_lons):
+    src_dom = weights.source_domain(dom)
+    assert domain.is_split(src_dom[1]) == domain.is_split(dom[1])
+    # The stencil reaches a source point beyond the domain each way
+    assert domain.contains(src_dom, (dom[0], stencil_lons))
+
+    f = lambda lat, lon: numpy.sin(numpy.deg2rad(3 * lat)) + numpy.cos(numpy.deg2rad(5 * lon))  # noqa: E731
+    src_global = global_grid(weights.SOURCE_SPACING, f)
+    src = domain.select(src_global, *src_dom)
+    tgt = domain.select(global_grid(weights.TARGET_SPACING), *dom)
+
+    out = weights.subset_regridder(src, tgt)(src)
+    lat2, lon2 = numpy.meshgrid(tgt.latitude.values, tgt.longitude.values, indexing="ij")
+    ilat, iwest, ieast = stencil(lat2, lon2)
+    expected = 0.5 * (src_global.values[ilat, iwest] + src_global.values[ilat, ieast])
+    numpy.testing.assert_allclose(out.values, expected, rtol=1e-12)
+
+
+def test_subset_regridder_needs_source_points(weight_file):
+    dom = (slice(-10.0, -20.0), slice(140.0, 150.0))
+    src = domain.select(global_grid(weights.SOURCE_SPACING), slice(-10.0, -20.0), slice(140.0, 150.0))
+    tgt = domain.select(global_grid(weights.TARGET_SPACING), *dom)
+    with pytest.raises(SystemExit):
+        weights.subset_regridder(src, tgt)